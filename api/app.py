@@ -24,12 +24,23 @@ theory = Theory(
         d_model=D_MODEL,
         dff=DFF,
         num_heads=NUM_HEADS,
-        dropout_rate=DROPOUT_RATE
+        dropout_rate=DROPOUT_RATE,
+        max_seq_len=MAX_SEQ_LEN
     ),
     output_dir_path=MODEL_DIR,
     train_dataset_path=TRAIN_DATASET_PATH,
     valid_dataset_path=VALID_DATASET_PATH,
     data_map_path=DATA_MAP_PATH,
+    nn_batch_size=NN_BATCH_SIZE,
+    inference=True,
+    serving_model_path=SERVING_MODEL_DIR,
+    beam_width=BEAM_WIDTH,
+    length_penalty=LENGTH_PENALTY,
+    max_length_ratio=MAX_LENGTH_RATIO,
+    max_length_offset=MAX_LENGTH_OFFSET,
+    nn_cache_path=NN_CACHE_PATH,
+    nn_cache_max_entries=NN_CACHE_MAX_ENTRIES,
+    nn_precision=NN_PRECISION,
     debug=DEBUG
 )
 
@@ -10,6 +10,7 @@ DEBUG = bool(int(__debug)) if __debug is not None else False
 
 # Neural network
 MODEL_DIR = 'model'
+SERVING_MODEL_DIR = os.environ.get('SERVING_MODEL_DIR')
 TRAIN_DATASET_PATH = os.environ.get('TRAIN_DATASET_PATH')
 VALID_DATASET_PATH = os.environ.get('VALID_DATASET_PATH')
 DATA_MAP_PATH = os.environ.get('DATA_MAP_PATH')
@@ -20,6 +21,16 @@ D_MODEL = int(os.environ.get('D_MODEL'))
 DFF = int(os.environ.get('DFF'))
 NUM_HEADS = int(os.environ.get('NUM_HEADS'))
 DROPOUT_RATE = float(os.environ.get('DROPOUT_RATE'))
+MAX_SEQ_LEN = int(os.environ.get('MAX_SEQ_LEN', 512))
+__nn_batch_size = os.environ.get('NN_BATCH_SIZE')
+NN_BATCH_SIZE = int(__nn_batch_size) if __nn_batch_size is not None else None
+BEAM_WIDTH = int(os.environ.get('BEAM_WIDTH', 1))
+LENGTH_PENALTY = float(os.environ.get('LENGTH_PENALTY', 0.6))
+MAX_LENGTH_RATIO = float(os.environ.get('MAX_LENGTH_RATIO', 3.0))
+MAX_LENGTH_OFFSET = int(os.environ.get('MAX_LENGTH_OFFSET', 32))
+NN_CACHE_PATH = os.environ.get('NN_CACHE_PATH')
+NN_CACHE_MAX_ENTRIES = int(os.environ.get('NN_CACHE_MAX_ENTRIES', 100000))
+NN_PRECISION = os.environ.get('NN_PRECISION')
 
 # AWS
 AWS_ACCESS_KEY_ID = os.environ.get('AWS_ACCESS_KEY_ID')
@@ -0,0 +1,215 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import queue
+import shutil
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from os import path
+
+from cli import log
+from cli_constants import DEFAULT_HYPERPARAMS
+from theory.nn.datasets import has_token_shards
+
+TRAIN_SCRIPT_PATH = path.join(path.dirname(path.abspath(__file__)), 'train.py')
+
+# Get command line arguments. Unknown arguments are passed on to every trial.
+parser = argparse.ArgumentParser(
+    epilog='Other arguments are passed to "train.py" for every trial (e.g. "--batch-size=64 --disable-wandb").')
+parser.add_argument('-o', '--out', help='Sweep directory', default='sweep')
+parser.add_argument('-l', '--lvp', help='Language-version pair', required=True)
+parser.add_argument('--base-data-path',
+                    help='Base dataset path (e.g. "data")', default='data')
+parser.add_argument('--train-data', help='Training dataset file path')
+parser.add_argument('--valid-data', help='Validation dataset file path')
+parser.add_argument('--layers', help='Comma-separated numbers of layers to try',
+                    default=str(DEFAULT_HYPERPARAMS.num_layers))
+parser.add_argument('--d-model', help='Comma-separated d-model sizes to try', default=str(DEFAULT_HYPERPARAMS.d_model))
+parser.add_argument('--dff', help='Comma-separated dense feed-forward network sizes to try',
+                    default=str(DEFAULT_HYPERPARAMS.dff))
+parser.add_argument('--heads', help='Comma-separated numbers of attention heads to try',
+                    default=str(DEFAULT_HYPERPARAMS.num_heads))
+parser.add_argument('--parallel', help='Number of trials to run concurrently', type=int, default=1)
+parser.add_argument('--cores-per-trial',
+                    help='Number of CPU cores pinned to each trial (defaults to the available cores divided by '
+                         '"--parallel")', type=int)
+parser.add_argument('--max-steps', help='Number of optimizer steps to train each trial for', type=int)
+parser.add_argument('--max-time', help='Number of seconds to train each trial for', type=float)
+parser.add_argument('--benchmark-samples',
+                    help='Number of validation sequences to measure the decoding latency of each trial on', type=int,
+                    default=64)
+args, train_args = parser.parse_known_args()
+
+# Split the available CPU cores into a group per concurrent trial
+cores = sorted(os.sched_getaffinity(0))
+cores_per_trial = args.cores_per_trial if args.cores_per_trial is not None else max(1, len(cores) // args.parallel)
+
+if cores_per_trial * args.parallel > len(cores):
+    raise Exception(f'{args.parallel} trials of {cores_per_trial} cores need more than the {len(cores)} available '
+                    f'cores.')
+
+core_groups = queue.Queue()
+
+for i in range(args.parallel):
+    core_groups.put(cores[i * cores_per_trial:(i + 1) * cores_per_trial])
+
+# Dataset arguments of every "train.py" run
+data_args = [f'--lvp={args.lvp}', f'--base-data-path={args.base_data_path}']
+
+if args.train_data is not None:
+    data_args.append(f'--train-data={args.train_data}')
+
+if args.valid_data is not None:
+    data_args.append(f'--valid-data={args.valid_data}')
+
+# Build tokenizers and encode the datasets once, shared by all trials
+shared_path = path.abspath(path.join(args.out, 'shared'))
+
+if not has_token_shards(path.join(shared_path, 'preprocessed', 'train')):
+    log(f'Preprocessing datasets into "{shared_path}"...')
+    subprocess.run([sys.executable, TRAIN_SCRIPT_PATH, 'preprocess', f'--out={shared_path}'] + data_args + train_args,
+                   check=True)
+
+# Trial grid
+trials = []
+
+for num_layers, d_model, dff, num_heads in itertools.product(*(
+        [int(v) for v in values.split(',')] for values in (args.layers, args.d_model, args.dff, args.heads))):
+    if d_model % num_heads != 0:
+        log(f'Skipping d-model {d_model} with {num_heads} heads, which doesn\'t divide it.', level=logging.WARNING)
+        continue
+
+    trials.append({
+        'trial': f'l{num_layers}_d{d_model}_f{dff}_h{num_heads}',
+        'num_layers': num_layers,
+        'd_model': d_model,
+        'dff': dff,
+        'num_heads': num_heads,
+    })
+
+
+def run_trial(trial: dict) -> dict:
+    """
+    Train and benchmark a trial in a separate process, pinned to a free group of CPU cores.
+
+    :param trial: Trial hyperparameters.
+    :returns: Trial results.
+    """
+
+    trial_path = path.abspath(path.join(args.out, 'trials', trial['trial']))
+
+    # Start from scratch, rather than resuming the checkpoints and appending to the metrics of a previous sweep
+    if path.exists(trial_path):
+        log(f'Removing trial {trial["trial"]} of a previous sweep...', level=logging.WARNING)
+        shutil.rmtree(trial_path)
+
+    os.makedirs(trial_path)
+
+    # Share the tokenizer vocabularies and encoded datasets
+    for name in ('src.subwords', 'tar.subwords', 'preprocessed'):
+        os.symlink(path.join(shared_path, name), path.join(trial_path, name))
+
+    command = [sys.executable, TRAIN_SCRIPT_PATH, f'--out={trial_path}', f'--layers={trial["num_layers"]}',
+               f'--d-model={trial["d_model"]}', f'--dff={trial["dff"]}', f'--heads={trial["num_heads"]}',
+               f'--benchmark-samples={args.benchmark_samples}'] + data_args + train_args
+
+    if args.max_steps is not None:
+        command.append(f'--max-steps={args.max_steps}')
+
+    if args.max_time is not None:
+        command.append(f'--max-time={args.max_time}')
+
+    trial_cores = core_groups.get()
+
+    try:
+        log(f'Starting trial {trial["trial"]} on cores {trial_cores}...')
+
+        # Size TensorFlow's thread pools to the pinned cores
+        env = dict(os.environ, TF_NUM_INTRAOP_THREADS=str(len(trial_cores)),
+                   TF_NUM_INTEROP_THREADS=str(len(trial_cores)), OMP_NUM_THREADS=str(len(trial_cores)))
+
+        # Pinned by "taskset", since a `preexec_fn` isn't safe to run from threads
+        taskset = ['taskset', '-c', ','.join(str(core) for core in trial_cores)]
+
+        with open(path.join(trial_path, 'train.log'), 'w') as log_file:
+            returncode = subprocess.run(taskset + command, stdout=log_file, stderr=subprocess.STDOUT,
+                                        env=env).returncode
+    finally:
+        core_groups.put(trial_cores)
+
+    log(f'Trial {trial["trial"]} {"finished" if returncode == 0 else f"failed with exit code {returncode}"}.')
+
+    return {**trial, 'status': 'ok' if returncode == 0 else 'failed', **collect_results(trial_path)}
+
+
+def collect_results(trial_path: str) -> dict:
+    """
+    Collect the validation loss, throughput and decoding latency of a trial.
+
+    :param trial_path: Trial model directory.
+    :returns: Trial results. Missing results are `None`.
+    """
+
+    records = []
+    metrics_path = path.join(trial_path, 'train_metrics.jsonl')
+
+    if path.exists(metrics_path):
+        with open(metrics_path) as file:
+            records = [json.loads(line) for line in file if line.strip()]
+
+    validations = [r for r in records if 'val_loss' in r]
+    throughputs = [r['tokens_per_sec'] for r in records if 'tokens_per_sec' in r]
+    best = min(validations, key=lambda r: r['val_loss']) if validations else {}
+
+    benchmark = {}
+    benchmark_path = path.join(trial_path, 'benchmark_report.json')
+
+    if path.exists(benchmark_path):
+        with open(benchmark_path) as file:
+            benchmark = json.load(file)
+
+    return {
+        'steps': max((r['step'] for r in records), default=None),
+        'val_loss': best.get('val_loss'),
+        'val_accuracy': best.get('val_accuracy'),
+        'tokens_per_sec': sum(throughputs) / len(throughputs) if throughputs else None,
+        'decode_latency_s': benchmark.get('latency_s'),
+    }
+
+
+# Run trials
+with ThreadPoolExecutor(max_workers=args.parallel) as executor:
+    results = list(executor.map(run_trial, trials))
+
+# Mark trials on the quality/latency frontier, which no other trial beats on both validation loss and latency
+complete = [r for r in results if r['val_loss'] is not None and r['decode_latency_s'] is not None]
+
+for result in results:
+    result['frontier'] = result in complete and not any(
+        (o['val_loss'], o['decode_latency_s']) != (result['val_loss'], result['decode_latency_s']) and
+        o['val_loss'] <= result['val_loss'] and o['decode_latency_s'] <= result['decode_latency_s']
+        for o in complete)
+
+results.sort(key=lambda r: (r['val_loss'] is None, r['val_loss']))
+
+with open(path.join(args.out, 'sweep_results.json'), 'w') as file:
+    json.dump(results, file, indent=2)
+
+# Output comparison table
+columns = ['trial', 'status', 'steps', 'val_loss', 'val_accuracy', 'tokens_per_sec', 'decode_latency_s', 'frontier']
+
+
+def format_value(value) -> str:
+    if value is None:
+        return '-'
+
+    return f'{value:.4f}' if isinstance(value, float) else str(value)
+
+
+rows = [columns] + [[format_value(r[c]) for c in columns] for r in results]
+widths = [max(len(row[i]) for row in rows) for i in range(len(columns))]
+
+log('Sweep results:\n' + '\n'.join('  '.join(v.ljust(w) for v, w in zip(row, widths)) for row in rows))
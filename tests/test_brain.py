@@ -0,0 +1,162 @@
+import numpy as np
+import pytest
+import tensorflow as tf
+import tensorflow_datasets as tfds
+
+from theory.lvp import LVP
+from theory.nn.brain import Brain
+from theory.nn.hyperparams import Hyperparams
+
+
+def create_brain(model_dir_path) -> Brain:
+    """Create an inference brain with seeded random weights and small tokenizer vocabularies."""
+
+    tf.keras.utils.set_random_seed(0)
+
+    for name in ('src', 'tar'):
+        tokenizer = tfds.deprecated.text.SubwordTextEncoder.build_from_corpus(
+            ['MOVE A TO B', 'ADD 1 TO C', 'A = B;', 'C += 1;'], target_vocab_size=300)
+        tokenizer.save_to_file(str(model_dir_path / name))
+
+    hyperparams = Hyperparams(buffer_size=100, batch_size=32, num_layers=2, d_model=16, dff=32, num_heads=4,
+                              dropout_rate=0.1, epochs=1, max_seq_len=32)
+    brain = Brain(LVP.COBOL_TO_CSHARP_9, hyperparams, str(model_dir_path), enable_wandb=False, inference=True)
+
+    # Random weights tend to make each token predict itself. Tying the final layer to the negated target embedding
+    # makes the decoded tokens vary instead.
+    inp = tf.ones((1, 1), dtype=tf.int32)
+    brain.transformer((inp, inp), mask=list(Brain.create_masks(inp, inp)))
+    embedding = brain.transformer.decoder.embedding.embeddings
+    brain.transformer.final_layer.kernel.assign(-tf.transpose(embedding))
+
+    return brain
+
+
+def greedy_decode(brain: Brain, encoder_input, max_lengths):
+    """Greedily decode by running the transformer on the whole target prefix at every step."""
+
+    end_token = brain.tokenizer_tar.vocab_size + 1
+    tar = tf.fill([encoder_input.shape[0], 1], brain.tokenizer_tar.vocab_size)
+    finished = tf.zeros([encoder_input.shape[0]], dtype=tf.bool)
+
+    for step in range(max(max_lengths)):
+        predictions, _ = brain.transformer((encoder_input, tar), mask=list(Brain.create_masks(encoder_input, tar)))
+        predicted_id = tf.cast(tf.argmax(predictions[:, -1, :], axis=-1), tf.int32)
+        predicted_id = tf.where(finished, tf.zeros_like(predicted_id), predicted_id)
+        tar = tf.concat([tar, predicted_id[:, tf.newaxis]], axis=-1)
+        finished = tf.reduce_any([finished, tf.equal(predicted_id, end_token), step + 1 >= tf.constant(max_lengths)],
+                                 axis=0)
+
+    return tar[:, 1:].numpy()
+
+
+def test_greedy_decode(tmp_path):
+    """Brain's compiled greedy decoding should match decoding with full forward passes."""
+
+    brain = create_brain(tmp_path)
+    encoder_input = tf.constant([[brain.tokenizer_src.vocab_size, 5, 3, 7, brain.tokenizer_src.vocab_size + 1],
+                                 [brain.tokenizer_src.vocab_size, 2, brain.tokenizer_src.vocab_size + 1, 0, 0]])
+
+    # Shorter than the shortest repetition loop that stops decoding
+    max_lengths = [12, 5]
+    output_ids, _ = brain._Brain__decode(encoder_input, tf.constant(max_lengths))
+    expected = greedy_decode(brain, encoder_input, max_lengths)
+
+    np.testing.assert_array_equal(output_ids.numpy(), expected[:, :output_ids.shape[1]])
+    assert not expected[:, output_ids.shape[1]:].any()
+
+
+def test_beam_search_decode_width_1(tmp_path):
+    """Brain's beam search with a single beam should decode the same tokens as greedy decoding."""
+
+    brain = create_brain(tmp_path)
+    encoder_input = tf.constant([[brain.tokenizer_src.vocab_size, 5, 3, 7, brain.tokenizer_src.vocab_size + 1],
+                                 [brain.tokenizer_src.vocab_size, 2, brain.tokenizer_src.vocab_size + 1, 0, 0]])
+    max_lengths = tf.constant([30, 20])
+
+    output_ids, stop_reasons = brain._Brain__decode(encoder_input, max_lengths)
+    beam_output_ids, beam_stop_reasons = brain._Brain__beam_search(encoder_input, max_lengths, 1, 0.6)
+
+    np.testing.assert_array_equal(beam_output_ids.numpy(), output_ids.numpy())
+    np.testing.assert_array_equal(beam_stop_reasons.numpy(), stop_reasons.numpy())
+
+
+def test_quantize(tmp_path):
+    """Brain.quantize() should decode greedily with an INT8 quantized decoder approximating the float decoder."""
+
+    brain = create_brain(tmp_path)
+
+    # Inputs of random tokens and lengths
+    rng = np.random.default_rng(0)
+    encoder_input = np.zeros((16, 8), dtype=np.int32)
+    for row in range(16):
+        length = rng.integers(1, 7)
+        encoder_input[row, 0] = brain.tokenizer_src.vocab_size
+        encoder_input[row, 1:length + 1] = rng.integers(1, brain.tokenizer_src.vocab_size, length)
+        encoder_input[row, length + 1] = brain.tokenizer_src.vocab_size + 1
+
+    max_lengths = np.full(16, 12, dtype=np.int32)
+    max_lengths[0] = 3
+    expected, expected_stop_reasons = brain._Brain__decode(tf.constant(encoder_input), tf.constant(max_lengths))
+
+    report = brain.quantize(['MOVE A TO B', 'ADD 1 TO C'])
+    assert report['samples'] == 2
+    assert report['quantized_model_bytes'] > 0
+
+    output_ids, stop_reasons = brain.quantized_decoder(encoder_input, max_lengths)
+    np.testing.assert_array_equal(stop_reasons.numpy(), expected_stop_reasons.numpy())
+    assert output_ids.shape == expected.shape
+    assert not output_ids.numpy()[0, 3:].any()
+    assert (output_ids.numpy() == expected.numpy()).mean() >= 0.9
+
+
+def test_quantized_serving_model(tmp_path):
+    """Serving models exported by a quantized Brain should decode greedily with the quantized decoder."""
+
+    brain = create_brain(tmp_path)
+    inputs = ['MOVE A TO B', 'ADD 1 TO C', 'MOVE C TO A']
+    brain.quantize(inputs)
+    expected = brain.translate_batch(inputs)
+
+    export_dir_path = tmp_path / 'serving'
+    brain.export(str(export_dir_path))
+
+    serving_brain = Brain(LVP.COBOL_TO_CSHARP_9, brain.hyperparams, str(tmp_path), enable_wandb=False,
+                          serving_model_path=str(export_dir_path))
+    serving_brain.restore_checkpoint()
+
+    assert serving_brain.quantized_decoder is not None
+    assert serving_brain.model_id.endswith(':int8')
+    assert serving_brain.translate_batch(inputs) == expected
+
+
+def test_preprocessed_datasets_stale(tmp_path):
+    """Brain should only train on preprocessed datasets encoded from the current datasets."""
+
+    train_dataset_path = tmp_path / 'train.csv'
+    valid_dataset_path = tmp_path / 'valid.csv'
+    train_dataset_path.write_text('"MOVE %mask_0% TO %mask_1%","%mask_1%.Set(%mask_0%);"\n')
+    valid_dataset_path.write_text('"DISPLAY %mask_0%","Console.WriteLine(%mask_0%);"\n')
+
+    def load_brain() -> Brain:
+        hyperparams = Hyperparams(buffer_size=100, batch_size=32, num_layers=1, d_model=16, dff=32, num_heads=4,
+                                  dropout_rate=0.1, epochs=1, max_seq_len=32)
+        return Brain(LVP.COBOL_TO_CSHARP_9, hyperparams, str(tmp_path / 'output'), enable_wandb=False,
+                     train_dataset_path=str(train_dataset_path), valid_dataset_path=str(valid_dataset_path))
+
+    load_brain().preprocess(num_shards=2)
+    assert not load_brain().preprocessed_stale
+
+    # Changed after preprocessing
+    with open(train_dataset_path, 'a') as file:
+        file.write('"PERFORM %mask_0%","%mask_0%();"\n')
+
+    brain = load_brain()
+    assert brain.preprocessed_stale
+    assert len(list(brain.train_dataset)) == 2
+
+    with pytest.raises(Exception, match='Run the "preprocess" command again'):
+        brain.train()
+
+    brain.preprocess(num_shards=2)
+    assert not load_brain().preprocessed_stale
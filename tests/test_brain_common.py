@@ -0,0 +1,63 @@
+import tensorflow as tf
+
+from theory.nn.brain_common import detect_loops, einsum_attention, loop_span, scaled_dot_product_attention
+from theory.nn.mha import MultiHeadAttention
+
+
+def test_detect_loops():
+    """detect_loops() should only flag sequences ending in a pattern repeated over a long enough span."""
+
+    window = loop_span(4, 4, 16)
+    recent = tf.constant([
+        [5, 6, 7, 8] * (window // 4),
+        [1] * (window - 1) + [2],
+        list(range(window)),
+    ])
+
+    assert detect_loops(recent, window, 4, 4, 16).numpy().tolist() == [True, False, False]
+
+    # Not enough tokens have been generated yet to fill the span
+    assert not detect_loops(recent, 8, 4, 4, 16).numpy().any()
+
+
+def test_scaled_dot_product_attention_half_precision():
+    """scaled_dot_product_attention() should mask keys without overflowing in 16-bit types."""
+
+    for dtype in (tf.bfloat16, tf.float16):
+        q = tf.ones((1, 2, 4), dtype=dtype)
+        k = v = tf.reshape(tf.range(12, dtype=dtype), (1, 3, 4))
+        mask = tf.constant([[[0., 0., 1.]]])
+
+        output, attention_weights = scaled_dot_product_attention(q, k, v, mask)
+
+        assert output.dtype == dtype and attention_weights.dtype == dtype
+        assert tf.reduce_all(tf.math.is_finite(tf.cast(output, tf.float32)))
+        assert float(tf.reduce_max(attention_weights[..., 2])) == 0
+
+
+def test_einsum_attention():
+    """einsum_attention() should match scaled_dot_product_attention() in its own layout."""
+
+    q = tf.random.stateless_normal((2, 3, 4, 8), seed=(1, 2))  # (batch_size, seq_len_q, num_heads, depth)
+    k = tf.random.stateless_normal((2, 4, 5, 8), seed=(3, 4))  # (batch_size, num_heads, seq_len_k, depth)
+    v = tf.random.stateless_normal((2, 4, 5, 8), seed=(5, 6))
+    mask = tf.constant([[0., 0., 0., 1., 1.], [0., 0., 0., 0., 0.]])[:, tf.newaxis, tf.newaxis, :]
+
+    expected, _ = scaled_dot_product_attention(tf.transpose(q, perm=[0, 2, 1, 3]), k, v, mask)
+    output = einsum_attention(q, k, v, mask)
+
+    assert output.shape == (2, 3, 4, 8)
+    assert float(tf.reduce_max(tf.abs(tf.transpose(expected, perm=[0, 2, 1, 3]) - output))) < 1e-5
+
+
+def test_multi_head_attention_without_attention_weights():
+    """MultiHeadAttention should give the same output whether or not it returns the attention weights."""
+
+    mha = MultiHeadAttention(16, 4)
+    x = tf.random.stateless_normal((2, 3, 16), seed=(1, 2))
+
+    expected, attention_weights = mha(x, x, x, None)
+    output, no_attention_weights = mha(x, x, x, None, return_attention_weights=False)
+
+    assert attention_weights.shape == (2, 4, 3, 3) and no_attention_weights is None
+    assert float(tf.reduce_max(tf.abs(expected - output))) < 1e-5
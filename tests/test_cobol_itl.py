@@ -0,0 +1,26 @@
+from theory.lvp import LVP
+from theory.lvps.cobol_to_csharp_9.itl import COBOLToCSharp9ITL
+from theory.lvps.cobol_to_csharp_9.store import COBOLToCSharp9Store
+from theory.lvps.cobol_to_csharp_9.template_processor import COBOLToCSharp9TemplateProcessor, TEMPL_FILE_VARS, \
+    TEMPL_FILE_VAR_ASSIGNMENTS
+from theory.veil import Veil
+
+
+def test_translate_file_select(tmp_path):
+    """COBOLToCSharp9ITL.translate() should add SELECT file vars to the template instead of the translated line."""
+
+    data_map_path = tmp_path / 'map.csv'
+    data_map_path.write_text('source,target\n')
+
+    veil = Veil(LVP.COBOL_TO_CSHARP_9)
+    template_processor = COBOLToCSharp9TemplateProcessor()
+    store = COBOLToCSharp9Store(template_processor, veil)
+    itl = COBOLToCSharp9ITL(str(data_map_path), veil, store, template_processor, None)
+
+    veil.tokens['%mask_0%'] = 'InFile'
+    veil.tokens['%mask_1%'] = 'input.txt'
+    veil.current_relative_tokens = ['%mask_0%', '%mask_1%']
+
+    assert itl.translate('SELECT %mask_0% ASSIGN TO %mask_1%') == ''
+    assert template_processor.tag_content[TEMPL_FILE_VARS] == ['private COBOLFile InFile;']
+    assert template_processor.tag_content[TEMPL_FILE_VAR_ASSIGNMENTS] == ['InFile = new COBOLFile(@"InFile");']
@@ -0,0 +1,111 @@
+import tensorflow_datasets as tfds
+
+from theory.core import Theory
+from theory.lvp import LVP
+from theory.nn.hyperparams import Hyperparams
+
+COBOL_SOURCE = '''       IDENTIFICATION DIVISION.
+       PROGRAM-ID. HELLO.
+       DATA DIVISION.
+       WORKING-STORAGE SECTION.
+       01 WS-A PIC 9(4) VALUE 1.
+       01 WS-B PIC 9(4) VALUE 2.
+       PROCEDURE DIVISION.
+       MAIN-PARA.
+           DISPLAY WS-A.
+           DISPLAY WS-B.
+           DISPLAY WS-A WS-B.
+           DISPLAY WS-A.
+           STOP RUN.
+'''
+
+# Repeats lines translated by stateless ITL rules (MOVE), stateful ITL rules (condition items, which depend on their
+# parent item) and the neural network (DISPLAY)
+COBOL_REPEATED_SOURCE = '''       IDENTIFICATION DIVISION.
+       PROGRAM-ID. HELLO.
+       DATA DIVISION.
+       WORKING-STORAGE SECTION.
+       01 WS-A PIC 9(4) VALUE 1.
+           88 WS-A-ON VALUE 1.
+       01 WS-B PIC 9(4) VALUE 2.
+           88 WS-B-ON VALUE 1.
+       PROCEDURE DIVISION.
+       MAIN-PARA.
+           DISPLAY WS-A.
+           MOVE WS-A TO WS-B.
+           DISPLAY WS-A.
+           MOVE WS-A TO WS-B.
+           STOP RUN.
+'''
+
+# Neural network translations of the masked lines of `COBOL_SOURCE` that the ITL can't translate.
+# The translation of "DISPLAY WS-A WS-B" refers to a mask token the line doesn't have, so unmasking it fails.
+NN_TRANSLATIONS = {
+    '%mask_0% %mask_1% PIC 9(%mask_2%) VALUE %mask_3%': '%mask_1% = new COBOLVar(size: %mask_2%, value: %mask_3%);',
+    'DISPLAY %mask_0%': 'Console.WriteLine(%mask_0%);',
+    'DISPLAY %mask_0% %mask_1%': 'Console.WriteLine(%mask_0% + %mask_5%);',
+}
+
+
+def translate(tmp_path, nn_batch_size, source: str = COBOL_SOURCE, reuse_translations: bool = True) -> str:
+    """
+    Translate COBOL source with neural network translations from `NN_TRANSLATIONS`.
+
+    :returns: Translated file contents.
+    """
+
+    data_path = tmp_path / 'data'
+    model_path = tmp_path / 'models' / 'cobol_to_csharp_9'
+    data_path.mkdir(exist_ok=True)
+    model_path.mkdir(parents=True, exist_ok=True)
+    (data_path / 'cobol_to_csharp_9_map.csv').write_text('source,target\n"STOP RUN","return;"\n')
+
+    for name in ('src', 'tar'):
+        tokenizer = tfds.deprecated.text.SubwordTextEncoder.build_from_corpus(['MOVE A TO B'], target_vocab_size=300)
+        tokenizer.save_to_file(str(model_path / name))
+
+    hyperparams = Hyperparams(buffer_size=100, batch_size=32, num_layers=2, d_model=16, dff=32, num_heads=4,
+                              dropout_rate=0.1, epochs=1, max_seq_len=32)
+    theory = Theory(LVP.COBOL_TO_CSHARP_9, hyperparams, str(tmp_path / 'models'), base_dataset_path=str(data_path),
+                    nn_batch_size=nn_batch_size, reuse_translations=reuse_translations, inference=True)
+    theory.brain.translate = lambda line: NN_TRANSLATIONS[line]
+    theory.brain.translate_batch = lambda lines, batch_size: [NN_TRANSLATIONS[line] for line in lines]
+
+    input_file_path = tmp_path / 'hello.cbl'
+    output_file_path = tmp_path / f'hello_{nn_batch_size}_{reuse_translations}.cs'
+    input_file_path.write_text(source)
+    theory.translate(str(input_file_path), str(output_file_path),
+                     request_data={'cobol_copybook_ext': None, 'cobol_default_copybooks_path': None})
+
+    return output_file_path.read_text()
+
+
+def test_translate_deferred(tmp_path):
+    """Theory.translate() should output the same file whether neural network translations are deferred or not."""
+
+    output = translate(tmp_path, None)
+
+    # Translations held by the store and the template processor
+    assert 'WsA = new COBOLVar(size: 4, value: 1);' in output
+    assert 'WsB = new COBOLVar(size: 4, value: 2);' in output
+
+    assert output.count('Console.WriteLine(WsA);') == 2
+    assert 'Console.WriteLine(WsB);' in output
+    assert '// DISPLAY WS-A WS-B\t// [Turring Theory] ERROR: Failed to translate.' in output
+
+    for nn_batch_size in (1, 2, 8):
+        assert translate(tmp_path, nn_batch_size) == output
+
+
+def test_translate_reuse_translations(tmp_path):
+    """Theory.translate() should output the same file whether translations of identical lines are reused or not."""
+
+    output = translate(tmp_path, None, source=COBOL_REPEATED_SOURCE)
+
+    # Identical condition items are translated for their own parent items
+    assert 'WsAOn = new COBOLVar(\n\tnull,\n\tsize: 1,\n\tconditionVar: WsA,' in output
+    assert 'WsBOn = new COBOLVar(\n\tnull,\n\tsize: 1,\n\tconditionVar: WsB,' in output
+
+    assert output.count('Console.WriteLine(WsA);') == 2
+    assert output.count('WsB.Set(WsA);') == 2
+    assert translate(tmp_path, None, source=COBOL_REPEATED_SOURCE, reuse_translations=False) == output
@@ -0,0 +1,19 @@
+import tensorflow as tf
+
+from theory.nn.custom_schedule import CustomSchedule
+
+
+def test_integer_step():
+    """CustomSchedule should accept the optimizer's integer step counter."""
+
+    schedule = CustomSchedule(128, warmup_steps=10)
+
+    assert float(schedule(tf.constant(5, dtype=tf.int64))) == float(schedule(tf.constant(5.0)))
+
+
+def test_warmup():
+    """The learning rate should increase during warm-up and decay afterwards."""
+
+    schedule = CustomSchedule(128, warmup_steps=10)
+
+    assert float(schedule(5)) < float(schedule(10)) > float(schedule(20))
@@ -0,0 +1,112 @@
+import csv
+
+import tensorflow as tf
+
+from theory.nn.datasets import batch_by_length, bucket_batch_sizes, has_token_shards, load_token_shards, \
+    prepare_dataset, read_examples, sample_corpus, split_example, write_token_shards
+
+
+def test_token_shards(tmp_path):
+    """Examples written by write_token_shards() should be read back by load_token_shards()."""
+
+    file_prefix = str(tmp_path / 'train')
+    examples = [([1, 2, 3], [4, 5]), ([6], [7, 8, 9]), ([10, 11], [12])]
+
+    assert not has_token_shards(file_prefix)
+    assert write_token_shards(examples, file_prefix, num_shards=2) == 3
+    assert has_token_shards(file_prefix)
+
+    loaded = [(inp.numpy().tolist(), tar.numpy().tolist()) for inp, tar in load_token_shards(file_prefix)]
+    assert sorted(loaded) == sorted(examples)
+
+
+def test_bucket_batch_sizes():
+    """Longer buckets should get proportionally smaller batches."""
+
+    assert bucket_batch_sizes([8, 16, 32], max_seq_len=128, tokens_per_batch=256) == [32, 16, 8, 2]
+    assert bucket_batch_sizes([8], max_seq_len=1024, tokens_per_batch=256) == [32, 1]
+
+
+def test_batch_by_length():
+    """Bucketed batches should only contain sequences of similar length."""
+
+    examples = [([1] * n, [2] * n) for n in (2, 10, 3, 12, 2, 11)]
+    dataset = tf.data.Dataset.from_generator(
+        lambda: iter(examples),
+        output_signature=(tf.TensorSpec([None], tf.int64), tf.TensorSpec([None], tf.int64)))
+
+    batches = [tuple(inp.shape)
+               for inp, _ in batch_by_length(dataset, 2, 16, bucket_boundaries=[8], tokens_per_batch=24)]
+
+    assert sorted(batches) == [(1, 10), (1, 11), (1, 12), (3, 3)]
+
+
+def test_sample_corpus(tmp_path):
+    """sample_corpus() should keep aligned source/target pairs and count the whole corpus."""
+
+    file_path = tmp_path / 'train.csv'
+    file_path.write_text(''.join(f'src {i},"tar, {i}"\n' for i in range(100)))
+
+    src, tar, stats = sample_corpus(str(file_path), sample_size=1000)
+    assert src == [f'src {i}' for i in range(100)]
+    assert tar == [f'tar, {i}' for i in range(100)]
+
+    src, tar, stats = sample_corpus(str(file_path), sample_size=10)
+    assert len(set(src)) == 10
+    assert [s.replace('src', 'tar,') for s in src] == tar
+    assert stats['examples'] == 100
+    assert stats['sampled_examples'] == 10
+    assert stats['target']['max_length'] == len('tar, 99')
+
+
+def test_read_examples(tmp_path):
+    """read_examples() should stream examples and add the corpus statistics once they are all read."""
+
+    file_path = tmp_path / 'train.csv'
+    file_path.write_text('a,"B, c"\n\nde,f\n')
+    stats = dict()
+    examples = read_examples(str(file_path), stats)
+
+    assert next(examples) == ('a', 'B, c')
+    assert stats == {}
+    assert list(examples) == [('de', 'f')]
+    assert stats['examples'] == 2
+    assert stats['source'] == {'characters': 3, 'mean_length': 1.5, 'max_length': 2}
+
+
+def test_prepare_dataset(tmp_path):
+    """prepare_dataset() should deduplicate examples in order and drop or split long ones."""
+
+    file_path = tmp_path / 'train.csv'
+    output_path = tmp_path / 'prepared.csv'
+    rows = [('a', 'A')] * 4 + [('b', 'B'), ('a', 'A'), ('x' * 20, 'X'), ('c\nd', 'C\nD'), ('ccc\nddd', 'CCC\nDDD')]
+
+    with open(file_path, 'w', newline='') as file:
+        csv.writer(file).writerows(rows)
+
+    def read_output():
+        with open(output_path, newline='') as file:
+            return [tuple(row) for row in csv.reader(file)]
+
+    stats = prepare_dataset(str(file_path), str(output_path), max_length=5)
+    assert read_output() == [('a', 'A'), ('b', 'B'), ('c\nd', 'C\nD')]
+    assert stats['rows'] == 9
+    assert stats['unique_examples'] == 3
+    assert stats['duplicate_examples'] == 4
+    assert stats['max_occurrences'] == 5
+    assert stats['dropped_rows'] == 2
+
+    stats = prepare_dataset(str(file_path), str(output_path), max_length=5, long_rows='split',
+                            duplicate_weighting='log')
+    assert read_output() == [('a', 'A')] * 3 + [('b', 'B'), ('c\nd', 'C\nD'), ('ccc', 'CCC'), ('ddd', 'DDD')]
+    assert stats['split_rows'] == 1
+    assert stats['dropped_rows'] == 1
+    assert stats['output_examples'] == 7
+
+
+def test_split_example():
+    """split_example() should only split examples with aligned lines that fit the max length."""
+
+    assert split_example('a\nb\nc', 'A\nB\nC', 3) == [('a\nb', 'A\nB'), ('c', 'C')]
+    assert split_example('a\nb', 'A', 3) == []
+    assert split_example('abcd\nb', 'A\nB', 3) == []
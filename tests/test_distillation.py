@@ -0,0 +1,24 @@
+import tensorflow as tf
+
+from theory.nn.brain import Brain
+
+
+def test_distillation_loss_function():
+    """Brain.distillation_loss_function() should weigh the target loss against the divergence from the teacher."""
+
+    real = tf.constant([[3, 1, 0]])
+    pred = tf.random.stateless_normal((1, 3, 5), seed=(1, 2))
+    teacher_pred = tf.random.stateless_normal((1, 3, 5), seed=(3, 4))
+    loss = float(Brain.loss_function(real, pred))
+
+    # Only the targets
+    assert abs(float(Brain.distillation_loss_function(real, pred, teacher_pred, 1.0, 2.0)) - loss) < 1e-5
+
+    # No divergence from identical predictions
+    assert abs(float(Brain.distillation_loss_function(real, pred, pred, 0.5, 2.0)) - loss / 2) < 1e-5
+
+    # Padding is ignored
+    padded_teacher_pred = tf.concat([teacher_pred[:, :2], tf.reverse(teacher_pred[:, 2:], axis=[-1]) * 3], axis=1)
+    assert abs(float(Brain.distillation_loss_function(real, pred, teacher_pred, 0.0, 2.0)) -
+               float(Brain.distillation_loss_function(real, pred, padded_teacher_pred, 0.0, 2.0))) < 1e-5
+    assert float(Brain.distillation_loss_function(real, pred, teacher_pred, 0.0, 2.0)) > 0
@@ -0,0 +1,22 @@
+from theory.nn.hyperparams import Hyperparams
+
+
+def test_save_load(tmp_path):
+    """Hyperparams.load() should restore hyperparameters saved by Hyperparams.save()."""
+
+    hyperparams = Hyperparams(buffer_size=100, batch_size=32, num_layers=2, d_model=64, dff=128, num_heads=4,
+                              dropout_rate=0.2, epochs=5)
+    file_path = str(tmp_path / 'hyperparams.json')
+    hyperparams.save(file_path)
+
+    assert vars(Hyperparams.load(file_path)) == vars(hyperparams)
+
+
+def test_load_without_max_seq_len(tmp_path):
+    """Hyperparams saved before "max_seq_len" existed should load with the default max sequence length."""
+
+    file_path = tmp_path / 'hyperparams.json'
+    file_path.write_text('{"buffer_size": 100, "batch_size": 32, "num_layers": 2, "d_model": 64, "dff": 128, '
+                         '"num_heads": 4, "dropout_rate": 0.2, "epochs": 5}')
+
+    assert Hyperparams.load(str(file_path)).max_seq_len == 512
@@ -0,0 +1,63 @@
+import numpy as np
+import tensorflow as tf
+
+from theory.nn.brain import Brain
+from theory.nn.mha import MultiHeadAttention
+from theory.nn.pruning import head_scores, prune_transformer, top_indices
+from theory.nn.transformer import Transformer
+
+
+def build_transformer(num_heads: int, dff: int) -> Transformer:
+    transformer = Transformer(2, 16, num_heads, dff, 20, 22, pe_input=32, pe_target=32, head_depth=4)
+    inp = tf.constant([[5, 3, 7, 0]])
+    tar = tf.constant([[1, 4, 0]])
+    transformer((inp, tar), mask=list(Brain.create_masks(inp, tar)))
+
+    return transformer
+
+
+def test_mha_head_depth():
+    """MultiHeadAttention should support heads of a given dimensionality, independent of the model dimensionality."""
+
+    mha = MultiHeadAttention(16, 2, depth=4)
+    x = tf.random.normal((1, 3, 16), seed=0)
+    output, attention_weights = mha(x, x, x, None)
+
+    assert output.shape == (1, 3, 16)
+    assert attention_weights.shape == (1, 2, 3, 3)
+    assert mha.wq.kernel.shape == (16, 8)
+    assert mha.dense.kernel.shape == (8, 16)
+
+
+def test_head_scores():
+    """head_scores() should score the heads with the largest weights highest."""
+
+    mha = MultiHeadAttention(8, 2)
+    mha(tf.zeros((1, 1, 8)), tf.zeros((1, 1, 8)), tf.zeros((1, 1, 8)), None)
+    mha.wq.kernel.assign(tf.concat([tf.ones((8, 4)), tf.zeros((8, 4))], axis=1))
+
+    assert np.argmax(head_scores(mha)) == 0
+    assert top_indices(np.array([0.1, 0.9, 0.5, 0.3]), 2).tolist() == [1, 2]
+
+
+def test_prune_transformer():
+    """prune_transformer() should reproduce the outputs of an unpruned transformer and shrink a pruned one."""
+
+    source = build_transformer(4, 32)
+    inp = tf.constant([[5, 3, 7, 0], [2, 9, 0, 0]])
+    tar = tf.constant([[1, 4, 0], [1, 6, 8]])
+    expected, _ = source((inp, tar), mask=list(Brain.create_masks(inp, tar)))
+
+    target = build_transformer(4, 32)
+    prune_transformer(source, target)
+    output, _ = target((inp, tar), mask=list(Brain.create_masks(inp, tar)))
+    np.testing.assert_allclose(output.numpy(), expected.numpy(), atol=1e-5)
+
+    pruned = build_transformer(2, 8)
+    prune_transformer(source, pruned)
+    output, _ = pruned((inp, tar), mask=list(Brain.create_masks(inp, tar)))
+
+    assert output.shape == expected.shape
+    assert pruned.count_params() < source.count_params()
+    assert pruned.encoder.enc_layers[0].mha.wq.kernel.shape == (16, 8)
+    assert pruned.decoder.dec_layers[0].ffn.layers[0].kernel.shape == (16, 8)
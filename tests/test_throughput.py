@@ -0,0 +1,28 @@
+import json
+
+from theory.nn.throughput import ThroughputMonitor
+
+
+def test_summary(tmp_path):
+    """ThroughputMonitor should aggregate the steps of a window and append its metrics to the JSONL file."""
+
+    file_path = tmp_path / 'metrics.jsonl'
+    monitor = ThroughputMonitor(str(file_path))
+    monitor.update(wait_time=0.5, compute_time=1.5, examples=8, real_tokens=60, padded_tokens=80)
+    monitor.update(wait_time=0.5, compute_time=1.5, examples=8, real_tokens=60, padded_tokens=80)
+
+    summary = monitor.summary()
+    assert summary['tokens_per_sec'] == 30
+    assert summary['examples_per_sec'] == 4
+    assert summary['padding_ratio'] == 0.25
+    assert summary['input_wait_time'] == 0.5
+    assert summary['compute_time'] == 1.5
+    assert summary['input_wait_fraction'] == 0.25
+    assert summary['host_memory_mb'] > 0
+
+    monitor.write({'step': 2, **summary})
+    monitor.reset()
+    monitor.close()
+
+    assert monitor.steps == 0
+    assert json.loads(file_path.read_text())['step'] == 2
@@ -0,0 +1,55 @@
+import runpy
+import sys
+from os import path
+
+import tensorflow as tf
+import tensorflow_datasets as tfds
+
+from theory.lvp import LVP
+from theory.nn.brain import Brain
+from theory.nn.hyperparams import Hyperparams
+
+TRAIN_SCRIPT_PATH = path.join(path.dirname(path.dirname(path.abspath(__file__))), 'train.py')
+
+
+def test_export_only(tmp_path, monkeypatch):
+    """train.py --export-only should export the checkpoint with the architecture saved alongside it."""
+
+    model_dir_path = tmp_path / 'output'
+    model_dir_path.mkdir()
+
+    for name in ('src', 'tar'):
+        tokenizer = tfds.deprecated.text.SubwordTextEncoder.build_from_corpus(
+            ['MOVE A TO B', 'ADD 1 TO C', 'A = B;', 'C += 1;'], target_vocab_size=300)
+        tokenizer.save_to_file(str(model_dir_path / name))
+
+    # Smaller than the default architecture
+    hyperparams = Hyperparams(buffer_size=100, batch_size=32, num_layers=1, d_model=32, dff=64, num_heads=2,
+                              dropout_rate=0.1, epochs=1, max_seq_len=32)
+    hyperparams.save(str(model_dir_path / 'hyperparams.json'))
+
+    tf.keras.utils.set_random_seed(0)
+    brain = Brain(LVP.COBOL_TO_CSHARP_9, hyperparams, str(model_dir_path), enable_wandb=False, inference=True)
+    # Creates the weights, since there is no checkpoint to restore yet
+    brain.restore_checkpoint()
+    brain.ckpt_manager.save()
+
+    encoder_input = tf.constant([[brain.tokenizer_src.vocab_size, 5, 3, 7, brain.tokenizer_src.vocab_size + 1]])
+    max_lengths = tf.constant([12])
+    expected, _ = brain._Brain__decode(encoder_input, max_lengths)
+
+    # Neither the architecture flags nor the datasets are given
+    export_dir_path = tmp_path / 'serving'
+    monkeypatch.setattr(sys, 'argv', [
+        TRAIN_SCRIPT_PATH, '-l', 'cobol_to_csharp_9', '-o', str(model_dir_path), '--base-data-path',
+        str(tmp_path / 'data'), '--disable-wandb', '--export-only', '--export-dir', str(export_dir_path),
+    ])
+    runpy.run_path(TRAIN_SCRIPT_PATH, run_name='__main__')
+
+    exported = Hyperparams.load(str(export_dir_path / 'hyperparams.json'))
+    assert (exported.num_layers, exported.d_model, exported.dff, exported.num_heads) == (1, 32, 64, 2)
+
+    serving_brain = Brain(LVP.COBOL_TO_CSHARP_9, hyperparams, str(model_dir_path), enable_wandb=False,
+                          serving_model_path=str(export_dir_path))
+    output, _ = serving_brain._Brain__decode(encoder_input, max_lengths)
+    assert output.numpy().tolist() == expected.numpy().tolist()
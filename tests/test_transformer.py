@@ -0,0 +1,29 @@
+import numpy as np
+import tensorflow as tf
+
+from theory.nn.brain import Brain
+from theory.nn.transformer import Transformer
+
+
+def test_decode_step():
+    """Transformer.decode_step() should predict the same logits as a forward pass over the whole target prefix."""
+
+    transformer = Transformer(2, 16, 4, 32, 20, 22, pe_input=32, pe_target=32)
+    inp = tf.constant([[5, 3, 7, 0], [2, 9, 0, 0]])
+    tar = tf.constant([[1, 4, 6, 2, 8], [1, 6, 8, 3, 5]])
+    expected, _ = transformer((inp, tar), mask=list(Brain.create_masks(inp, tar)))
+
+    padding_mask = Brain.create_padding_mask(inp)
+
+    @tf.function
+    def decode(inp, tar):
+        cache = transformer.decoder.init_cache(transformer.encode(inp, padding_mask))
+        predictions = []
+
+        for step in range(tar.shape[1]):
+            step_predictions, _, cache = transformer.decode_step(tar[:, step:step + 1], cache, step, padding_mask)
+            predictions.append(step_predictions)
+
+        return tf.concat(predictions, axis=1)
+
+    np.testing.assert_allclose(decode(inp, tar).numpy(), expected.numpy(), atol=1e-5)
@@ -0,0 +1,29 @@
+from theory.nn.translation_cache import TranslationCache
+
+
+def test_get_put(tmp_path):
+    """Cached translations should be keyed by model identity and input, and count hits and misses."""
+
+    cache = TranslationCache(str(tmp_path / 'cache.db'))
+    cache.put_many('model_a', {'%mask_0%();': 'a'})
+
+    assert cache.get_many('model_a', ['%mask_0%();', 'other']) == {'%mask_0%();': 'a'}
+    assert cache.get_many('model_b', ['%mask_0%();']) == {}
+    assert (cache.hits, cache.misses) == (1, 2)
+
+    # Cache is persisted
+    cache.close()
+    assert TranslationCache(str(tmp_path / 'cache.db')).get_many('model_a', ['%mask_0%();']) == {'%mask_0%();': 'a'}
+
+
+def test_eviction(tmp_path):
+    """The least recently used translations should be evicted once the cache is full."""
+
+    cache = TranslationCache(str(tmp_path / 'cache.db'), max_entries=2)
+    cache.put_many('model', {'a': '1'})
+    cache.put_many('model', {'b': '2'})
+    cache.get_many('model', ['a'])
+    cache.put_many('model', {'c': '3'})
+
+    assert len(cache) == 2
+    assert cache.get_many('model', ['a', 'b', 'c']) == {'a': '1', 'c': '3'}
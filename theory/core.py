@@ -1,6 +1,8 @@
+import io
+import re
 from os import path
 import logging
-from typing import Optional, List
+from typing import Optional, List, Tuple
 from tqdm.contrib import tenumerate
 
 from api.config import DEBUG
@@ -21,12 +23,14 @@ from .lvps.cobol_to_csharp_9.store import COBOLToCSharp9Store
 from .lvps.cpp_17_to_nodejs_14.itl import CPP17ToNodeJS14ITL
 from .lvps.java_14_to_nodejs_14.itl import Java14ToNodeJS14ITL
 from .lvps.java_14_to_python_3.itl import Java14ToPython3ITL
-from .utils import log_translation
+from .utils import log_translation, to_special_token
 from .veil import Veil
 from .lvps.base_postprocessor import Postprocessor
 from .dependency_generator import DependencyGenerator
 from .lang_utils import get_language_definition
 
+DEFERRED_TRANSLATION_REGEX = re.compile(r'%nn_deferred_\d+%')
+
 
 class Theory:
     """Theory core."""
@@ -40,6 +44,17 @@ class Theory:
         train_dataset_path: str = None,
         valid_dataset_path: str = None,
         data_map_path: str = None,
+        nn_batch_size: Optional[int] = None,
+        reuse_translations: bool = True,
+        inference: bool = False,
+        serving_model_path: str = None,
+        beam_width: int = 1,
+        length_penalty: float = 0.6,
+        max_length_ratio: float = 3.0,
+        max_length_offset: int = 32,
+        nn_cache_path: str = None,
+        nn_cache_max_entries: int = 100000,
+        nn_precision: str = None,
         debug: bool = False,
     ):
         """
@@ -51,11 +66,31 @@ class Theory:
         :param train_dataset_path: Training dataset path.
         :param valid_dataset_path: Validation dataset path.
         :param data_map_path: Data map path.
+        :param nn_batch_size: Batch size for deferred neural network translation. If `None`, lines are translated
+            by the neural network one at a time as they are reached.
+        :param reuse_translations: Whether to reuse the translations of identical lines of a file that don't depend
+            on state, instead of translating each of them again.
+        :param inference: Whether to load the neural network for inference only, without the training and validation
+            datasets.
+        :param serving_model_path: Path to an exported serving model to load the neural network from, instead of the
+            checkpoints in the output directory.
+        :param beam_width: Number of beams used for neural network beam search decoding. If 1, greedy decoding is used.
+        :param length_penalty: Length penalty exponent used to normalize beam search scores.
+        :param max_length_ratio: Maximum neural network translation length as a multiple of the encoded line length.
+        :param max_length_offset: Number of tokens added to the maximum neural network translation length of every
+            line.
+        :param nn_cache_path: Path to a persistent neural network translation cache file, shared between processes.
+            If `None`, translations are not cached.
+        :param nn_cache_max_entries: Maximum number of translations kept in the neural network translation cache.
+        :param nn_precision: Mixed precision policy of the neural network (e.g. "mixed_bfloat16"). If `None`, the
+            precision the model was trained with is used.
         :param debug: Whether to enable debug mode.
         """
 
         self.debug = debug
         self.lvp = lvp
+        self.nn_batch_size = nn_batch_size
+        self.reuse_translations = reuse_translations
         self.train_dataset_path = \
             path.join(base_dataset_path,
                       f'{lvp.value.lower()}_train.csv') if train_dataset_path is None else train_dataset_path
@@ -77,6 +112,15 @@ class Theory:
             self.output_dir_path,
             train_dataset_path=self.train_dataset_path,
             valid_dataset_path=self.valid_dataset_path,
+            inference=inference,
+            serving_model_path=serving_model_path,
+            beam_width=beam_width,
+            length_penalty=length_penalty,
+            max_length_ratio=max_length_ratio,
+            max_length_offset=max_length_offset,
+            cache_path=nn_cache_path,
+            cache_max_entries=nn_cache_max_entries,
+            precision=nn_precision,
             debug=debug,
         )
 
@@ -106,9 +150,10 @@ class Theory:
         self.tar_lang_def = get_language_definition(lvp, is_target=True)
 
     def restore(self):
-        """Restore brain's latest checkpoint."""
+        """Restore brain's best checkpoint (or latest, if it has not been validated) and trace its decoder."""
 
-        self.brain.restore_checkpoint()
+        self.brain.restore_checkpoint(best=True)
+        self.brain.trace_decoder()
 
     def translate(self, input_file_path: str, output_file_path: str = None, request_data=None):
         """
@@ -182,10 +227,26 @@ class Theory:
 
         output_lines = list()
         can_write = output_file_path is not None
-
-        # Open/create output file for writing
-        writer = open(output_file_path, 'w',
-                      newline='') if output_file_path is not None else None
+        self.brain.reset_decode_stats()
+        defer_nn = self.nn_batch_size is not None
+
+        # Lines requiring the neural network, translated in batches after all other lines have been processed
+        deferred_translations = list()
+
+        # Translations of relative masked lines (with their indentation) that don't depend on state, reused for
+        # identical lines of this file
+        line_memo = dict()
+        reused_translation_count = 0
+
+        # Open/create output file for writing.
+        # Output is buffered in memory when deferring neural translation, since deferred lines are only translated
+        # once the whole file has been processed.
+        if not can_write:
+            writer = None
+        elif defer_nn:
+            writer = io.StringIO()
+        else:
+            writer = open(output_file_path, 'w', newline='')
 
         incorrect_translation_count = 0
 
@@ -211,6 +272,8 @@ class Theory:
             log('=' * 80, level=logging.DEBUG)
             log(f'- Line: {i + 1}', level=logging.DEBUG)
 
+            is_deferred = False
+
             try:
                 # Replace global mask tokens with relative versions
                 line = self.veil.to_relative(line)
@@ -224,25 +287,58 @@ class Theory:
                 if self.has_store:
                     self.store.update(input_line)
 
-                # Send line through the Immediate Translation Layer (ITL)
-                translated = self.itl.translate(line, line_indent)
+                memo_key = (line, line_indent)
+
+                if memo_key in line_memo:
+                    # Reuse translation of an identical line
+                    translated = line_memo[memo_key]
+                    reused_translation_count += 1
+                    log_translation('Memo', line, translated)
+                else:
+                    # Send line through the Immediate Translation Layer (ITL),
+                    # starting with the rules that don't depend on state
+                    translated = self.itl.translate_stateless(line, line_indent)
+                    is_reusable = translated is not None
 
-                if translated is None:
-                    # Try to translate line with map
-                    translated = self.itl.map(line)
+                    if translated is None:
+                        translated = self.itl.translate_stateful(
+                            line, line_indent)
 
-                    # Translate line via neural network if ITL had no available
-                    # translation
                     if translated is None:
-                        translated = self.brain.translate(line)
-                        log_translation('NN', line, translated)
+                        # Try to translate line with map
+                        translated = self.itl.map(line)
+                        is_reusable = translated is not None
+
+                        # Translate line via neural network if ITL had no available
+                        # translation
+                        if translated is None:
+                            if defer_nn:
+                                # Substitute a placeholder until the batched neural translation phase.
+                                # Identical deferred lines are deduplicated when batched instead.
+                                is_deferred = True
+                                translated = to_special_token(
+                                    f'nn_deferred_{len(deferred_translations)}')
+                                deferred_translations.append((
+                                    translated,
+                                    line,
+                                    list(self.veil.current_relative_tokens),
+                                    input_lines[i].strip('\n').strip(),
+                                ))
+                            else:
+                                translated = self.brain.translate(line)
+                                is_reusable = True
+                                log_translation('NN', line, translated)
+                        else:
+                            log_translation('ITL (Map)', line, translated)
                     else:
-                        log_translation('ITL (Map)', line, translated)
-                else:
-                    log_translation('ITL (Algorithm)', line, translated)
+                        log_translation('ITL (Algorithm)', line, translated)
 
-                # Skip further processing if translated to empty string
-                if translated:
+                    if is_reusable and self.reuse_translations:
+                        line_memo[memo_key] = translated
+
+                # Skip further processing if translated to empty string or
+                # deferred (processed once translated)
+                if translated and not is_deferred:
                     # Post-process translated line
                     translated = self.postprocessor.postprocess_line(
                         translated)
@@ -257,20 +353,8 @@ class Theory:
                 if self.has_store:
                     self.store.post_translation_hook(translated)
             except Exception as e:
-                src_line = input_lines[i].strip('\n').strip()
-
-                if DEBUG:
-                    log(f'Failed to translate:', level=logging.WARNING)
-                    log(f'\tMasked: {line}', level=logging.WARNING)
-                    log(f'\tSource: {src_line}', level=logging.WARNING)
-                    log(f'Error:', level=logging.WARNING)
-                    log(e, level=logging.WARNING)
-
-                commented_inp_line = self.tar_lang_def.to_single_line_comment(
-                    src_line)
-                err_comment = self.tar_lang_def.to_single_line_comment(
-                    f'[Turring Theory] ERROR: Failed to translate.')
-                translated = f'{commented_inp_line}\t{err_comment}'
+                translated = self.__to_failed_translation(
+                    input_lines[i].strip('\n').strip(), line, e)
                 incorrect_translation_count += 1
 
             if self.has_template_processor:
@@ -285,6 +369,23 @@ class Theory:
 
             log('=' * 80 + '\n', level=logging.DEBUG)
 
+        # Translate deferred lines via the neural network and substitute them
+        # for their placeholders
+        if defer_nn:
+            translations, failed_count = self.__translate_deferred(
+                deferred_translations)
+            incorrect_translation_count += failed_count
+
+            def substitute(text: str) -> str:
+                return re.sub(DEFERRED_TRANSLATION_REGEX, lambda m: translations[m.group(0)], text)
+
+            output_lines = list(map(substitute, output_lines))
+
+            if self.has_template_processor:
+                for tag, content in self.template_processor.tag_content.items():
+                    self.template_processor.tag_content[tag] = list(
+                        map(substitute, content))
+
         # Build template (if applicable)
         if self.has_template_processor:
             result = self.template_processor.build()
@@ -297,6 +398,11 @@ class Theory:
             # TODO: Postprocess file contents if cannot write and has no template processor
             pass
 
+        if defer_nn and can_write:
+            # Write buffered output
+            with open(output_file_path, 'w', newline='') as file:
+                file.write(substitute(writer.getvalue()))
+
         writer.close()
 
         # Generate dependencies
@@ -311,9 +417,79 @@ class Theory:
         nn_accuracy = (len(masked_lines) -
                        incorrect_translation_count) / len(masked_lines) * 100
         log('📈 Estimated accuracy: {:.4f}%'.format(nn_accuracy))
+        log(f'Reused translations for {reused_translation_count} repeated lines.')
+        self.brain.log_decode_stats()
 
         return '\n'.join(output_lines)
 
+    def __translate_deferred(self, deferred_translations: List[Tuple[str, str, List[str], str]]) -> Tuple[dict, int]:
+        """
+        Translate deferred lines via the neural network in batches, then postprocess and unmask each translation.
+
+        :param deferred_translations: List of tuples of placeholder, relative masked line, relative mask tokens, and
+            source line.
+        :returns: Tuple of map of placeholders to translated lines, and the number of failed translations.
+        """
+
+        if len(deferred_translations) == 0:
+            return dict(), 0
+
+        log(f'Translating {len(deferred_translations)} lines via neural network...')
+        nn_translations = self.brain.translate_batch(
+            [line for _, line, _, _ in deferred_translations],
+            batch_size=self.nn_batch_size,
+        )
+
+        translations = dict()
+        failed_count = 0
+
+        for (placeholder, line, relative_tokens, src_line), translated in zip(deferred_translations, nn_translations):
+            log_translation('NN', line, translated)
+
+            try:
+                if translated:
+                    # Post-process translated line
+                    translated = self.postprocessor.postprocess_line(
+                        translated)
+
+                    # Replace relative mask tokens with global versions, using
+                    # the relative tokens from when the line was deferred
+                    self.veil.current_relative_tokens = relative_tokens
+                    translated = self.veil.from_relative(translated)
+
+                    # Unmask line
+                    translated = self.veil.unmask(translated)
+            except Exception as e:
+                translated = self.__to_failed_translation(src_line, line, e)
+                failed_count += 1
+
+            translations[placeholder] = translated
+
+        return translations, failed_count
+
+    def __to_failed_translation(self, src_line: str, line: str, e: Exception) -> str:
+        """
+        Build the commented-out output for a line that failed to translate.
+
+        :param src_line: Original source line.
+        :param line: Masked line.
+        :param e: Exception raised during translation.
+        :returns: Commented source line with error comment.
+        """
+
+        if DEBUG:
+            log(f'Failed to translate:', level=logging.WARNING)
+            log(f'\tMasked: {line}', level=logging.WARNING)
+            log(f'\tSource: {src_line}', level=logging.WARNING)
+            log(f'Error:', level=logging.WARNING)
+            log(e, level=logging.WARNING)
+
+        commented_inp_line = self.tar_lang_def.to_single_line_comment(
+            src_line)
+        err_comment = self.tar_lang_def.to_single_line_comment(
+            f'[Turring Theory] ERROR: Failed to translate.')
+        return f'{commented_inp_line}\t{err_comment}'
+
     def translate_direct(
         self,
         line: str,
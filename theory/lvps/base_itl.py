@@ -73,7 +73,34 @@ class ITL:
         :param indent: Source indentation length.
         :returns: Translated sequence. If no translation available, returns `None`.
         """
-        pass
+
+        translated = self.translate_stateless(seq, indent)
+
+        if translated is None:
+            translated = self.translate_stateful(seq, indent)
+
+        return translated
+
+    def translate_stateless(self, seq: str, indent: int = 0):
+        """
+        Translate sequence using only rules that neither depend on nor modify any state, so the translation of
+        identical sequences can be reused.
+
+        :param seq: Sequence to translate. Assumed to be stripped.
+        :param indent: Source indentation length.
+        :returns: Translated sequence. If no translation available, returns `None`.
+        """
+        return None
+
+    def translate_stateful(self, seq: str, indent: int = 0):
+        """
+        Translate sequence using rules that depend on or modify state (e.g. Veil, store or template processor).
+
+        :param seq: Sequence to translate. Assumed to be stripped.
+        :param indent: Source indentation length.
+        :returns: Translated sequence. If no translation available, returns `None`.
+        """
+        return None
 
     @staticmethod
     def translate_std_to_nodejs(seq: str):
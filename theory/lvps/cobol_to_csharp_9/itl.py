@@ -61,7 +61,7 @@ class COBOLToCSharp9ITL(ITL):
         self.uses_db = False
         self.last_obtained_record = None
 
-    def translate(self, seq: str, indent: int = 0):
+    def translate_stateless(self, seq: str, indent: int = 0):
         # Ignores via equality
         for ignored_seq in COBOL_TO_CSHARP_IGNORED_SEQS:
             if seq == ignored_seq:
@@ -102,6 +102,9 @@ class COBOLToCSharp9ITL(ITL):
             date = match.group('date')
             return f'// Date written: {date}'
 
+        return None
+
+    def translate_stateful(self, seq: str, indent: int = 0):
         # Bool items with value-based conditions
         match = re.match(COBOL_BOOL_ITEM_WITH_VAL_REGEX, seq)
         if match is not None:
@@ -174,7 +177,9 @@ class COBOLToCSharp9ITL(ITL):
                 var_def)
             self.template_processor.tag_content[TEMPL_FILE_VAR_ASSIGNMENTS].append(
                 assignment)
-            return translation
+
+            # The file var is output by the template
+            return ''
 
         # Translate file data attachments
         match = re.match(COBOL_FILE_DATA_REGEX, seq)
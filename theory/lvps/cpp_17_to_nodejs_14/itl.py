@@ -8,13 +8,11 @@ from theory.languages.cpp.constants import CPP_IGNORED_SEQS, CPP_IMPORT_REGEX, C
 class CPP17ToNodeJS14ITL(ITL):
     """ITL for C++17 to Node.js 14."""
 
-    def translate(self, seq: str, indent: int = 0):
+    def translate_stateless(self, seq: str, indent: int = 0):
         # Standard language translation
-        translated = self.translate_std_to_nodejs(seq)
-
-        if translated is not None:
-            return translated
+        return self.translate_std_to_nodejs(seq)
 
+    def translate_stateful(self, seq: str, indent: int = 0):
         # C++-specific translation
         # Ignores
         for ignored in CPP_IGNORED_SEQS:
@@ -8,13 +8,11 @@ from theory.languages.java.constants import JAVA_IGNORED_RE_SEQS, JAVA_IMPORT_RE
 class Java14ToNodeJS14ITL(ITL):
     """ITL for Java 14 to Node.js 14."""
 
-    def translate(self, seq: str, indent: int = 0):
+    def translate_stateless(self, seq: str, indent: int = 0):
         # Standard language translation
-        translated = self.translate_std_to_nodejs(seq)
-
-        if translated is not None:
-            return translated
+        return self.translate_std_to_nodejs(seq)
 
+    def translate_stateful(self, seq: str, indent: int = 0):
         # Java-specific translation
         # Ignores
         for ignored_regex in JAVA_IGNORED_RE_SEQS:
@@ -7,13 +7,11 @@ from theory.languages.java.constants import JAVA_IGNORED_RE_SEQS, JAVA_IMPORT_RE
 class Java14ToPython3ITL(ITL):
     """ITL for Java 14 to Python 3."""
 
-    def translate(self, seq: str, indent: int = 0):
+    def translate_stateless(self, seq: str, indent: int = 0):
         # Standard language translation
-        translated = self.translate_std_to_python_3(seq)
-
-        if translated is not None:
-            return translated
+        return self.translate_std_to_python_3(seq)
 
+    def translate_stateful(self, seq: str, indent: int = 0):
         # Java-specific translation
         # Ignores
         for ignored_regex in JAVA_IGNORED_RE_SEQS:
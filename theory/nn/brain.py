@@ -1,6 +1,13 @@
+import hashlib
+import json
+import logging
+import math
 import os
+import shutil
 from os import path
 import time
+from typing import List, Optional, Tuple
+import numpy as np
 import tensorflow as tf
 import tensorflow_datasets as tfds
 import wandb
@@ -8,23 +15,94 @@ import wandb
 from cli import log
 from theory.lvp import LVP
 from api.config import DEBUG
+from .brain_common import detect_loops, loop_span
 from .custom_schedule import CustomSchedule
-from .datasets import load_datasets
+from .datasets import batch_by_length, file_fingerprint, has_token_shards, load_datasets, load_token_shards, \
+    read_examples, sample_corpus, write_token_shards
 from .hyperparams import Hyperparams
+from .pruning import prune_transformer
+from .quantization import QUANTIZED_DECODER_FILE_NAME, QuantizedDecoder, quantize_decoder
+from .throughput import ThroughputMonitor
 from .transformer import Transformer
+from .translation_cache import TranslationCache
 
 # Global translation neural network architecture
 loss_object = tf.keras.losses.SparseCategoricalCrossentropy(
     from_logits=True, reduction='none'
 )
 
+# NOTE: Arbitrary max length of 512
+MAX_DECODE_LENGTH = 512
+
+# Repetition loop detection. Decoding of a sequence stops once its last tokens are a pattern of up to
+# `LOOP_MAX_PERIOD` tokens repeated at least `LOOP_MIN_REPEATS` times and spanning at least `LOOP_MIN_SPAN` tokens.
+LOOP_MAX_PERIOD = 8
+LOOP_MIN_REPEATS = 4
+LOOP_MIN_SPAN = 16
+LOOP_WINDOW = max(loop_span(p, LOOP_MIN_REPEATS, LOOP_MIN_SPAN) for p in range(1, LOOP_MAX_PERIOD + 1))
+
+# Decoding stop reasons
+STOP_END_TOKEN = 0
+STOP_MAX_LENGTH = 1
+STOP_LOOP = 2
+
+# Supported mixed precision policies
+PRECISIONS = ('float32', 'mixed_bfloat16', 'mixed_float16')
+
 
 class Brain:
     """Translation neural network abstraction."""
 
     def __init__(self, lvp: LVP, hyperparams: Hyperparams, model_dir_path: str, base_dataset_path: str = 'data',
                  train_dataset_path: str = None, valid_dataset_path: str = None, enable_wandb: bool = True,
+                 inference: bool = False, serving_model_path: str = None, beam_width: int = 1,
+                 length_penalty: float = 0.6, max_length_ratio: float = 3.0, max_length_offset: int = 32,
+                 cache_path: str = None, cache_max_entries: int = 100000, distribution_strategy: str = None,
+                 precision: str = None, vocab_sample_size: int = None, teacher_model_path: str = None,
+                 prune_model_path: str = None, prune_head_fraction: float = 0.0, prune_ffn_fraction: float = 0.0,
                  debug: bool = False):
+        """
+        :param lvp: LVP.
+        :param hyperparams: Hyperparameters. In inference mode, the model architecture hyperparameters saved alongside
+            the model (if any) are used instead.
+        :param model_dir_path: Path to directory containing the tokenizer vocabularies, model config and checkpoints.
+        :param base_dataset_path: Base dataset path.
+        :param train_dataset_path: Training dataset path.
+        :param valid_dataset_path: Validation dataset path.
+        :param enable_wandb: Whether to enable Weights & Biases (wandb) integration.
+        :param inference: Whether to only load what is required for translation, skipping the training and validation
+            datasets and the optimizer.
+        :param serving_model_path: Path to a serving model exported by `Brain.export()`. If given, the model,
+            tokenizer vocabularies and model config are loaded from it instead of being built and restored from
+            checkpoints. Implies inference mode.
+        :param beam_width: Number of beams used for beam search decoding. If 1, greedy decoding is used instead.
+        :param length_penalty: Length penalty exponent (alpha) used to normalize beam scores. Higher values favor
+            longer translations.
+        :param max_length_ratio: Maximum decoded length as a multiple of the encoded input length.
+        :param max_length_offset: Number of tokens added to the maximum decoded length of every input.
+        :param cache_path: Path to a persistent translation cache file. If given, translations of the restored model
+            are cached and reused across runs and processes.
+        :param cache_max_entries: Maximum number of translations kept in the translation cache.
+        :param distribution_strategy: Distribution strategy for data-parallel training. Either "mirrored" (all local
+            devices) or "multi_worker_mirrored" (workers configured via the `TF_CONFIG` environment variable). If
+            `None`, training runs on a single device.
+        :param precision: Mixed precision policy of the transformer, overriding the hyperparameters' (e.g.
+            "mixed_bfloat16" to serve a float32 model in bfloat16 on CPUs that support it). Ignored for serving models,
+            whose precision is fixed when exported.
+        :param vocab_sample_size: Number of training examples randomly sampled to build missing tokenizer vocabularies
+            from. If `None`, the whole training dataset is streamed into each tokenizer.
+        :param teacher_model_path: Path to the model directory of a trained teacher model to distill into this (usually
+            smaller) model. Training then fits the teacher's predictions as well as the training targets, with the
+            teacher's tokenizer vocabularies.
+        :param prune_model_path: Path to the model directory of a trained model to prune into this model. The
+            architecture and tokenizer vocabularies are taken from it, with the lowest magnitude attention heads and
+            feed-forward network hidden units of every layer removed, and the remaining weights copied over for
+            fine-tuning.
+        :param prune_head_fraction: Fraction of the attention heads of every attention layer to prune.
+        :param prune_ffn_fraction: Fraction of the hidden units of every feed-forward network to prune.
+        :param debug: Whether to enable debug mode.
+        """
+
         self.lvp = lvp
         self.hyperparams = hyperparams
         self.model_dir_path = model_dir_path
@@ -35,18 +113,120 @@ class Brain:
             path.join(base_dataset_path,
                       f'{lvp.value.lower()}_valid.csv') if valid_dataset_path is None else valid_dataset_path
         self.enable_wandb = enable_wandb
+        self.inference = inference or serving_model_path is not None
+        self.serving_model_path = serving_model_path
+        self.beam_width = beam_width
+        self.length_penalty = length_penalty
+        self.max_length_ratio = max_length_ratio
+        self.max_length_offset = max_length_offset
+        self.vocab_sample_size = vocab_sample_size
+        self.teacher_model_path = teacher_model_path
+        self.teacher = None
+        self.prune_model_path = prune_model_path
+        self.pruning_source = None
         self.debug = debug
-
-        # Load datasets
-        self.__load_datasets()
-
-        self.learning_rate = CustomSchedule(self.hyperparams.d_model)
-        self.optimizer = tf.keras.optimizers.Adam(
-            self.learning_rate, beta_1=0.9, beta_2=0.98, epsilon=1e-9)
-        self.transformer = Transformer(self.hyperparams.num_layers, self.hyperparams.d_model,
-                                       self.hyperparams.num_heads, self.hyperparams.dff, self.input_vocab_size,
-                                       self.target_vocab_size, pe_input=self.input_vocab_size,
-                                       pe_target=self.target_vocab_size, rate=self.hyperparams.dropout_rate)
+        self.cache = TranslationCache(cache_path, cache_max_entries) if cache_path is not None else None
+        self.model_id = None
+        # Greedy decoder of the INT8 quantized model, if quantized by `quantize()` or loaded from a quantized serving
+        # model. Used instead of the float model for greedy decoding.
+        self.quantized_decoder = None
+        self.reset_decode_stats()
+        self.hyperparams_path = path.join(self.model_dir_path, 'hyperparams.json')
+        self.preprocessed_path = path.join(self.model_dir_path, 'preprocessed')
+        self.preprocessed_source_path = path.join(self.preprocessed_path, 'source.json')
+
+        # Whether the preprocessed datasets were encoded from other datasets or tokenizers than the current ones
+        self.preprocessed_stale = False
+
+        # Training dataset deduplicated and length filtered by `prepare_dataset()` (see "train.py prepare"), used
+        # instead of the training dataset if it exists
+        self.prepared_dataset_path = path.join(self.model_dir_path, 'prepared_train.csv')
+        if path.exists(self.prepared_dataset_path):
+            self.train_dataset_path = self.prepared_dataset_path
+
+        # Must be created before any other TensorFlow operations run
+        self.strategy = self.__create_strategy(distribution_strategy)
+
+        if serving_model_path is not None:
+            # Load exported serving model, which contains its own model config and tokenizer vocabularies
+            self.hyperparams = Hyperparams.load(path.join(serving_model_path, 'hyperparams.json'))
+            self.__load_tokenizers(dir_path=serving_model_path)
+
+            log(f'Loading serving model from "{serving_model_path}"...')
+            self.serving_model = tf.saved_model.load(serving_model_path)
+            self.__decode = self.serving_model.decode
+
+            if beam_width > 1:
+                self.__beam_search = self.serving_model.beam_search
+
+            quantized_decoder_path = path.join(serving_model_path, QUANTIZED_DECODER_FILE_NAME)
+            if path.exists(quantized_decoder_path):
+                with open(quantized_decoder_path, 'rb') as file:
+                    self.quantized_decoder = QuantizedDecoder(file.read(), MAX_DECODE_LENGTH)
+
+                if beam_width > 1:
+                    log('Beam search is not supported by quantized models, so the float model is used.',
+                        level=logging.WARNING)
+
+            log('Serving model loaded.')
+            return
+
+        if inference:
+            # Load saved model config and tokenizers only
+            if path.exists(self.hyperparams_path):
+                self.hyperparams = Hyperparams.load(self.hyperparams_path)
+            else:
+                log(f'No model config found at "{self.hyperparams_path}", the given hyperparameters are used instead.',
+                    level=logging.WARNING)
+
+            self.__load_tokenizers()
+        else:
+            # The student must share the teacher's tokenizer vocabularies, so the teacher's predictions line up
+            if teacher_model_path is not None:
+                self.__copy_tokenizers(teacher_model_path)
+
+            # The pruned architecture (e.g. max sequence length) must be known before the datasets are filtered
+            if prune_model_path is not None:
+                self.__copy_tokenizers(prune_model_path)
+                self.__load_pruning_source(prune_head_fraction, prune_ffn_fraction)
+
+            # Load datasets
+            self.__load_datasets()
+
+            if self.pruning_source is not None:
+                self.__validate_vocabularies(self.pruning_source, prune_model_path)
+
+        if precision is not None:
+            self.hyperparams.precision = precision
+
+        if self.hyperparams.precision not in PRECISIONS:
+            raise Exception(f'Unknown precision "{self.hyperparams.precision}".')
+
+        # Variables created within the strategy scope are replicated across devices and workers
+        with self.strategy.scope():
+            if not inference:
+                self.learning_rate = CustomSchedule(self.hyperparams.d_model)
+                self.optimizer = tf.keras.optimizers.Adam(
+                    self.learning_rate, beta_1=0.9, beta_2=0.98, epsilon=1e-9)
+
+                # Float16 gradients underflow without loss scaling, unlike bfloat16 which has float32's range
+                if self.hyperparams.precision == 'mixed_float16':
+                    self.optimizer = tf.keras.mixed_precision.LossScaleOptimizer(self.optimizer)
+
+            # Layers take their dtype policy from the global policy when created
+            global_policy = tf.keras.mixed_precision.global_policy()
+            tf.keras.mixed_precision.set_global_policy(self.hyperparams.precision)
+
+            try:
+                self.transformer = Transformer(self.hyperparams.num_layers, self.hyperparams.d_model,
+                                               self.hyperparams.num_heads, self.hyperparams.dff,
+                                               self.input_vocab_size, self.target_vocab_size,
+                                               pe_input=self.hyperparams.max_seq_len,
+                                               pe_target=self.hyperparams.max_seq_len,
+                                               rate=self.hyperparams.dropout_rate,
+                                               head_depth=self.hyperparams.head_depth)
+            finally:
+                tf.keras.mixed_precision.set_global_policy(global_policy)
 
         # Output hyperparams
         if DEBUG:
@@ -56,15 +236,181 @@ class Brain:
         # Configure checkpoints
         self.checkpoint_path = path.join(self.model_dir_path, 'checkpoints')
 
-        self.ckpt = tf.train.Checkpoint(
-            transformer=self.transformer, optimizer=self.optimizer)
+        if inference:
+            self.ckpt = tf.train.Checkpoint(transformer=self.transformer)
+        else:
+            with self.strategy.scope():
+                # Lowest validation loss so far, so resumed training only keeps better checkpoints
+                self.best_val_loss = tf.Variable(float('inf'), trainable=False, name='best_val_loss')
+
+                # Training progress, so training can resume mid-epoch. `epoch_batches` is the number of the epoch's
+                # batches already trained on, `step` the number of optimizer steps and `micro_batches` the number of
+                # micro-batches accumulated since the last optimizer step.
+                self.epoch = tf.Variable(0, dtype=tf.int64, trainable=False, name='epoch')
+                self.epoch_batches = tf.Variable(0, dtype=tf.int64, trainable=False, name='epoch_batches')
+                self.step = tf.Variable(0, dtype=tf.int64, trainable=False, name='step')
+                self.micro_batches = tf.Variable(0, dtype=tf.int64, trainable=False, name='micro_batches')
+
+            # Holds the partially accumulated gradients once `train()` creates them. Asynchronous checkpoints only
+            # save the dependencies a checkpoint is created with, so these are nested rather than added later.
+            self.accumulation = tf.train.Checkpoint()
+
+            self.ckpt = tf.train.Checkpoint(
+                transformer=self.transformer, optimizer=self.optimizer, best_val_loss=self.best_val_loss,
+                epoch=self.epoch, epoch_batches=self.epoch_batches, step=self.step, micro_batches=self.micro_batches,
+                accumulation=self.accumulation)
+
         self.ckpt_manager = tf.train.CheckpointManager(
             self.ckpt, self.checkpoint_path, max_to_keep=10)
 
-    def __load_datasets(self):
-        """Load and process the training and validation datasets."""
+        # Checkpoint with the lowest validation loss, kept apart from the rolling checkpoints. Only contains weights.
+        self.best_checkpoint_path = path.join(self.checkpoint_path, 'best')
+        self.best_ckpt = tf.train.Checkpoint(transformer=self.transformer)
+        self.best_ckpt_manager = tf.train.CheckpointManager(self.best_ckpt, self.best_checkpoint_path, max_to_keep=1)
+
+        self.__create_decoders()
+
+        if teacher_model_path is not None and not inference:
+            self.__load_teacher()
+
+        # Start from the pruned model's weights, unless a checkpoint of this model is restored afterwards
+        if self.pruning_source is not None:
+            with self.strategy.scope():
+                self.__build_transformer()
+                prune_transformer(self.pruning_source.transformer, self.transformer)
+
+    @staticmethod
+    def __create_strategy(name: str = None):
+        """
+        Create a distribution strategy.
+
+        :param name: Strategy name. Either "mirrored", "multi_worker_mirrored" or `None` for the default
+            (single device) strategy.
+        :returns: Distribution strategy.
+        """
+
+        if name is None:
+            return tf.distribute.get_strategy()
+
+        if name == 'mirrored':
+            return tf.distribute.MirroredStrategy()
+
+        if name == 'multi_worker_mirrored':
+            return tf.distribute.MultiWorkerMirroredStrategy()
+
+        raise Exception(f'Unknown distribution strategy "{name}".')
+
+    def __is_chief(self) -> bool:
+        """Whether this process is the chief worker, which is responsible for saving checkpoints and logging."""
+
+        resolver = getattr(self.strategy, 'cluster_resolver', None)
+
+        if resolver is None or resolver.task_type is None:
+            return True
+
+        return resolver.task_type == 'chief' or (resolver.task_type == 'worker' and resolver.task_id == 0)
+
+    def __create_decoders(self):
+        """Create compiled decoding functions, traced once by `trace_decoder()`."""
+
+        self.__decode = tf.function(self.__greedy_decode, input_signature=[
+            tf.TensorSpec(shape=(None, None), dtype=tf.int32),
+            tf.TensorSpec(shape=(None,), dtype=tf.int32),
+        ])
+        self.__beam_search = tf.function(self.__beam_search_decode, input_signature=[
+            tf.TensorSpec(shape=(None, None), dtype=tf.int32),
+            tf.TensorSpec(shape=(None,), dtype=tf.int32),
+            tf.TensorSpec(shape=(), dtype=tf.int32),
+            tf.TensorSpec(shape=(), dtype=tf.float32),
+        ])
+
+    def __copy_tokenizers(self, model_path: str):
+        """
+        Copy the tokenizer vocabularies of another model to the model directory, unless they already exist.
+
+        :param model_path: Path to the other model's directory.
+        """
+
+        if not path.exists(path.join(model_path, 'hyperparams.json')):
+            raise Exception(f'Model at path "{model_path}" does not exist.')
+
+        os.makedirs(self.model_dir_path, exist_ok=True)
+
+        for name in ('src', 'tar'):
+            file_path = path.join(self.model_dir_path, f'{name}.subwords')
+
+            if not path.exists(file_path):
+                shutil.copy(path.join(model_path, f'{name}.subwords'), file_path)
+
+    def __load_model(self, model_path: str) -> 'Brain':
+        """
+        Load another trained model for inference, restored from its best checkpoint.
+
+        :param model_path: Path to the other model's directory.
+        :returns: Brain of the other model.
+        """
+
+        # The model only runs forward passes, so it doesn't need to be replicated
+        brain = Brain(self.lvp, self.hyperparams, model_path, enable_wandb=False, inference=True)
+        brain.restore_checkpoint(best=True)
+
+        if brain.model_id is None:
+            raise Exception(f'Model at path "{model_path}" has no checkpoints.')
+
+        return brain
+
+    def __validate_vocabularies(self, brain: 'Brain', model_path: str):
+        """
+        Validate that another model's tokenizer vocabularies are the same as this model's.
+
+        :param brain: Brain of the other model.
+        :param model_path: Path to the other model's directory.
+        """
+
+        if (brain.input_vocab_size, brain.target_vocab_size) != (self.input_vocab_size, self.target_vocab_size):
+            raise Exception(f'Tokenizer vocabularies of the model at path "{model_path}" differ.')
+
+    def __load_pruning_source(self, head_fraction: float, ffn_fraction: float):
+        """
+        Load the model to prune, and set this model's architecture to its pruned architecture.
+
+        :param head_fraction: Fraction of the attention heads of every attention layer to prune.
+        :param ffn_fraction: Fraction of the hidden units of every feed-forward network to prune.
+        """
+
+        if not 0 <= head_fraction < 1 or not 0 <= ffn_fraction < 1:
+            raise Exception('Pruning fractions must be at least 0 and less than 1.')
+
+        log(f'Loading model to prune from "{self.prune_model_path}"...')
+        self.pruning_source = self.__load_model(self.prune_model_path)
+        source = self.pruning_source.hyperparams
+
+        # Restored weights are only assigned once the transformer's variables are created, and are needed for scoring
+        self.pruning_source.__build_transformer()
+
+        # Remaining heads keep their dimensionality
+        self.hyperparams.num_layers = source.num_layers
+        self.hyperparams.d_model = source.d_model
+        self.hyperparams.max_seq_len = source.max_seq_len
+        self.hyperparams.head_depth = source.head_depth if source.head_depth is not None else \
+            source.d_model // source.num_heads
+        self.hyperparams.num_heads = max(1, source.num_heads - round(source.num_heads * head_fraction))
+        self.hyperparams.dff = max(1, source.dff - round(source.dff * ffn_fraction))
+
+        log(f'Pruning to {self.hyperparams.num_heads}/{source.num_heads} attention heads and '
+            f'{self.hyperparams.dff}/{source.dff} feed-forward network units per layer.')
+
+    def __load_teacher(self):
+        """Load the teacher model to distill from, restored from its best checkpoint."""
+
+        log(f'Loading teacher model from "{self.teacher_model_path}"...')
+        self.teacher = self.__load_model(self.teacher_model_path)
+        self.__validate_vocabularies(self.teacher, self.teacher_model_path)
+        log('Teacher model loaded.')
+
+    def __validate_dataset_paths(self):
+        """Validate that the training and validation dataset files exist."""
 
-        # Validate dataset paths
         if not path.exists(self.train_dataset_path):
             raise Exception(
                 f'Training dataset at path "{self.train_dataset_path}" does not exist.')
@@ -73,15 +419,201 @@ class Brain:
             raise Exception(
                 f'Validation dataset at path "{self.valid_dataset_path}" does not exist.')
 
-        # Load datasets
+    def __encode_example(self, lang1, lang2):
+        """
+        Encode a training example, adding the start and end tokens.
+
+        :param lang1: Source sequence.
+        :param lang2: Target sequence.
+        :returns: Tuple of source and target token IDs.
+        """
+
+        lang1 = [self.tokenizer_src.vocab_size] + self.tokenizer_src.encode(lang1) + [
+            self.tokenizer_src.vocab_size + 1]
+
+        lang2 = [self.tokenizer_tar.vocab_size] + self.tokenizer_tar.encode(lang2) + [
+            self.tokenizer_tar.vocab_size + 1]
+
+        return lang1, lang2
+
+    def __load_datasets(self):
+        """
+        Load and process the training and validation datasets.
+        Datasets preprocessed by `preprocess()` are used if available and encoded from the current datasets and
+        tokenizers, otherwise the CSV datasets are encoded on the fly.
+        """
+
+        train_prefix = path.join(self.preprocessed_path, 'train')
+        valid_prefix = path.join(self.preprocessed_path, 'valid')
+        has_preprocessed = has_token_shards(train_prefix) and has_token_shards(valid_prefix)
+
+        if has_preprocessed:
+            self.__validate_dataset_paths()
+            self.__load_tokenizers()
+            self.preprocessed_stale = self.__load_preprocessed_source() != self.__preprocessing_source()
+
+            if self.preprocessed_stale:
+                log(f'Preprocessed datasets in "{self.preprocessed_path}" were encoded from other datasets or '
+                    f'tokenizers, so they are ignored.', level=logging.WARNING)
+
+        if has_preprocessed and not self.preprocessed_stale:
+            log(f'Loading preprocessed datasets from "{self.preprocessed_path}"...')
+            train_encoded = load_token_shards(train_prefix)
+            val_encoded = load_token_shards(valid_prefix)
+        else:
+            self.__validate_dataset_paths()
+
+            if self.train_dataset_path == self.prepared_dataset_path:
+                log(f'Using prepared training dataset "{self.prepared_dataset_path}".')
+
+            # Load datasets
+            train_examples, val_examples = load_datasets(train_path=self.train_dataset_path,
+                                                         valid_path=self.valid_dataset_path)
+
+            # Load or build tokenizers
+            self.__load_tokenizers(build_dataset_path=self.train_dataset_path)
+
+            def tf_encode(pt, en):
+                result_pt, result_en = tf.py_function(
+                    lambda pt, en: self.__encode_example(pt.numpy(), en.numpy()), [pt, en], [tf.int64, tf.int64])
+                result_pt.set_shape([None])
+                result_en.set_shape([None])
+
+                return result_pt, result_en
+
+            train_encoded = train_examples.map(tf_encode)
+            val_encoded = val_examples.map(tf_encode)
+
+        def filter_max_len(pt, en):
+            return tf.logical_and(tf.size(pt) <= self.hyperparams.max_seq_len,
+                                  tf.size(en) <= self.hyperparams.max_seq_len)
+
+        # Training dataset. Shuffled and batched per epoch by `__epoch_dataset()`.
+        self.train_dataset = train_encoded.filter(filter_max_len)
+        self.train_dataset = self.train_dataset.cache()
+
+        # Validation dataset
+        self.val_dataset = self.__batch(val_encoded.filter(filter_max_len))
+
+    def __batch(self, dataset):
+        """Batch a dataset of encoded examples, bucketed by length if configured."""
+
+        return batch_by_length(dataset, self.hyperparams.batch_size, self.hyperparams.max_seq_len,
+                               bucket_boundaries=self.hyperparams.bucket_boundaries,
+                               tokens_per_batch=self.hyperparams.tokens_per_batch)
+
+    def __epoch_dataset(self, epoch: int):
+        """
+        Get the shuffled training batches of an epoch.
+        The shuffle is seeded by the epoch, so the batches of an interrupted epoch can be replayed in the same order
+        when training resumes.
+
+        :param epoch: Epoch index.
+        :returns: Training dataset.
+        """
+
+        dataset = self.train_dataset.shuffle(self.hyperparams.buffer_size, seed=epoch, reshuffle_each_iteration=False)
+
+        return self.__batch(dataset).prefetch(tf.data.experimental.AUTOTUNE)
+
+    def preprocess(self, num_shards: int = 8):
+        """
+        Encode the training and validation datasets once into sharded TFRecord files of token IDs, which are read in
+        parallel instead of encoding the CSV datasets during training.
+        Files are saved to the "preprocessed" directory in the model directory, since they depend on its tokenizers.
+
+        :param num_shards: Number of shards per dataset.
+        """
+
+        self.__validate_dataset_paths()
+        os.makedirs(self.preprocessed_path, exist_ok=True)
+
+        # Removed until all shards are written, so interrupted runs leave them stale
+        if path.exists(self.preprocessed_source_path):
+            os.remove(self.preprocessed_source_path)
+
         train_examples, val_examples = load_datasets(train_path=self.train_dataset_path,
                                                      valid_path=self.valid_dataset_path)
 
-        # Create tokenizers output directory (recursive)
-        src_tokenizer_prefix = path.join(self.model_dir_path, 'src')
-        tar_tokenizer_prefix = path.join(self.model_dir_path, 'tar')
+        for name, examples in (('train', train_examples), ('valid', val_examples)):
+            file_prefix = path.join(self.preprocessed_path, name)
 
-        os.makedirs(self.model_dir_path, exist_ok=True)
+            # Remove shards of a previous run, which may have a different shard count
+            for file_path in tf.io.gfile.glob(f'{file_prefix}-*.tfrecord'):
+                os.remove(file_path)
+
+            log(f'Preprocessing {name} dataset...')
+            count = write_token_shards(
+                (self.__encode_example(src.numpy(), tar.numpy()) for src, tar in examples),
+                file_prefix,
+                num_shards,
+            )
+            log(f'Preprocessed {count} {name} examples into {num_shards} shards.')
+
+        with open(self.preprocessed_source_path, 'w') as file:
+            json.dump(self.__preprocessing_source(), file, indent=2)
+
+        self.preprocessed_stale = False
+
+    def __preprocessing_source(self) -> dict:
+        """
+        Describe the datasets and tokenizers that `preprocess()` encodes, to detect stale preprocessed datasets.
+
+        :returns: Map of the training and validation dataset file fingerprints and the vocabulary sizes.
+        """
+
+        return {
+            'train': file_fingerprint(self.train_dataset_path),
+            'valid': file_fingerprint(self.valid_dataset_path),
+            'input_vocab_size': self.input_vocab_size,
+            'target_vocab_size': self.target_vocab_size,
+        }
+
+    def __load_preprocessed_source(self) -> Optional[dict]:
+        """
+        Load the description of the datasets and tokenizers the preprocessed datasets were encoded from.
+
+        :returns: Map saved by `preprocess()`, or `None` if there is none.
+        """
+
+        if not path.exists(self.preprocessed_source_path):
+            return None
+
+        with open(self.preprocessed_source_path) as file:
+            return json.load(file)
+
+    def __load_tokenizers(self, build_dataset_path: str = None, dir_path: str = None):
+        """
+        Load the source and target tokenizers, building them from the training dataset if they don't exist.
+
+        :param build_dataset_path: Path to the training dataset file to build missing tokenizers from. If `None`, the
+            tokenizers must already exist.
+        :param dir_path: Path to directory containing the tokenizer vocabularies. Defaults to the model directory.
+        """
+
+        dir_path = self.model_dir_path if dir_path is None else dir_path
+        src_tokenizer_prefix = path.join(dir_path, 'src')
+        tar_tokenizer_prefix = path.join(dir_path, 'tar')
+        missing = [p for p in (src_tokenizer_prefix, tar_tokenizer_prefix) if not path.exists(f'{p}.subwords')]
+
+        if build_dataset_path is None and missing:
+            raise Exception(f'Tokenizer vocabulary at path "{missing[0]}.subwords" does not exist.')
+
+        # Create tokenizers output directory (recursive)
+        os.makedirs(dir_path, exist_ok=True)
+
+        if missing:
+            if self.vocab_sample_size is None:
+                # Stream the whole corpus into each tokenizer, rather than keeping it in memory. The statistics are
+                # gathered by whichever pass runs to the end.
+                corpus_stats = dict()
+                src_corpus = (src for src, _ in read_examples(build_dataset_path, corpus_stats))
+                tar_corpus = (tar for _, tar in read_examples(build_dataset_path, corpus_stats))
+            else:
+                # Sample the corpus for both tokenizers in a single pass
+                log('Sampling corpus for tokenizers...')
+                src_corpus, tar_corpus, corpus_stats = sample_corpus(build_dataset_path, self.vocab_sample_size)
+                log(f'Sampled {corpus_stats["sampled_examples"]} of {corpus_stats["examples"]} examples.')
 
         if path.exists(f'{src_tokenizer_prefix}.subwords'):
             # Load source tokenizer
@@ -93,7 +625,7 @@ class Brain:
             # Build and save source tokenizer
             log('Building source tokenizer from corpus...')
             self.tokenizer_src = tfds.deprecated.text.SubwordTextEncoder.build_from_corpus(
-                (s.numpy() for s, _ in train_examples), target_vocab_size=2 ** 13)
+                src_corpus, target_vocab_size=2 ** 13)
             self.tokenizer_src.save_to_file(src_tokenizer_prefix)
 
         if path.exists(f'{tar_tokenizer_prefix}.subwords'):
@@ -105,46 +637,28 @@ class Brain:
             # Build and save target tokenizer
             log('Building target tokenizer from corpus...')
             self.tokenizer_tar = tfds.deprecated.text.SubwordTextEncoder.build_from_corpus(
-                (t.numpy() for _, t in train_examples), target_vocab_size=2 ** 13)
+                tar_corpus, target_vocab_size=2 ** 13)
             self.tokenizer_tar.save_to_file(tar_tokenizer_prefix)
 
         self.input_vocab_size = self.tokenizer_src.vocab_size + 2
         self.target_vocab_size = self.tokenizer_tar.vocab_size + 2
 
-        def encode(lang1, lang2):
-            lang1 = [self.tokenizer_src.vocab_size] + self.tokenizer_src.encode(lang1.numpy()) + [
-                self.tokenizer_src.vocab_size + 1]
-
-            lang2 = [self.tokenizer_tar.vocab_size] + self.tokenizer_tar.encode(lang2.numpy()) + [
-                self.tokenizer_tar.vocab_size + 1]
+        if missing:
+            # Save corpus statistics alongside the vocabularies
+            corpus_stats.setdefault('sampled_examples', corpus_stats['examples'])
+            corpus_stats['source']['vocab_size'] = self.tokenizer_src.vocab_size
+            corpus_stats['target']['vocab_size'] = self.tokenizer_tar.vocab_size
 
-            return lang1, lang2
-
-        def tf_encode(pt, en):
-            result_pt, result_en = tf.py_function(
-                encode, [pt, en], [tf.int64, tf.int64])
-            result_pt.set_shape([None])
-            result_en.set_shape([None])
-
-            return result_pt, result_en
-
-        # Training dataset
-        self.train_dataset = train_examples.map(tf_encode)
-        self.train_dataset = self.train_dataset.cache()
-        self.train_dataset = self.train_dataset.shuffle(self.hyperparams.buffer_size).padded_batch(
-            self.hyperparams.batch_size)
-        self.train_dataset = self.train_dataset.prefetch(
-            tf.data.experimental.AUTOTUNE)
-
-        # Validation dataset
-        self.val_dataset = val_examples.map(tf_encode)
+            with open(path.join(dir_path, 'corpus_stats.json'), 'w') as file:
+                json.dump(corpus_stats, file, indent=2)
 
     @staticmethod
     def create_padding_mask(seq):
         seq = tf.cast(tf.math.equal(seq, 0), tf.float32)
 
-        # Add extra dimensions to add the padding to the attention logits
-        return seq[:, tf.newaxis, tf.newaxis, :]  # (batch_size, 1, 1, seq_len)
+        # Add extra dimensions to add the padding to the attention logits. Reshaped rather than sliced with new axes,
+        # which TFLite's built-in ops don't support (see `quantize()`).
+        return tf.reshape(seq, [tf.shape(seq)[0], 1, 1, -1])  # (batch_size, 1, 1, seq_len)
 
     @staticmethod
     def loss_function(real, pred):
@@ -156,6 +670,30 @@ class Brain:
 
         return tf.reduce_sum(loss_) / tf.reduce_sum(mask)
 
+    @staticmethod
+    def distillation_loss_function(real, pred, teacher_pred, alpha: float, temperature: float):
+        """
+        Knowledge distillation loss. Weighs the cross-entropy loss on the targets against the KL divergence of the
+        student's predictions from the teacher's, both softened by the temperature.
+
+        :param real: Target token IDs. Shape: (batch_size, tar_seq_len)
+        :param pred: Student logits. Shape: (batch_size, tar_seq_len, target_vocab_size)
+        :param teacher_pred: Teacher logits. Shape: (batch_size, tar_seq_len, target_vocab_size)
+        :param alpha: Weight of the cross-entropy loss, between 0 and 1.
+        :param temperature: Softmax temperature.
+        :returns: Loss.
+        """
+
+        mask = tf.cast(tf.math.logical_not(tf.math.equal(real, 0)), tf.float32)
+
+        teacher_log_probs = tf.nn.log_softmax(tf.cast(teacher_pred, tf.float32) / temperature)
+        student_log_probs = tf.nn.log_softmax(tf.cast(pred, tf.float32) / temperature)
+        kl = tf.reduce_sum(tf.exp(teacher_log_probs) * (teacher_log_probs - student_log_probs), axis=-1)
+        kl = tf.reduce_sum(kl * mask) / tf.reduce_sum(mask)
+
+        # Scaled by the squared temperature, so gradient magnitudes don't depend on it
+        return alpha * Brain.loss_function(real, pred) + (1 - alpha) * temperature ** 2 * kl
+
     @staticmethod
     def accuracy_function(real, pred):
         accuracies = tf.equal(real, tf.argmax(pred, axis=2))
@@ -167,6 +705,16 @@ class Brain:
         mask = tf.cast(mask, dtype=tf.float32)
         return tf.reduce_sum(accuracies) / tf.reduce_sum(mask)
 
+    def __build_transformer(self):
+        """Create the transformer's variables by running it on a dummy batch."""
+
+        inp = tf.ones((1, 1), dtype=tf.int64)
+        tar = tf.ones((1, 1), dtype=tf.int64)
+        enc_padding_mask, combined_mask, dec_padding_mask = self.create_masks(inp, tar)
+
+        self.transformer((inp, tar), mask=[enc_padding_mask, combined_mask, dec_padding_mask], training=False,
+                         return_attention_weights=False)
+
     @staticmethod
     def create_masks(inp, tar):
         # Encoder padding mask
@@ -192,18 +740,371 @@ class Brain:
         mask = 1 - tf.linalg.band_part(tf.ones((size, size)), -1, 0)
         return mask  # (seq_len, seq_len)
 
-    def restore_checkpoint(self):
-        """Restore latest checkpoint."""
+    def restore_checkpoint(self, best: bool = False):
+        """
+        Restore latest checkpoint.
+
+        :param best: Whether to restore the checkpoint with the lowest validation loss instead, if there is one. Only
+            the weights are restored, not the optimizer state.
+        """
+
+        # Serving models already contain their weights
+        if self.serving_model_path is not None:
+            self.model_id = self.__get_model_id(path.join(self.serving_model_path, 'variables', 'variables.index'))
+
+            if self.quantized_decoder is not None:
+                self.model_id += ':int8'
+
+            return
+
+        # Keras 3 layers don't restore weights they haven't created yet, so the variables are created first
+        with self.strategy.scope():
+            self.__build_transformer()
+
+        if best and self.best_ckpt_manager.latest_checkpoint:
+            self.best_ckpt.restore(self.best_ckpt_manager.latest_checkpoint).expect_partial()
+            self.model_id = self.__get_model_id(f'{self.best_ckpt_manager.latest_checkpoint}.index')
+            log(f'Best checkpoint restored from "{self.best_checkpoint_path}".')
+        elif self.ckpt_manager.latest_checkpoint:
+            status = self.ckpt.restore(self.ckpt_manager.latest_checkpoint)
+
+            # Optimizer state is intentionally not restored in inference mode
+            if self.inference:
+                status.expect_partial()
 
-        if self.ckpt_manager.latest_checkpoint:
-            self.ckpt.restore(self.ckpt_manager.latest_checkpoint)
+            self.model_id = self.__get_model_id(f'{self.ckpt_manager.latest_checkpoint}.index')
             log(f'Latest checkpoint restored from "{self.checkpoint_path}".')
 
-    def train(self):
-        """Train translation neural network."""
+    def __get_model_id(self, weights_index_path: str) -> str:
+        """
+        Get the identity of the restored model and decoding config, used to key cached translations.
+
+        :param weights_index_path: Path to the index file of the restored weights, which contains a checksum of each
+            weight tensor.
+        """
+
+        with open(weights_index_path, 'rb') as file:
+            weights_digest = hashlib.sha256(file.read()).hexdigest()
+
+        return f'{weights_digest}:{self.hyperparams.precision}:{self.beam_width}:{self.length_penalty}:' \
+               f'{self.max_length_ratio}:{self.max_length_offset}'
+
+    def trace_decoder(self):
+        """Trace the compiled decoding function ahead of the first translation."""
+
+        # Quantized decoders are compiled ahead of time
+        if self.beam_width == 1 and self.quantized_decoder is not None:
+            return
+
+        log('Tracing decoder...')
+        if self.beam_width > 1:
+            self.__beam_search.get_concrete_function()
+        else:
+            self.__decode.get_concrete_function()
+
+        log('Decoder traced.')
+
+    def export(self, export_dir_path: str):
+        """
+        Export a serving model for inference.
+        The model contains the transformer weights (without optimizer state) and the compiled decoding function,
+        alongside the tokenizer vocabularies and model config, and the quantized decoder if quantized by `quantize()`.
+        Load it via `Brain(serving_model_path=...)`.
+
+        :param export_dir_path: Output directory path.
+        """
+
+        log(f'Exporting serving model to "{export_dir_path}"...')
+
+        module = tf.Module()
+        module.transformer = self.transformer
+        module.decode = self.__decode
+        module.beam_search = self.__beam_search
+        tf.saved_model.save(module, export_dir_path)
+
+        # Copy tokenizer vocabularies and save model config
+        for name in ('src', 'tar'):
+            shutil.copy(path.join(self.model_dir_path, f'{name}.subwords'), export_dir_path)
+
+        self.hyperparams.save(path.join(export_dir_path, 'hyperparams.json'))
+
+        if self.quantized_decoder is not None:
+            with open(path.join(export_dir_path, QUANTIZED_DECODER_FILE_NAME), 'wb') as file:
+                file.write(self.quantized_decoder.model)
+
+        log('Serving model exported.')
+
+    def benchmark_decode(self, sample_inputs: List[str]) -> Tuple[List[str], float]:
+        """
+        Measure the latency of translating sample input sequences, bypassing the translation cache. The decoder is
+        traced beforehand, so tracing isn't measured.
+
+        :param sample_inputs: Input sequences (e.g. a sample of the validation dataset).
+        :returns: Tuple of translations and latency in seconds.
+        """
+
+        cache = self.cache
+        self.cache = None
+
+        try:
+            self.trace_decoder()
+            start = time.time()
+            translations = self.translate_batch(sample_inputs)
+            return translations, time.time() - start
+        finally:
+            self.cache = cache
+
+    def quantize(self, sample_inputs: List[str]) -> dict:
+        """
+        Quantize the greedy decoder to INT8 for faster CPU inference, by converting it to a TFLite model with dynamic
+        range quantization (see `quantize_decoder()`). Greedy decoding then runs on the quantized model, while beam
+        search keeps running on the float model.
+        Export the quantized model via `export()`, then load it via `Brain(serving_model_path=...)`.
+
+        :param sample_inputs: Input sequences to compare the translations and latency of the float and quantized
+            models on (e.g. a sample of the validation dataset).
+        :returns: Comparison report of the float and quantized models.
+        """
+
+        if self.serving_model_path is not None:
+            raise Exception('Cannot quantize a serving model.')
+
+        if self.quantized_decoder is not None:
+            raise Exception('Brain is already quantized.')
+
+        # Greedy decoding is compared, since it's the only decoding the quantized model supports
+        beam_width = self.beam_width
+        self.beam_width = 1
+
+        try:
+            log(f'Translating {len(sample_inputs)} sample sequences with the float model...')
+            float_translations, float_latency = self.benchmark_decode(sample_inputs)
+            float_size = sum(v.numpy().nbytes for v in self.transformer.variables)
+
+            log('Quantizing model...')
+            self.quantized_decoder = QuantizedDecoder(self.__quantize_decoder(), MAX_DECODE_LENGTH)
+
+            log(f'Translating {len(sample_inputs)} sample sequences with the quantized model...')
+            quantized_translations, quantized_latency = self.benchmark_decode(sample_inputs)
+            quantized_size = len(self.quantized_decoder.model)
+        finally:
+            self.beam_width = beam_width
+
+        if self.model_id is not None:
+            self.model_id += ':int8'
+
+        matches = sum(f == q for f, q in zip(float_translations, quantized_translations))
+        report = {
+            'samples': len(sample_inputs),
+            'translation_match_rate': matches / max(len(sample_inputs), 1),
+            'float_latency_s': float_latency,
+            'quantized_latency_s': quantized_latency,
+            'speedup': float_latency / max(quantized_latency, 1e-9),
+            'float_weights_bytes': float_size,
+            'quantized_model_bytes': quantized_size,
+        }
+
+        log(f'Quantized model matches {matches}/{len(sample_inputs)} float translations, '
+            f'latency {float_latency:.3f}s --> {quantized_latency:.3f}s, '
+            f'size {float_size / 2 ** 20:.1f} MiB --> {quantized_size / 2 ** 20:.1f} MiB.')
+
+        return report
+
+    def __quantize_decoder(self) -> bytes:
+        """
+        Convert the greedy decoder to an INT8 quantized TFLite model.
+        The model runs the same decoding steps as `__greedy_decode()`, one at a time, with the decoding state flattened
+        into named tensors.
+
+        :returns: TFLite model.
+        """
+
+        # Cached keys and values of a dummy encoder output, for the cache's structure and shapes
+        cache_structure = self.transformer.decoder.init_cache(tf.zeros((1, 1, self.hyperparams.d_model)))
+        cache_specs = {f'cache_{i}': tf.TensorSpec([None, t.shape[1], None, t.shape[3]], t.dtype, name=f'cache_{i}')
+                       for i, t in enumerate(tf.nest.flatten(cache_structure))}
+
+        def flatten_state(state):
+            cache = tf.nest.flatten(state['cache'])
+            return {**{k: v for k, v in state.items() if k != 'cache'},
+                    **{f'cache_{i}': t for i, t in enumerate(cache)}}
+
+        def unflatten_state(state):
+            cache = [state[name] for name in cache_specs]
+            return {**{k: v for k, v in state.items() if k not in cache_specs},
+                    'cache': tf.nest.pack_sequence_as(cache_structure, cache)}
+
+        input_specs = {
+            'encoder_input': tf.TensorSpec([None, None], tf.int32, name='encoder_input'),
+            'max_lengths': tf.TensorSpec([None], tf.int32, name='max_lengths'),
+        }
+        state_specs = {
+            'step': tf.TensorSpec([], tf.int32, name='step'),
+            'last_id': tf.TensorSpec([None], tf.int32, name='last_id'),
+            'finished': tf.TensorSpec([None], tf.bool, name='finished'),
+            'stop_reasons': tf.TensorSpec([None], tf.int32, name='stop_reasons'),
+            'recent_ids': tf.TensorSpec([None, LOOP_WINDOW], tf.int32, name='recent_ids'),
+            **cache_specs,
+        }
+
+        # Cached keys and values of decoded tokens start empty, so they aren't output by the encoder (see
+        # `quantize_decoder()`)
+        empty_state = {f'cache_{i}' for i, t in enumerate(tf.nest.flatten(cache_structure)) if t.shape[2] == 0}
+
+        @tf.function(input_signature=[input_specs])
+        def encode(inputs):
+            state = flatten_state(self.__init_greedy_state(inputs['encoder_input']))
+            return {k: v for k, v in state.items() if k not in empty_state}
+
+        @tf.function(input_signature=[{**input_specs, **state_specs}])
+        def decode_step(inputs):
+            state = unflatten_state({k: v for k, v in inputs.items() if k not in input_specs})
+            return flatten_state(self.__greedy_step(state, inputs['encoder_input'], inputs['max_lengths']))
+
+        return quantize_decoder(encode, decode_step)
+
+    def evaluate(self, dataset) -> dict:
+        """
+        Evaluate the transformer's loss and accuracy on a dataset, given the target prefix (teacher forcing).
+
+        :param dataset: Dataset of batched, encoded examples (e.g. `val_dataset`).
+        :returns: Dictionary of the mean loss and accuracy over the dataset's batches.
+        """
+
+        @tf.function(input_signature=[tf.TensorSpec(shape=(None, None), dtype=tf.int64),
+                                      tf.TensorSpec(shape=(None, None), dtype=tf.int64)])
+        def evaluate_step(inp, tar):
+            tar_inp = tar[:, :-1]
+            tar_real = tar[:, 1:]
+
+            enc_padding_mask, combined_mask, dec_padding_mask = self.create_masks(inp, tar_inp)
+            predictions, _ = self.transformer((inp, tar_inp),
+                                              mask=[enc_padding_mask, combined_mask, dec_padding_mask],
+                                              training=False,
+                                              return_attention_weights=False)
+
+            return self.loss_function(tar_real, predictions), self.accuracy_function(tar_real, predictions)
+
+        loss = tf.keras.metrics.Mean()
+        accuracy = tf.keras.metrics.Mean()
+
+        for inp, tar in dataset:
+            batch_loss, batch_accuracy = evaluate_step(inp, tar)
+            loss(batch_loss)
+            accuracy(batch_accuracy)
+
+        return {'loss': float(loss.result()), 'accuracy': float(accuracy.result())}
+
+    def __compare(self, reference: 'Brain', sample_inputs: List[str], name: str, reference_name: str) -> dict:
+        """
+        Compare the quality, latency and size of this model to a reference model's.
+
+        :param reference: Reference model, with the same tokenizer vocabularies.
+        :param sample_inputs: Input sequences to compare the translations and latency of both models on.
+        :param name: Name of this model, prefixing its report keys.
+        :param reference_name: Name of the reference model, prefixing its report keys.
+        :returns: Comparison report.
+        """
+
+        def weights_size(brain):
+            return sum(v.numpy().nbytes for v in brain.transformer.variables)
+
+        log(f'Evaluating {name} and {reference_name} models on the validation dataset...')
+        metrics = self.evaluate(self.val_dataset)
+        reference_metrics = reference.evaluate(self.val_dataset)
+
+        log(f'Translating {len(sample_inputs)} sample sequences with the {reference_name} model...')
+        reference_translations, reference_latency = reference.benchmark_decode(sample_inputs)
+
+        log(f'Translating {len(sample_inputs)} sample sequences with the {name} model...')
+        translations, latency = self.benchmark_decode(sample_inputs)
+
+        matches = sum(t == r for t, r in zip(translations, reference_translations))
+        report = {
+            'samples': len(sample_inputs),
+            'translation_match_rate': matches / max(len(sample_inputs), 1),
+            f'{name}_val_loss': metrics['loss'],
+            f'{reference_name}_val_loss': reference_metrics['loss'],
+            f'{name}_val_accuracy': metrics['accuracy'],
+            f'{reference_name}_val_accuracy': reference_metrics['accuracy'],
+            f'{name}_latency_s': latency,
+            f'{reference_name}_latency_s': reference_latency,
+            'speedup': reference_latency / max(latency, 1e-9),
+            f'{name}_weights_bytes': weights_size(self),
+            f'{reference_name}_weights_bytes': weights_size(reference),
+        }
+
+        log(f'{name.capitalize()} model matches {matches}/{len(sample_inputs)} {reference_name} translations, '
+            f'validation accuracy {reference_metrics["accuracy"]:.4f} --> {metrics["accuracy"]:.4f}, '
+            f'latency {reference_latency:.3f}s --> {latency:.3f}s, '
+            f'weights {report[f"{reference_name}_weights_bytes"] / 2 ** 20:.1f} MiB --> '
+            f'{report[f"{name}_weights_bytes"] / 2 ** 20:.1f} MiB.')
+
+        return report
+
+    def distillation_report(self, sample_inputs: List[str]) -> dict:
+        """
+        Compare the quality, latency and size of the distilled model to its teacher's.
+
+        :param sample_inputs: Input sequences to compare the translations and latency of the student and teacher
+            models on (e.g. a sample of the validation dataset).
+        :returns: Comparison report of the student and teacher models.
+        """
+
+        if self.teacher is None:
+            raise Exception('Brain has no teacher model.')
+
+        return self.__compare(self.teacher, sample_inputs, 'student', 'teacher')
+
+    def pruning_report(self, sample_inputs: List[str]) -> dict:
+        """
+        Compare the quality, latency and size of the pruned model to the original model's.
+
+        :param sample_inputs: Input sequences to compare the translations and latency of the pruned and original
+            models on (e.g. a sample of the validation dataset).
+        :returns: Comparison report of the pruned and original models.
+        """
+
+        if self.pruning_source is None:
+            raise Exception('Brain has no model it was pruned from.')
+
+        return self.__compare(self.pruning_source, sample_inputs, 'pruned', 'original')
+
+    def train(self, metrics_interval: int = 10, metrics_path: str = None,
+              profile_batches: Optional[Tuple[int, int]] = None, max_steps: int = None, max_time: float = None):
+        """
+        Train translation neural network.
+
+        :param metrics_interval: Number of batches to aggregate throughput metrics (tokens/sec, input pipeline wait
+            versus compute time, etc.) over, before they are sent to wandb and the metrics file.
+        :param metrics_path: Path to a JSONL file to append throughput metrics to. Defaults to "train_metrics.jsonl" in
+            the model directory.
+        :param profile_batches: First and last batch of this run (counting from 1) to capture a profiler trace of. The
+            trace is saved to "profile" in the model directory, for TensorBoard's profile plugin.
+        :param max_steps: Total number of optimizer steps to stop training after, even if epochs remain.
+        :param max_time: Number of seconds of this run to stop training after, at the next optimizer step.
+        """
+
+        if self.inference:
+            raise Exception('Cannot train a Brain in inference mode.')
+
+        if self.preprocessed_stale:
+            raise Exception(f'Preprocessed datasets in "{self.preprocessed_path}" were encoded from other datasets or '
+                            f'tokenizers. Run the "preprocess" command again, or delete them to encode the datasets '
+                            f'during training.')
+
+        if self.quantized_decoder is not None:
+            raise Exception('Cannot train a quantized Brain.')
+
+        is_chief = self.__is_chief()
+        enable_wandb = self.enable_wandb and is_chief
+
+        # Save model config for inference
+        if is_chief:
+            self.hyperparams.save(self.hyperparams_path)
 
         # Initialize wandb
-        if self.enable_wandb:
+        if enable_wandb:
             wandb.init(project='theory', entity='joshnies-turring')
             config = wandb.config
             config.lvp = self.lvp.value
@@ -214,20 +1115,76 @@ class Brain:
             config.d_model = self.hyperparams.d_model
             config.dff = self.hyperparams.dff
             config.num_heads = self.hyperparams.num_heads
+            config.head_depth = self.hyperparams.head_depth
             config.dropout_rate = self.hyperparams.dropout_rate
+            config.bucket_boundaries = self.hyperparams.bucket_boundaries
+            config.tokens_per_batch = self.hyperparams.tokens_per_batch
+            config.accumulation_steps = self.hyperparams.accumulation_steps
+            config.precision = self.hyperparams.precision
+            config.validation_interval = self.hyperparams.validation_interval
+            config.early_stopping_patience = self.hyperparams.early_stopping_patience
+            config.checkpoint_interval = self.hyperparams.checkpoint_interval
             config.learning_rate_warmup_steps = self.learning_rate.warmup_steps
+            config.distribution_replicas = self.strategy.num_replicas_in_sync
+
+            if self.pruning_source is not None:
+                config.prune_model_path = self.prune_model_path
+
+            if self.teacher is not None:
+                config.teacher_model_path = self.teacher_model_path
+                config.distillation_alpha = self.hyperparams.distillation_alpha
+                config.distillation_temperature = self.hyperparams.distillation_temperature
+
+        accumulation_steps = self.hyperparams.accumulation_steps
+        loss_scaling = isinstance(self.optimizer, tf.keras.mixed_precision.LossScaleOptimizer)
+
+        if accumulation_steps < 1:
+            raise Exception('Gradient accumulation steps must be at least 1.')
+
+        with self.strategy.scope():
+            train_loss = tf.keras.metrics.Mean(name='train_loss')
+            train_accuracy = tf.keras.metrics.Mean(name='train_accuracy')
+            val_loss = tf.keras.metrics.Mean(name='val_loss')
+            val_accuracy = tf.keras.metrics.Mean(name='val_accuracy')
+
+            # Gradients summed over micro-batches, local to each replica until applied
+            accumulated_gradients = None
+
+            if accumulation_steps > 1:
+                self.__build_transformer()
+                accumulated_gradients = [
+                    tf.Variable(tf.zeros_like(v), trainable=False,
+                                synchronization=tf.VariableSynchronization.ON_READ,
+                                aggregation=tf.VariableAggregation.SUM)
+                    for v in self.transformer.trainable_variables
+                ]
+
+                # Checkpoints saved between optimizer steps (i.e. at the end of an epoch) keep the partially
+                # accumulated gradients. Restored when added, if the restored checkpoint has them.
+                self.accumulation.gradients = accumulated_gradients
+
+        # Split batches across replicas. Sharding by data rather than by file works for single-file CSV datasets too.
+        options = tf.data.Options()
+        options.experimental_distribute.auto_shard_policy = tf.data.experimental.AutoShardPolicy.DATA
+
+        def distribute_epoch_dataset(epoch):
+            return self.strategy.experimental_distribute_dataset(self.__epoch_dataset(epoch).with_options(options))
+
+        train_element_spec = distribute_epoch_dataset(0).element_spec
+        val_dataset = self.strategy.experimental_distribute_dataset(self.val_dataset.with_options(options))
+
+        # In multi-worker training every worker must save checkpoints, but only the chief's are kept
+        if is_chief:
+            ckpt_manager = self.ckpt_manager
+            best_ckpt_manager = self.best_ckpt_manager
+        else:
+            worker_checkpoint_path = path.join(self.checkpoint_path, f'worker_{self.strategy.cluster_resolver.task_id}')
+            ckpt_manager = tf.train.CheckpointManager(self.ckpt, worker_checkpoint_path, max_to_keep=1)
+            best_ckpt_manager = tf.train.CheckpointManager(self.best_ckpt, path.join(worker_checkpoint_path, 'best'),
+                                                           max_to_keep=1)
 
-        train_loss = tf.keras.metrics.Mean(name='train_loss')
-        train_accuracy = tf.keras.metrics.Mean(name='train_accuracy')
-
-        train_step_signature = [
-            tf.TensorSpec(shape=(None, None), dtype=tf.int64),
-            tf.TensorSpec(shape=(None, None), dtype=tf.int64),
-        ]
-
-        @tf.function(input_signature=train_step_signature)
         def train_step(inp, tar):
-            """Training step."""
+            """Training step of a single replica."""
 
             tar_inp = tar[:, :-1]
             tar_real = tar[:, 1:]
@@ -235,115 +1192,713 @@ class Brain:
             enc_padding_mask, combined_mask, dec_padding_mask = self.create_masks(
                 inp, tar_inp)
 
+            if self.teacher is not None:
+                teacher_predictions, _ = self.teacher.transformer((inp, tar_inp),
+                                                                  mask=[enc_padding_mask, combined_mask,
+                                                                        dec_padding_mask],
+                                                                  training=False,
+                                                                  return_attention_weights=False)
+
             with tf.GradientTape() as tape:
                 predictions, _ = self.transformer((inp, tar_inp),
                                                   mask=[
                                                       enc_padding_mask, combined_mask, dec_padding_mask],
-                                                  training=True)
-                loss = self.loss_function(tar_real, predictions)
+                                                  training=True,
+                                                  return_attention_weights=False)
+
+                if self.teacher is None:
+                    loss = self.loss_function(tar_real, predictions)
+                else:
+                    loss = self.distillation_loss_function(tar_real, predictions, teacher_predictions,
+                                                           self.hyperparams.distillation_alpha,
+                                                           self.hyperparams.distillation_temperature)
+
+                # Gradients are summed across replicas and micro-batches
+                scaled_loss = loss / (self.strategy.num_replicas_in_sync * accumulation_steps)
+
+                if loss_scaling:
+                    scaled_loss = self.optimizer.get_scaled_loss(scaled_loss)
 
             gradients = tape.gradient(
-                loss, self.transformer.trainable_variables)
-            self.optimizer.apply_gradients(
-                zip(gradients, self.transformer.trainable_variables))
+                scaled_loss, self.transformer.trainable_variables)
+
+            if loss_scaling:
+                gradients = self.optimizer.get_unscaled_gradients(gradients)
+
+            if accumulated_gradients is None:
+                self.optimizer.apply_gradients(
+                    zip(gradients, self.transformer.trainable_variables))
+            else:
+                for accumulated_gradient, gradient in zip(accumulated_gradients, gradients):
+                    accumulated_gradient.assign_add(tf.convert_to_tensor(gradient))
 
             train_loss(loss)
             train_accuracy(self.accuracy_function(tar_real, predictions))
 
-        step = 0
+            # Examples, non-padding and total tokens
+            examples = tf.shape(inp, out_type=tf.int64)[0]
+            real_tokens = tf.math.count_nonzero(inp) + tf.math.count_nonzero(tar)
+            padded_tokens = tf.size(inp, out_type=tf.int64) + tf.size(tar, out_type=tf.int64)
+
+            return examples, real_tokens, padded_tokens
+
+        @tf.function(input_signature=[train_element_spec])
+        def distributed_train_step(batch):
+            """Training step across all replicas."""
+
+            counts = self.strategy.run(train_step, args=batch)
+
+            return tuple(self.strategy.reduce(tf.distribute.ReduceOp.SUM, count, axis=None) for count in counts)
+
+        def apply_accumulated_gradients():
+            """Optimizer step of a single replica, using its accumulated gradients."""
+
+            self.optimizer.apply_gradients(
+                zip([g.read_value() for g in accumulated_gradients], self.transformer.trainable_variables))
+
+            for accumulated_gradient in accumulated_gradients:
+                accumulated_gradient.assign(tf.zeros_like(accumulated_gradient))
+
+        @tf.function
+        def distributed_apply_accumulated_gradients():
+            """Optimizer step across all replicas, using their accumulated gradients."""
+
+            self.strategy.run(apply_accumulated_gradients)
+
+        def val_step(inp, tar):
+            """Validation step of a single replica."""
+
+            tar_inp = tar[:, :-1]
+            tar_real = tar[:, 1:]
+
+            enc_padding_mask, combined_mask, dec_padding_mask = self.create_masks(
+                inp, tar_inp)
+
+            predictions, _ = self.transformer((inp, tar_inp),
+                                              mask=[enc_padding_mask, combined_mask, dec_padding_mask],
+                                              training=False,
+                                              return_attention_weights=False)
+
+            val_loss(self.loss_function(tar_real, predictions))
+            val_accuracy(self.accuracy_function(tar_real, predictions))
+
+        @tf.function(input_signature=[val_dataset.element_spec])
+        def distributed_val_step(batch):
+            """Validation step across all replicas."""
+
+            self.strategy.run(val_step, args=batch)
+
+        @tf.function(input_signature=[tf.TensorSpec(shape=(), dtype=tf.int32)])
+        def distributed_time_exhausted(exhausted):
+            """Whether any worker's time budget is exhausted, so all workers stop at the same step."""
+
+            exhausted = self.strategy.run(tf.identity, args=(exhausted,))
+            return self.strategy.reduce(tf.distribute.ReduceOp.SUM, exhausted, axis=None) > 0
+
+        # Validation passes since the validation loss last improved
+        stale_validations = 0
+
+        def validate(step):
+            """
+            Run a validation pass, keeping the checkpoint if its validation loss is the lowest so far.
+
+            :param step: Optimizer step.
+            :returns: Whether training should stop early.
+            """
+
+            nonlocal stale_validations
+
+            val_loss.reset_states()
+            val_accuracy.reset_states()
+
+            for inputs in val_dataset:
+                distributed_val_step(inputs)
+
+            loss = float(val_loss.result())
+            accuracy = float(val_accuracy.result())
+            log('Step {}\tValidation loss {:.4f}\tValidation accuracy {:.4f}'.format(step, loss, accuracy))
+            throughput.write({'step': step, 'val_loss': loss, 'val_accuracy': accuracy})
+
+            if enable_wandb:
+                wandb.log({
+                    'val_loss': loss,
+                    'val_accuracy': accuracy,
+                    'step': step,
+                })
+
+            if loss < float(self.best_val_loss.numpy()) - self.hyperparams.early_stopping_min_delta:
+                self.best_val_loss.assign(loss)
+                stale_validations = 0
+
+                best_ckpt_save_path = best_ckpt_manager.save(checkpoint_number=step)
+
+                if is_chief:
+                    log(f'Saving best checkpoint at {best_ckpt_save_path}')
+                else:
+                    shutil.rmtree(worker_checkpoint_path, ignore_errors=True)
+            else:
+                stale_validations += 1
+
+            patience = self.hyperparams.early_stopping_patience
+            return patience is not None and stale_validations >= patience
+
+        # Checkpoints are written in the background, except for non-chief workers which delete them right away
+        checkpoint_options = tf.train.CheckpointOptions(experimental_enable_async_checkpoint=is_chief)
+
+        def save_checkpoint(epoch, epoch_batches, step):
+            """
+            Save a checkpoint of the model, optimizer, accumulated gradients and training progress.
+
+            :param epoch: Epoch index.
+            :param epoch_batches: Number of the epoch's batches trained on.
+            :param step: Optimizer step.
+            :returns: Checkpoint path.
+            """
+
+            self.epoch.assign(epoch)
+            self.epoch_batches.assign(epoch_batches)
+            self.step.assign(step)
+            self.micro_batches.assign(micro_batches)
+
+            # Numbered by step, since asynchronous saves don't keep the checkpoint's save counter
+            ckpt_save_path = ckpt_manager.save(checkpoint_number=step, options=checkpoint_options)
+
+            if not is_chief:
+                shutil.rmtree(worker_checkpoint_path, ignore_errors=True)
+
+            return ckpt_save_path
+
+        # Resume from the restored training progress
+        first_epoch = int(self.epoch.numpy())
+        skip_batches = int(self.epoch_batches.numpy())
+        step = int(self.step.numpy())
+
+        # Micro-batches since the last optimizer step. Carried over between epochs.
+        micro_batches = int(self.micro_batches.numpy()) if accumulated_gradients is not None else 0
+        stop = False
+
+        if first_epoch >= self.hyperparams.epochs:
+            log(f'Model has already been trained for {first_epoch} epochs.', level=logging.WARNING)
+
+        # Whether the step or time budget is exhausted
+        run_start = time.time()
+        budget_exhausted = max_steps is not None and step >= max_steps
+
+        if budget_exhausted:
+            log(f'Model has already been trained for {step} steps.', level=logging.WARNING)
+
+        # Throughput metrics and profiling, of the chief only
+        if metrics_path is None:
+            metrics_path = path.join(self.model_dir_path, 'train_metrics.jsonl')
+
+        throughput = ThroughputMonitor(metrics_path if is_chief else None)
+        profile_path = path.join(self.model_dir_path, 'profile')
+        profiling = False
+
+        # Batches trained on by this run
+        run_batches = 0
 
         # Training routine
-        for epoch in range(self.hyperparams.epochs):
+        for epoch in range(first_epoch, first_epoch if budget_exhausted else self.hyperparams.epochs):
             start = time.time()
+            train_iterator = iter(distribute_epoch_dataset(epoch))
+
+            # Replay the batches the interrupted epoch was already trained on
+            if skip_batches > 0:
+                log(f'Resuming epoch {epoch + 1} after {skip_batches} batches...')
+
+                for _ in range(skip_batches):
+                    next(train_iterator)
 
             train_loss.reset_states()
             train_accuracy.reset_states()
 
-            for (batch, (inp, tar)) in enumerate(self.train_dataset):
-                train_step(inp, tar)
-                step += 1
+            # Non-padding and total tokens, for the padding efficiency of the epoch's batches
+            real_tokens = 0
+            padded_tokens = 0
+
+            wait_start = time.perf_counter()
+
+            for (batch, inputs) in enumerate(train_iterator, start=skip_batches):
+                compute_start = time.perf_counter()
+                run_batches += 1
+
+                if is_chief and profile_batches is not None and run_batches == profile_batches[0]:
+                    log(f'Capturing profiler trace to "{profile_path}"...')
+                    tf.profiler.experimental.start(profile_path)
+                    profiling = True
+
+                batch_examples, batch_real_tokens, batch_padded_tokens = distributed_train_step(inputs)
+                micro_batches += 1
+                optimizer_step = micro_batches >= accumulation_steps
+
+                if optimizer_step:
+                    if accumulated_gradients is not None:
+                        distributed_apply_accumulated_gradients()
+
+                    micro_batches = 0
+                    step += 1
+
+                # Reading the results waits for the step to finish
+                batch_examples, batch_real_tokens, batch_padded_tokens = \
+                    int(batch_examples), int(batch_real_tokens), int(batch_padded_tokens)
+                throughput.update(compute_start - wait_start, time.perf_counter() - compute_start, batch_examples,
+                                  batch_real_tokens, batch_padded_tokens)
+
+                if profiling and run_batches == profile_batches[1]:
+                    tf.profiler.experimental.stop()
+                    profiling = False
+                    log('Profiler trace captured.')
+
+                if throughput.steps == metrics_interval:
+                    metrics = {'epoch': epoch + 1, 'batch': batch, 'step': step, **throughput.summary()}
+                    throughput.write(metrics)
+                    throughput.reset()
+
+                    if enable_wandb:
+                        wandb.log(metrics)
+
+                if optimizer_step:
+                    validation_interval = self.hyperparams.validation_interval
+                    if validation_interval is not None and step % validation_interval == 0:
+                        stop = validate(step)
+
+                    checkpoint_interval = self.hyperparams.checkpoint_interval
+                    if checkpoint_interval is not None and step % checkpoint_interval == 0 and not stop:
+                        ckpt_save_path = save_checkpoint(epoch, batch + 1, step)
+
+                        if is_chief:
+                            log(f'Saving checkpoint for step {step} at {ckpt_save_path}')
+
+                    if max_steps is not None and step >= max_steps:
+                        budget_exhausted = True
+                    elif max_time is not None:
+                        budget_exhausted = bool(distributed_time_exhausted(
+                            tf.constant(int(time.time() - run_start >= max_time))))
+
+                real_tokens += batch_real_tokens
+                padded_tokens += batch_padded_tokens
 
                 if batch % 50 == 0:
                     log('Epoch {} Batch {} Loss {:.4f} Accuracy {:.4f}'.format(epoch + 1, batch, train_loss.result(),
                                                                                train_accuracy.result()))
 
-            # Save checkpoint
-            ckpt_save_path = self.ckpt_manager.save()
-            log('Saving checkpoint for epoch {} at {}'.format(
-                epoch + 1, ckpt_save_path))
+                if stop or budget_exhausted:
+                    break
+
+                wait_start = time.perf_counter()
+
+            skip_batches = 0
+            validation_interval = self.hyperparams.validation_interval
+
+            # Validate at the end of every epoch, or at the end of training if the last step wasn't validated
+            if validation_interval is None or (budget_exhausted and step % validation_interval != 0):
+                stop = validate(step)
+
+            # Save checkpoint. If the budget is exhausted mid-epoch, the rest of the epoch is trained on when resumed.
+            if budget_exhausted:
+                ckpt_save_path = save_checkpoint(epoch, batch + 1, step)
+
+                if is_chief:
+                    log(f'Saving checkpoint for step {step} at {ckpt_save_path}')
+            else:
+                ckpt_save_path = save_checkpoint(epoch + 1, 0, step)
+
+                if is_chief:
+                    log('Saving checkpoint for epoch {} at {}'.format(
+                        epoch + 1, ckpt_save_path))
 
             # Log epoch results
             loss = train_loss.result()
             accuracy = train_accuracy.result()
             time_taken = time.time() - start
-            log('Epoch {}\tLoss {:.4f}\tAccuracy {:.4f}'.format(
-                epoch + 1, loss, accuracy))
+            padding_efficiency = float(real_tokens / padded_tokens) if padded_tokens > 0 else 0
+            log('Epoch {}\tLoss {:.4f}\tAccuracy {:.4f}\tPadding efficiency {:.2%}'.format(
+                epoch + 1, loss, accuracy, padding_efficiency))
             log('Epoch took {}s\n'.format(time_taken))
 
-            if self.enable_wandb:
+            if enable_wandb:
                 wandb.log({
                     'epoch': epoch + 1,
                     'loss': loss,
                     'accuracy': accuracy,
                     'time_taken': time_taken,
+                    'padding_efficiency': padding_efficiency,
                     'step': step,
-                    'learning_rate': float(self.learning_rate(tf.Variable(step, dtype=tf.float32)))
+                    'learning_rate': float(self.learning_rate(step))
                 })
 
-            # TODO: Fix
-            # Stop training if loss is 0 and accuracy is 100%
-            # if loss == float(0) and accuracy == float(1):
-            #     log('🎯 Model has converged!')
-            #     break
-
-        log('🎉 Training complete!')
+            if stop:
+                log('🎯 Validation loss stopped improving, stopping early.')
+                break
 
-    def __evaluate(self, input):
-        """Evaluate model."""
+            if budget_exhausted:
+                log(f'⏱ Training budget exhausted after {step} steps, stopping.')
+                break
 
-        start_token = [self.tokenizer_src.vocab_size]
-        end_token = [self.tokenizer_src.vocab_size + 1]
+        if profiling:
+            tf.profiler.experimental.stop()
 
-        # Add the start and end token to input sequence
-        input = start_token + self.tokenizer_src.encode(input) + end_token
-        encoder_input = tf.expand_dims(input, 0)
+        # Write the metrics of the last, partial window
+        if throughput.steps > 0:
+            throughput.write({'step': step, **throughput.summary()})
 
-        # First token sent to the transformer should be the start token
-        decoder_input = [self.tokenizer_tar.vocab_size]
-        output = tf.expand_dims(decoder_input, 0)
+        throughput.close()
 
-        # NOTE: Arbitrary max length of 512
-        for _ in range(512):
-            enc_padding_mask, combined_mask, dec_padding_mask = self.create_masks(
-                encoder_input, output)
+        # Wait for checkpoints still being written
+        self.ckpt.sync()
 
-            # predictions.shape: (batch_size, seq_len, vocab_size)
-            predictions, _ = self.transformer((encoder_input, output),
-                                              mask=[
-                                                  enc_padding_mask, combined_mask, dec_padding_mask],
-                                              training=False)
+        # Continue with the best weights (e.g. for export)
+        if self.best_ckpt_manager.latest_checkpoint:
+            self.best_ckpt.restore(self.best_ckpt_manager.latest_checkpoint).expect_partial()
+            log('Best checkpoint restored (validation loss {:.4f}).'.format(float(self.best_val_loss.numpy())))
 
-            # Select the last word from the seq_len dimension
-            predictions = predictions[:, -1:, :]  # (batch_size, 1, vocab_size)
+        log('🎉 Training complete!')
 
-            predicted_id = tf.cast(tf.argmax(predictions, axis=-1), tf.int32)
+    def __greedy_decode(self, encoder_input, max_lengths):
+        """
+        Greedily decode a batch of encoded input sequences.
+        Compiled into a single graph (see `__init__`), so no per-token Python or eager dispatch overhead is incurred.
+
+        :param encoder_input: Padded encoder input. Shape: (batch_size, inp_seq_len)
+        :param max_lengths: Maximum decoded length of each sequence. Shape: (batch_size,)
+        :returns: Tuple of decoded target token IDs and stop reasons. Token IDs exclude the start token, and sequences
+            that stopped are padded with 0 afterwards. Shape of token IDs: (batch_size, decoded_len)
+            Shape of stop reasons: (batch_size,)
+        """
+
+        state = self.__init_greedy_state(encoder_input)
+        output_ids = tf.TensorArray(tf.int32, size=MAX_DECODE_LENGTH, element_shape=[None])
+
+        def cond(state, output_ids):
+            # Stop once every sequence has stopped
+            return tf.logical_not(tf.reduce_all(state['finished']))
+
+        def body(state, output_ids):
+            state = self.__greedy_step(state, encoder_input, max_lengths)
+            return state, output_ids.write(state['step'] - 1, state['last_id'])
+
+        # Cached keys and values grow along the sequence axis
+        state_shapes = tf.nest.map_structure(lambda t: t.shape, state)
+        state_shapes['cache'] = tf.nest.map_structure(
+            lambda t: tf.TensorShape([None, t.shape[1], None, t.shape[3]]), state['cache'])
+
+        state, output_ids = tf.while_loop(
+            cond,
+            body,
+            loop_vars=(state, output_ids),
+            shape_invariants=(state_shapes, tf.TensorShape(None)),
+            maximum_iterations=MAX_DECODE_LENGTH,
+        )
+
+        # (decoded_len, batch_size) --> (batch_size, decoded_len)
+        return tf.transpose(output_ids.gather(tf.range(state['step']))), state['stop_reasons']
+
+    def __init_greedy_state(self, encoder_input) -> dict:
+        """
+        Encode a batch of input sequences, and create the initial state of greedily decoding them.
+        The input is encoded once and the decoder's keys and values are cached, so each step only processes the newest
+        token.
+
+        :param encoder_input: Padded encoder input. Shape: (batch_size, inp_seq_len)
+        :returns: Decoding state of `__greedy_step()`.
+        """
+
+        batch_size = tf.shape(encoder_input)[0]
+        enc_output = self.transformer.encode(encoder_input, self.create_padding_mask(encoder_input))
+
+        return {
+            'step': tf.constant(0),
+            # First token sent to the transformer should be the start token
+            'last_id': tf.fill([batch_size], self.tokenizer_tar.vocab_size),
+            'finished': tf.zeros([batch_size], dtype=tf.bool),
+            'stop_reasons': tf.fill([batch_size], STOP_MAX_LENGTH),
+            'recent_ids': tf.fill([batch_size, LOOP_WINDOW], -1),
+            'cache': self.transformer.decoder.init_cache(enc_output),
+        }
+
+    def __greedy_step(self, state: dict, encoder_input, max_lengths) -> dict:
+        """
+        Greedily decode the next token of a batch of sequences.
+
+        :param state: Decoding state, created by `__init_greedy_state()`.
+        :param encoder_input: Padded encoder input. Shape: (batch_size, inp_seq_len)
+        :param max_lengths: Maximum decoded length of each sequence. Shape: (batch_size,)
+        :returns: Next decoding state, of which `last_id` holds the predicted token IDs. Sequences that already stopped
+            are predicted 0.
+        """
+
+        step = state['step']
+        finished = state['finished']
+        end_token = self.tokenizer_tar.vocab_size + 1
+
+        # predictions.shape: (batch_size, 1, vocab_size)
+        predictions, _, cache = self.transformer.decode_step(
+            state['last_id'][:, tf.newaxis], state['cache'], step, self.create_padding_mask(encoder_input))
+
+        predicted_id = tf.cast(tf.argmax(predictions[:, -1, :], axis=-1), tf.int32)  # (batch_size,)
+
+        # Pad sequences that have already stopped
+        predicted_id = tf.where(finished, tf.zeros_like(predicted_id), predicted_id)
+        recent_ids = tf.concat([state['recent_ids'][:, 1:], predicted_id[:, tf.newaxis]], axis=-1)
+
+        # Stop sequences that emitted the end token, are stuck in a loop, or reached their max length
+        is_end = tf.logical_and(tf.logical_not(finished), tf.equal(predicted_id, end_token))
+        is_loop = tf.logical_and(
+            tf.logical_not(tf.logical_or(finished, is_end)),
+            detect_loops(recent_ids, step + 1, LOOP_MAX_PERIOD, LOOP_MIN_REPEATS, LOOP_MIN_SPAN))
+        stop_reasons = tf.where(is_end, STOP_END_TOKEN, tf.where(is_loop, STOP_LOOP, state['stop_reasons']))
+        finished = tf.reduce_any([finished, is_end, is_loop, step + 1 >= max_lengths], axis=0)
+
+        return {
+            'step': step + 1,
+            'last_id': predicted_id,
+            'finished': finished,
+            'stop_reasons': stop_reasons,
+            'recent_ids': recent_ids,
+            'cache': cache,
+        }
+
+    def __beam_search_decode(self, encoder_input, max_lengths, beam_width, length_penalty):
+        """
+        Decode a batch of encoded input sequences using beam search.
+        All beams are decoded together as a single batch of `batch_size * beam_width` sequences. Candidates are ranked
+        by their length-normalized log probability, and decoding stops once every beam has stopped.
+
+        :param encoder_input: Padded encoder input. Shape: (batch_size, inp_seq_len)
+        :param max_lengths: Maximum decoded length of each sequence. Shape: (batch_size,)
+        :param beam_width: Number of beams per input sequence.
+        :param length_penalty: Length penalty exponent (alpha).
+        :returns: Tuple of decoded target token IDs and stop reasons of the best beam for each input. Token IDs exclude
+            the start token, and sequences that stopped are padded with 0 afterwards.
+            Shape of token IDs: (batch_size, decoded_len)
+            Shape of stop reasons: (batch_size,)
+        """
+
+        batch_size = tf.shape(encoder_input)[0]
+        start_token = self.tokenizer_tar.vocab_size
+        end_token = self.tokenizer_tar.vocab_size + 1
+        vocab_size = self.target_vocab_size
+
+        # Large negative log probability used instead of -inf to avoid NaNs
+        neg_inf = -1e9
+
+        def length_normalize(log_probs, lengths):
+            # GNMT length penalty: ((5 + length) / 6) ^ alpha
+            penalty = tf.pow((5. + tf.cast(lengths, tf.float32)) / 6., length_penalty)
+            return log_probs / penalty
+
+        def merge_beams(t):
+            # (batch_size, beam_width, ...) --> (batch_size * beam_width, ...)
+            return tf.reshape(t, tf.concat([[batch_size * beam_width], tf.shape(t)[2:]], axis=0))
+
+        def split_beams(t):
+            # (batch_size * beam_width, ...) --> (batch_size, beam_width, ...)
+            return tf.reshape(t, tf.concat([[batch_size, beam_width], tf.shape(t)[1:]], axis=0))
+
+        # Encode input once and repeat it for each beam
+        encoder_input = tf.repeat(encoder_input, beam_width, axis=0)
+        padding_mask = self.create_padding_mask(encoder_input)
+        enc_output = self.transformer.encode(encoder_input, padding_mask)
+        cache = self.transformer.decoder.init_cache(enc_output)
+
+        # Only the first beam starts alive, so the first step doesn't expand identical beams
+        seqs = tf.zeros([batch_size, beam_width, 0], dtype=tf.int32)
+        log_probs = tf.tile(tf.concat([[0.], tf.fill([beam_width - 1], neg_inf)], axis=0)[tf.newaxis, :],
+                            [batch_size, 1])
+        lengths = tf.zeros([batch_size, beam_width], dtype=tf.int32)
+        finished = tf.zeros([batch_size, beam_width], dtype=tf.bool)
+        stop_reasons = tf.fill([batch_size, beam_width], STOP_MAX_LENGTH)
+        last_id = tf.fill([batch_size * beam_width], start_token)
+
+        def cond(step, last_id, seqs, log_probs, lengths, finished, stop_reasons, cache):
+            # Stop once every beam has stopped
+            return tf.logical_not(tf.reduce_all(finished))
+
+        def body(step, last_id, seqs, log_probs, lengths, finished, stop_reasons, cache):
+            # predictions.shape: (batch_size * beam_width, 1, vocab_size)
+            predictions, _, cache = self.transformer.decode_step(last_id[:, tf.newaxis], cache, step, padding_mask)
+            token_log_probs = split_beams(tf.nn.log_softmax(predictions[:, -1, :]))  # (batch_size, beam, vocab)
+
+            # Finished beams may only be continued with padding, at no cost
+            pad_only = tf.concat([[0.], tf.fill([vocab_size - 1], neg_inf)], axis=0)
+            token_log_probs = tf.where(finished[:, :, tf.newaxis], pad_only, token_log_probs)
+
+            # Score every (beam, token) candidate
+            candidate_log_probs = log_probs[:, :, tf.newaxis] + token_log_probs
+            candidate_lengths = tf.where(finished, lengths, lengths + 1)[:, :, tf.newaxis]
+            candidate_scores = length_normalize(candidate_log_probs, candidate_lengths)
+
+            # Keep the best candidates across all beams
+            _, top_indices = tf.math.top_k(tf.reshape(candidate_scores, [batch_size, -1]), k=beam_width)
+            beam_indices = top_indices // vocab_size
+            token_ids = tf.cast(top_indices % vocab_size, tf.int32)
+
+            log_probs = tf.gather(tf.reshape(candidate_log_probs, [batch_size, -1]), top_indices, batch_dims=1)
+            lengths = tf.gather(candidate_lengths[:, :, 0], beam_indices, batch_dims=1)
+            seqs = tf.concat([tf.gather(seqs, beam_indices, batch_dims=1), token_ids[:, :, tf.newaxis]], axis=-1)
+            finished = tf.gather(finished, beam_indices, batch_dims=1)
+            stop_reasons = tf.gather(stop_reasons, beam_indices, batch_dims=1)
+
+            # Stop beams that emitted the end token, are stuck in a loop, or reached their max length
+            recent_ids = tf.pad(seqs, [[0, 0], [0, 0], [LOOP_WINDOW, 0]], constant_values=-1)[:, :, -LOOP_WINDOW:]
+            is_loop = tf.reshape(
+                detect_loops(tf.reshape(recent_ids, [-1, LOOP_WINDOW]), step + 1, LOOP_MAX_PERIOD, LOOP_MIN_REPEATS,
+                             LOOP_MIN_SPAN),
+                [batch_size, beam_width])
+            is_end = tf.logical_and(tf.logical_not(finished), tf.equal(token_ids, end_token))
+            is_loop = tf.logical_and(tf.logical_not(tf.logical_or(finished, is_end)), is_loop)
+            stop_reasons = tf.where(is_end, STOP_END_TOKEN, tf.where(is_loop, STOP_LOOP, stop_reasons))
+            finished = tf.reduce_any([finished, is_end, is_loop, lengths >= max_lengths[:, tf.newaxis]], axis=0)
+
+            # Reorder self-attention caches to follow their beams
+            for layer_cache in cache:
+                layer_cache['self'] = tf.nest.map_structure(
+                    lambda t: merge_beams(tf.gather(split_beams(t), beam_indices, batch_dims=1)),
+                    layer_cache['self'])
+
+            return step + 1, tf.reshape(token_ids, [-1]), seqs, log_probs, lengths, finished, stop_reasons, cache
+
+        # Sequences and cached keys and values grow along the sequence axis
+        cache_shapes = tf.nest.map_structure(lambda t: tf.TensorShape([None, t.shape[1], None, t.shape[3]]), cache)
+
+        _, _, seqs, log_probs, lengths, _, stop_reasons, _ = tf.while_loop(
+            cond,
+            body,
+            loop_vars=(tf.constant(0), last_id, seqs, log_probs, lengths, finished, stop_reasons, cache),
+            shape_invariants=(tf.TensorShape([]), last_id.shape, tf.TensorShape([None, None, None]),
+                              log_probs.shape, lengths.shape, finished.shape, stop_reasons.shape, cache_shapes),
+            maximum_iterations=MAX_DECODE_LENGTH,
+        )
+
+        # Select the best beam of each input sequence
+        best_beams = tf.argmax(length_normalize(log_probs, lengths), axis=-1, output_type=tf.int32)
+        return tf.gather(seqs, best_beams, batch_dims=1), tf.gather(stop_reasons, best_beams, batch_dims=1)
+
+    def reset_decode_stats(self):
+        """Reset decoding statistics."""
+
+        self.decode_stats = {
+            'cache_hits': 0,
+            'cache_misses': 0,
+            'sequences': 0,
+            'max_length_stops': 0,
+            'loop_stops': 0,
+        }
+
+    def __update_decode_stats(self, input: str, stop_reason: int):
+        """
+        Update decoding statistics for a decoded sequence.
+
+        :param input: Input sequence.
+        :param stop_reason: Reason decoding of the sequence stopped.
+        """
+
+        self.decode_stats['sequences'] += 1
+
+        if stop_reason == STOP_MAX_LENGTH:
+            self.decode_stats['max_length_stops'] += 1
+            log(f'Decoding reached max length for input: {input}', level=logging.DEBUG)
+        elif stop_reason == STOP_LOOP:
+            self.decode_stats['loop_stops'] += 1
+            log(f'Decoding stopped on a repetition loop for input: {input}', level=logging.DEBUG)
+
+    def log_decode_stats(self):
+        """Log decoding statistics."""
+
+        stats = self.decode_stats
+
+        if self.cache is not None and stats['cache_hits'] + stats['cache_misses'] > 0:
+            log(f'Translation cache: {stats["cache_hits"]} hits, {stats["cache_misses"]} misses.')
+
+        if stats['sequences'] == 0:
+            return
+
+        log(f'Decoded {stats["sequences"]} sequences: {stats["max_length_stops"]} reached max length, '
+            f'{stats["loop_stops"]} stopped on a repetition loop.')
 
-            # Return result if "predicted_id" is the end token
-            if predicted_id == self.tokenizer_tar.vocab_size + 1:
-                return tf.squeeze(output, axis=0)
+    def translate(self, input: str) -> str:
+        """Translate input sequence to target LVP."""
 
-            # Concatenate the predicted_id to the output which is given to the decoder
-            # as its input.
-            output = tf.concat([output, predicted_id], axis=-1)
+        return self.translate_batch([input])[0]
 
-        return tf.squeeze(output, axis=0)
+    def translate_batch(self, inputs: List[str], batch_size: int = 64) -> List[str]:
+        """
+        Translate multiple input sequences to target LVP.
 
-    def translate(self, input: str) -> str:
-        """Translate input sequence to target LVP."""
+        Inputs are deduplicated and sorted by encoded length so each batch is padded only up to the length of its
+        longest member. Cached translations are reused if a translation cache is enabled.
 
-        # Translate
-        result = self.__evaluate(input.strip())
-        result = self.tokenizer_tar.decode(
-            [i for i in result if i < self.tokenizer_tar.vocab_size])
+        :param inputs: Input sequences.
+        :param batch_size: Maximum number of sequences decoded together.
+        :returns: Translated sequences, in the same order as `inputs`.
+        """
 
-        return result
+        start_token = [self.tokenizer_src.vocab_size]
+        end_token = [self.tokenizer_src.vocab_size + 1]
+        tar_end_token = self.tokenizer_tar.vocab_size + 1
+
+        unique_inputs = list(dict.fromkeys(i.strip() for i in inputs))
+        translations = dict()
+
+        # Only decode inputs missing from the translation cache
+        use_cache = self.cache is not None and self.model_id is not None
+        if use_cache:
+            translations = self.cache.get_many(self.model_id, unique_inputs)
+            self.decode_stats['cache_hits'] += len(translations)
+            self.decode_stats['cache_misses'] += len(unique_inputs) - len(translations)
+            unique_inputs = [i for i in unique_inputs if i not in translations]
+
+        # Add the start and end token to each unique input sequence
+        encoded = [start_token + self.tokenizer_src.encode(i) + end_token for i in unique_inputs]
+
+        # Truncate inputs beyond the positional encoding table size
+        max_seq_len = self.hyperparams.max_seq_len
+        for idx, e in enumerate(encoded):
+            if len(e) > max_seq_len:
+                log(f'Input exceeds max sequence length of {max_seq_len} tokens and was truncated: '
+                    f'{unique_inputs[idx]}', level=logging.WARNING)
+                encoded[idx] = e[:max_seq_len - 1] + end_token
+
+        # Decoded sequences (including the start token) are limited by the positional encoding table size too
+        max_decode_length = min(MAX_DECODE_LENGTH, max_seq_len - 1)
+
+        # Bucket by length so similarly sized sequences share a batch
+        order = sorted(range(len(encoded)), key=lambda idx: len(encoded[idx]))
+
+        for batch_start in range(0, len(order), batch_size):
+            batch_indices = order[batch_start:batch_start + batch_size]
+            max_len = max(len(encoded[idx]) for idx in batch_indices)
+
+            encoder_input = np.zeros((len(batch_indices), max_len), dtype=np.int32)
+            for row, idx in enumerate(batch_indices):
+                encoder_input[row, :len(encoded[idx])] = encoded[idx]
+
+            # Limit decoded length relative to the input length
+            max_lengths = np.array([
+                min(max_decode_length, math.ceil(len(encoded[idx]) * self.max_length_ratio) + self.max_length_offset)
+                for idx in batch_indices
+            ], dtype=np.int32)
+
+            if self.beam_width > 1:
+                results, stop_reasons = self.__beam_search(tf.constant(encoder_input), tf.constant(max_lengths),
+                                                           self.beam_width, self.length_penalty)
+            elif self.quantized_decoder is not None:
+                results, stop_reasons = self.quantized_decoder(encoder_input, max_lengths)
+            else:
+                results, stop_reasons = self.__decode(tf.constant(encoder_input), tf.constant(max_lengths))
+
+            for idx, result, stop_reason in zip(batch_indices, results.numpy().tolist(), stop_reasons.numpy()):
+                self.__update_decode_stats(unique_inputs[idx], stop_reason)
+
+                # Strip everything from the end token onward
+                if tar_end_token in result:
+                    result = result[:result.index(tar_end_token)]
+
+                translations[unique_inputs[idx]] = self.tokenizer_tar.decode(
+                    [i for i in result if i < self.tokenizer_tar.vocab_size])
+
+        if use_cache:
+            self.cache.put_many(self.model_id, {i: translations[i] for i in unique_inputs})
+
+        return [translations[i.strip()] for i in inputs]
@@ -52,17 +52,81 @@ def scaled_dot_product_attention(q, k, v, mask):
 
     matmul_qk = tf.matmul(q, k, transpose_b=True)  # (..., seq_len_q, seq_len_k)
 
-    # Scale matmul_qk
+    # Scale matmul_qk. The logits are kept in float32 under mixed precision, since the mask constant overflows 16-bit
+    # types and the softmax loses precision in them.
     dk = tf.cast(tf.shape(k)[-1], tf.float32)
-    scaled_attention_logits = matmul_qk / tf.math.sqrt(dk)
+    scaled_attention_logits = tf.cast(matmul_qk, tf.float32) / tf.math.sqrt(dk)
 
     # Add the mask to the scaled tensor
     if mask is not None:
-        scaled_attention_logits += (mask * -1e9)
+        scaled_attention_logits += (tf.cast(mask, tf.float32) * -1e9)
 
     # Softmax is normalized on the last axis (seq_len_k) so that the scores add up to 1.
     attention_weights = tf.nn.softmax(scaled_attention_logits, axis=-1)  # (..., seq_len_q, seq_len_k)
+    attention_weights = tf.cast(attention_weights, v.dtype)
 
     output = tf.matmul(attention_weights, v)  # (..., seq_len_q, depth_v)
 
     return output, attention_weights
+
+
+def einsum_attention(q, k, v, mask):
+    """
+    Scaled dot product attention without materializing the attention weights for the caller, with the queries and
+    output in (batch_size, seq_len, num_heads, depth) layout. Equivalent to `scaled_dot_product_attention()`, but saves
+    the transposes of the queries and output around it.
+
+    :param q: Queries. Shape: (batch_size, seq_len_q, num_heads, depth)
+    :param k: Keys. Shape: (batch_size, num_heads, seq_len_k, depth)
+    :param v: Values. Shape: (batch_size, num_heads, seq_len_v, depth_v)
+    :param mask: Float tensor with shape broadcastable to (batch_size, num_heads, seq_len_q, seq_len_k), or `None`.
+    :returns: Output. Shape: (batch_size, seq_len_q, num_heads, depth_v)
+    """
+
+    # Logits and softmax in float32, as in `scaled_dot_product_attention()`
+    logits = tf.cast(tf.einsum('bqhd,bhkd->bhqk', q, k), tf.float32)
+    logits /= tf.math.sqrt(tf.cast(tf.shape(k)[-1], tf.float32))
+
+    if mask is not None:
+        logits += (tf.cast(mask, tf.float32) * -1e9)
+
+    weights = tf.cast(tf.nn.softmax(logits, axis=-1), v.dtype)
+
+    return tf.einsum('bhqk,bhkd->bqhd', weights, v)
+
+
+def loop_span(period, min_repeats, min_span):
+    """Get the number of trailing tokens checked for a repeating pattern of the given period."""
+
+    return period * max(min_repeats, -(-min_span // period))
+
+
+def detect_loops(recent, length, max_period, min_repeats, min_span):
+    """Detect sequences whose most recent tokens are a short pattern repeated over and over.
+    A pattern of `period` tokens must repeat at least `min_repeats` times and span at least `min_span` tokens, so
+    shorter patterns need more repeats.
+
+    Args:
+      recent: Most recent tokens of each sequence, oldest first.
+              Shape == (batch_size, window), where window >= loop_span(max_period, ...).
+      length: Number of tokens generated so far.
+      max_period: Longest pattern length to check.
+      min_repeats: Minimum number of consecutive repeats.
+      min_span: Minimum number of tokens spanned by the repeats.
+
+    Returns:
+      Boolean tensor with shape (batch_size,)
+    """
+
+    window = recent.shape[-1]
+    detected = tf.zeros(tf.shape(recent)[:1], dtype=tf.bool)
+
+    for period in range(1, max_period + 1):
+        span = loop_span(period, min_repeats, min_span)
+        tail = recent[:, window - span:]
+
+        # A span is periodic if it equals itself shifted by one period
+        periodic = tf.reduce_all(tf.equal(tail[:, period:], tail[:, :-period]), axis=-1)
+        detected = tf.logical_or(detected, tf.logical_and(periodic, length >= span))
+
+    return detected
@@ -19,10 +19,12 @@ class CustomSchedule(tf.keras.optimizers.schedules.LearningRateSchedule):
 
     def __call__(self, step):
         """
-        :param step: Training step number.
+        :param step: Optimizer step number.
         :return: Learning rate.
         """
 
+        step = tf.cast(step, tf.float32)
+
         arg1 = tf.math.rsqrt(step)
         arg2 = step * (self.warmup_steps ** -1.5)
 
@@ -1,3 +1,10 @@
+import csv
+import hashlib
+import math
+import os
+import random
+from typing import Iterator, List, Tuple
+
 import tensorflow as tf
 
 
@@ -15,3 +22,358 @@ def load_datasets(train_path: str, valid_path: str):
     valid_dataset = tf.data.experimental.CsvDataset(valid_path, record_defaults)
 
     return train_dataset, valid_dataset
+
+
+def load_sources(dataset_path: str, limit: int = None) -> List[str]:
+    """
+    Load source sequences of a dataset.
+
+    :param dataset_path: Path to dataset file.
+    :param limit: Maximum number of sequences to load. If `None`, all sequences are loaded.
+    :returns: List of source sequences.
+    """
+
+    dataset = tf.data.experimental.CsvDataset(dataset_path, ['', ''])
+
+    if limit is not None:
+        dataset = dataset.take(limit)
+
+    return [src.numpy().decode('utf-8') for src, _ in dataset]
+
+
+def read_examples(dataset_path: str, stats: dict = None) -> Iterator[Tuple[str, str]]:
+    """
+    Stream the examples of a dataset file, without keeping them in memory.
+
+    :param dataset_path: Path to dataset file.
+    :param stats: Dictionary to add corpus statistics to once all examples are read, if any.
+    :returns: Iterator of tuples of source and target sequences.
+    """
+
+    count = 0
+    chars = [0, 0]
+    max_chars = [0, 0]
+
+    with open(dataset_path, newline='', encoding='utf-8') as file:
+        for row in csv.reader(file):
+            if len(row) < 2:
+                continue
+
+            for i, sequence in enumerate(row[:2]):
+                chars[i] += len(sequence)
+                max_chars[i] = max(max_chars[i], len(sequence))
+
+            count += 1
+            yield row[0], row[1]
+
+    if stats is not None:
+        stats['examples'] = count
+
+        for i, side in enumerate(('source', 'target')):
+            stats[side] = {
+                'characters': chars[i],
+                'mean_length': chars[i] / count if count > 0 else 0,
+                'max_length': max_chars[i],
+            }
+
+
+def sample_corpus(dataset_path: str, sample_size: int, seed: int = 0) -> Tuple[List[str], List[str], dict]:
+    """
+    Read a dataset in a single streaming pass, keeping a uniform random sample of its examples (reservoir sampling)
+    and gathering corpus statistics.
+
+    :param dataset_path: Path to dataset file.
+    :param sample_size: Maximum number of examples to sample.
+    :param seed: Random seed of the sample.
+    :returns: Tuple of sampled source sequences, sampled target sequences and corpus statistics.
+    """
+
+    rng = random.Random(seed)
+    sample = []
+    stats = dict()
+
+    for count, example in enumerate(read_examples(dataset_path, stats)):
+        if count < sample_size:
+            sample.append(example)
+        else:
+            # Replace a random sampled example, so each example is kept with probability sample_size / count
+            index = rng.randint(0, count)
+            if index < sample_size:
+                sample[index] = example
+
+    stats['sampled_examples'] = len(sample)
+
+    return [src for src, _ in sample], [tar for _, tar in sample], stats
+
+
+# Number of copies kept of a training example that occurs `count` times, by duplicate weighting
+DUPLICATE_WEIGHTINGS = {
+    'log': lambda count: 1 + int(math.log2(count)),
+    'sqrt': lambda count: max(1, round(math.sqrt(count))),
+}
+
+# Handling of examples exceeding the max length
+LONG_ROWS = ('drop', 'split')
+
+
+def split_example(src: str, tar: str, max_length: int) -> List[Tuple[str, str]]:
+    """
+    Split an example into shorter examples of consecutive lines, if its source and target have the same number of
+    lines. Lines are assumed to be aligned between source and target.
+
+    :param src: Source sequence.
+    :param tar: Target sequence.
+    :param max_length: Max length of the split sequences, in characters.
+    :returns: List of split examples, or an empty list if the example can't be split within the max length.
+    """
+
+    src_lines = src.split('\n')
+    tar_lines = tar.split('\n')
+
+    if len(src_lines) != len(tar_lines):
+        return []
+
+    pieces = []
+    start = 0
+    src_length = tar_length = -1
+
+    for i, (src_line, tar_line) in enumerate(zip(src_lines, tar_lines)):
+        if len(src_line) > max_length or len(tar_line) > max_length:
+            return []
+
+        # Start a new piece once either side would exceed the max length, counting the joining newlines
+        if i > start and (src_length + len(src_line) + 1 > max_length or tar_length + len(tar_line) + 1 > max_length):
+            pieces.append(('\n'.join(src_lines[start:i]), '\n'.join(tar_lines[start:i])))
+            start = i
+            src_length = tar_length = -1
+
+        src_length += len(src_line) + 1
+        tar_length += len(tar_line) + 1
+
+    pieces.append(('\n'.join(src_lines[start:]), '\n'.join(tar_lines[start:])))
+
+    return pieces
+
+
+def prepare_dataset(dataset_path: str, output_path: str, max_length: int = None, long_rows: str = 'drop',
+                    duplicate_weighting: str = None) -> dict:
+    """
+    Deduplicate a training dataset and filter out examples beyond a max length, in two streaming passes. The first
+    occurrence of each example is kept, in order.
+
+    :param dataset_path: Path to dataset file.
+    :param output_path: Path to write the prepared dataset file to.
+    :param max_length: Max length of an example's source and target, in characters. If `None`, examples aren't
+        filtered by length.
+    :param long_rows: How to handle examples beyond the max length. Either "drop", or "split" into examples of
+        consecutive aligned lines (examples that can't be split are dropped).
+    :param duplicate_weighting: Number of copies kept of duplicate examples, as a function of their count. Either
+        "log" (1 + log2(count)), "sqrt" (sqrt(count)) or `None` to keep a single copy.
+    :returns: Dataset statistics.
+    """
+
+    if long_rows not in LONG_ROWS:
+        raise Exception(f'Unknown long row handling "{long_rows}".')
+
+    if duplicate_weighting is not None and duplicate_weighting not in DUPLICATE_WEIGHTINGS:
+        raise Exception(f'Unknown duplicate weighting "{duplicate_weighting}".')
+
+    def read_rows():
+        """Read the dataset's rows, as tuples of the row's examples within the max length and whether it's long."""
+
+        with open(dataset_path, newline='', encoding='utf-8') as file:
+            for row in csv.reader(file):
+                if len(row) < 2:
+                    continue
+
+                src, tar = row[0], row[1]
+
+                if max_length is None or (len(src) <= max_length and len(tar) <= max_length):
+                    yield [(src, tar)], False
+                elif long_rows == 'split':
+                    yield split_example(src, tar, max_length), True
+                else:
+                    yield [], True
+
+    def key(src, tar):
+        # Digests keep memory use low for large corpora
+        return hashlib.blake2b(f'{src}\0{tar}'.encode('utf-8'), digest_size=16).digest()
+
+    stats = {
+        'rows': 0,
+        'long_rows': 0,
+        'split_rows': 0,
+        'dropped_rows': 0,
+        'examples': 0,
+    }
+
+    # Count each example's occurrences
+    counts = dict()
+
+    for examples, long in read_rows():
+        stats['rows'] += 1
+        stats['examples'] += len(examples)
+
+        if long:
+            stats['long_rows'] += 1
+            stats['split_rows' if examples else 'dropped_rows'] += 1
+
+        for src, tar in examples:
+            k = key(src, tar)
+            counts[k] = counts.get(k, 0) + 1
+
+    stats['unique_examples'] = len(counts)
+    stats['duplicate_examples'] = stats['examples'] - len(counts)
+    stats['max_occurrences'] = max(counts.values(), default=0)
+
+    weight = DUPLICATE_WEIGHTINGS[duplicate_weighting] if duplicate_weighting is not None else lambda count: 1
+    output_examples = 0
+    chars = [0, 0]
+    max_chars = [0, 0]
+
+    # Write the first occurrence of each example, weighted by its count
+    with open(output_path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file, quoting=csv.QUOTE_ALL)
+
+        for examples, _ in read_rows():
+            for src, tar in examples:
+                count = counts.pop(key(src, tar), None)
+
+                # Already written
+                if count is None:
+                    continue
+
+                copies = weight(count)
+                writer.writerows([(src, tar)] * copies)
+                output_examples += copies
+
+                for i, sequence in enumerate((src, tar)):
+                    chars[i] += len(sequence) * copies
+                    max_chars[i] = max(max_chars[i], len(sequence))
+
+    stats['output_examples'] = output_examples
+
+    for i, side in enumerate(('source', 'target')):
+        stats[side] = {
+            'characters': chars[i],
+            'mean_length': chars[i] / output_examples if output_examples > 0 else 0,
+            'max_length': max_chars[i],
+        }
+
+    return stats
+
+
+def write_token_shards(examples, file_prefix: str, num_shards: int) -> int:
+    """
+    Write encoded examples to sharded TFRecord files, distributed round-robin.
+
+    :param examples: Iterable of tuples of source and target token IDs.
+    :param file_prefix: Output file path prefix. Shards are named "<prefix>-<index>-of-<count>.tfrecord".
+    :param num_shards: Number of shards.
+    :returns: Number of written examples.
+    """
+
+    writers = [tf.io.TFRecordWriter(f'{file_prefix}-{i:05d}-of-{num_shards:05d}.tfrecord') for i in range(num_shards)]
+    count = 0
+
+    for inp, tar in examples:
+        example = tf.train.Example(features=tf.train.Features(feature={
+            'inp': tf.train.Feature(int64_list=tf.train.Int64List(value=inp)),
+            'tar': tf.train.Feature(int64_list=tf.train.Int64List(value=tar)),
+        }))
+        writers[count % num_shards].write(example.SerializeToString())
+        count += 1
+
+    for writer in writers:
+        writer.close()
+
+    return count
+
+
+def load_token_shards(file_prefix: str):
+    """
+    Load encoded examples from sharded TFRecord files written by `write_token_shards()`, reading shards in parallel.
+
+    :param file_prefix: File path prefix the shards were written with.
+    :returns: TensorFlow dataset of tuples of source and target token IDs.
+    """
+
+    features = {
+        'inp': tf.io.VarLenFeature(tf.int64),
+        'tar': tf.io.VarLenFeature(tf.int64),
+    }
+
+    def parse(record):
+        example = tf.io.parse_single_example(record, features)
+        return tf.sparse.to_dense(example['inp']), tf.sparse.to_dense(example['tar'])
+
+    # Deterministic, so the seeded shuffle of an interrupted epoch can be replayed in the same order when resuming
+    files = tf.data.Dataset.list_files(f'{file_prefix}-*.tfrecord', shuffle=False)
+    return files.interleave(tf.data.TFRecordDataset, num_parallel_calls=tf.data.experimental.AUTOTUNE,
+                            deterministic=True) \
+        .map(parse, num_parallel_calls=tf.data.experimental.AUTOTUNE)
+
+
+def has_token_shards(file_prefix: str) -> bool:
+    """
+    Check whether sharded TFRecord files written by `write_token_shards()` exist.
+
+    :param file_prefix: File path prefix the shards were written with.
+    """
+
+    return len(tf.io.gfile.glob(f'{file_prefix}-*.tfrecord')) > 0
+
+
+def file_fingerprint(file_path: str) -> dict:
+    """
+    Get the size and modification time of a file, which change whenever it's rewritten.
+
+    :param file_path: File path.
+    :returns: Map of "size" (in bytes) and "mtime_ns" (modification time in nanoseconds).
+    """
+
+    stat = os.stat(file_path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def bucket_batch_sizes(bucket_boundaries: List[int], max_seq_len: int, tokens_per_batch: int) -> List[int]:
+    """
+    Get the batch size of each length bucket, keeping the number of tokens per batch roughly constant.
+
+    :param bucket_boundaries: Exclusive upper sequence length bounds of all buckets except the last.
+    :param max_seq_len: Max sequence length, which bounds the last bucket.
+    :param tokens_per_batch: Target number of tokens per batch (per sequence side).
+    :returns: Batch size of each bucket.
+    """
+
+    return [max(1, tokens_per_batch // bound) for bound in bucket_boundaries + [max_seq_len]]
+
+
+def batch_by_length(dataset, batch_size: int, max_seq_len: int, bucket_boundaries: List[int] = None,
+                    tokens_per_batch: int = None):
+    """
+    Batch encoded examples, padding each batch up to its longest sequence.
+    If bucket boundaries are given, examples are grouped into buckets of similar length first, so short sequences
+    aren't padded up to long ones.
+
+    :param dataset: TensorFlow dataset of tuples of source and target token IDs.
+    :param batch_size: Batch size if not bucketing.
+    :param max_seq_len: Max sequence length.
+    :param bucket_boundaries: Exclusive upper sequence length bounds of all buckets except the last. If `None`,
+        examples are not bucketed.
+    :param tokens_per_batch: Target number of tokens per batch when bucketing. Defaults to enough tokens for
+        `batch_size` sequences in the last bounded bucket.
+    :returns: Batched dataset.
+    """
+
+    if not bucket_boundaries:
+        return dataset.padded_batch(batch_size)
+
+    if tokens_per_batch is None:
+        tokens_per_batch = batch_size * bucket_boundaries[-1]
+
+    return dataset.bucket_by_sequence_length(
+        lambda inp, tar: tf.maximum(tf.shape(inp)[0], tf.shape(tar)[0]),
+        bucket_boundaries,
+        bucket_batch_sizes(bucket_boundaries, max_seq_len, tokens_per_batch),
+    )
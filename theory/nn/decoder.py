@@ -8,7 +8,7 @@ class Decoder(tf.keras.layers.Layer):
     """Decoder."""
 
     def __init__(self, num_layers, d_model, num_heads, dff, target_vocab_size,
-                 maximum_position_encoding, dropout_rate=0.1):
+                 maximum_position_encoding, dropout_rate=0.1, head_depth=None):
         """
         :param num_layers: Number of hidden layers.
         :param d_model: Model dimensionality.
@@ -17,6 +17,7 @@ class Decoder(tf.keras.layers.Layer):
         :param target_vocab_size: Target vocabulary size.
         :param maximum_position_encoding: Maximum positional encoding.
         :param dropout_rate: Dropout rate.
+        :param head_depth: Dimensionality of each attention head. If `None`, `d_model` is split evenly across the heads.
         """
 
         super(Decoder, self).__init__()
@@ -27,34 +28,61 @@ class Decoder(tf.keras.layers.Layer):
         self.embedding = tf.keras.layers.Embedding(target_vocab_size, d_model)
         self.pos_encoding = positional_encoding(maximum_position_encoding, d_model)
 
-        self.dec_layers = [DecoderLayer(d_model, num_heads, dff, dropout_rate) for _ in range(num_layers)]
+        self.dec_layers = [DecoderLayer(d_model, num_heads, dff, dropout_rate, head_depth) for _ in range(num_layers)]
         self.dropout = tf.keras.layers.Dropout(dropout_rate)
 
-    def call(self, x, enc_output, training, look_ahead_mask, padding_mask):
+    def init_cache(self, enc_output):
+        """
+        Create the per-layer key/value caches used for incremental decoding.
+
+        :param enc_output: Encoder output. Shape: (batch_size, input_seq_len, d_model)
+        :returns: List of decoder layer caches.
+        """
+
+        return [layer.init_cache(enc_output) for layer in self.dec_layers]
+
+    def call(self, x, enc_output, training, look_ahead_mask, padding_mask, cache=None, step=0,
+             return_attention_weights=True):
         """
         :param x: X value (input).
         :param enc_output: Encoder output.
         :param training: Whether the model is in training mode.
         :param look_ahead_mask: Look-ahead mask.
         :param padding_mask: Padding mask.
+        :param cache: Optional per-layer key/value caches from `init_cache()`. When given, `x` only contains the
+            target positions starting at `step`.
+        :param step: Position of the first token in `x`.
+        :param return_attention_weights: Whether to collect and return the attention weights of every layer. If
+            `False`, `None` is returned instead.
 
-        :returns: Tuple of decoder output and attention weights.
+        :returns: Tuple of decoder output, attention weights and per-layer key/value caches including the target
+            positions of `x` (`None` if no caches were given).
         Shape of `x`: (batch_size, target_seq_len, d_model)
         """
 
         seq_len = tf.shape(x)[1]
-        attention_weights = {}
+        attention_weights = {} if return_attention_weights else None
 
         x = self.embedding(x)  # (batch_size, target_seq_len, d_model)
-        x *= tf.math.sqrt(tf.cast(self.d_model, tf.float32))
-        x += self.pos_encoding[:, :seq_len, :]
+        x *= tf.math.sqrt(tf.cast(self.d_model, x.dtype))
+        x += tf.cast(self.pos_encoding[:, step:step + seq_len, :], x.dtype)
 
         x = self.dropout(x, training=training)
+        new_cache = None if cache is None else []
 
         for i in range(self.num_layers):
-            x, block1, block2 = self.dec_layers[i](x, enc_output, training, look_ahead_mask, padding_mask)
-            attention_weights['decoder_layer{}_block1'.format(i + 1)] = block1
-            attention_weights['decoder_layer{}_block2'.format(i + 1)] = block2
+            layer_cache = None if cache is None else cache[i]
+            x, block1, block2, layer_cache = self.dec_layers[i](x, enc_output, training=training,
+                                                                look_ahead_mask=look_ahead_mask,
+                                                                padding_mask=padding_mask, cache=layer_cache,
+                                                                return_attention_weights=return_attention_weights)
+
+            if cache is not None:
+                new_cache.append(layer_cache)
+
+            if return_attention_weights:
+                attention_weights['decoder_layer{}_block1'.format(i + 1)] = block1
+                attention_weights['decoder_layer{}_block2'.format(i + 1)] = block2
 
         # x.shape: (batch_size, target_seq_len, d_model)
-        return x, attention_weights
+        return x, attention_weights, new_cache
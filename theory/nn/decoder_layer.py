@@ -7,18 +7,19 @@ from .mha import MultiHeadAttention
 class DecoderLayer(tf.keras.layers.Layer):
     """Decoder layer."""
 
-    def __init__(self, d_model, num_heads, dff, dropout_rate=0.1):
+    def __init__(self, d_model, num_heads, dff, dropout_rate=0.1, head_depth=None):
         """
         :param d_model: Model dimensionality.
         :param num_heads: Number of attention heads.
         :param dff: Feed-forward network dimensionality.
         :param dropout_rate: Dropout rate.
+        :param head_depth: Dimensionality of each attention head. If `None`, `d_model` is split evenly across the heads.
         """
 
         super(DecoderLayer, self).__init__()
 
-        self.mha1 = MultiHeadAttention(d_model, num_heads)
-        self.mha2 = MultiHeadAttention(d_model, num_heads)
+        self.mha1 = MultiHeadAttention(d_model, num_heads, head_depth)
+        self.mha2 = MultiHeadAttention(d_model, num_heads, head_depth)
 
         self.ffn = point_wise_feed_forward_network(d_model, dff)
 
@@ -30,25 +31,73 @@ class DecoderLayer(tf.keras.layers.Layer):
         self.dropout2 = tf.keras.layers.Dropout(dropout_rate)
         self.dropout3 = tf.keras.layers.Dropout(dropout_rate)
 
-    def call(self, x, enc_output, training, look_ahead_mask, padding_mask):
+    def init_cache(self, enc_output):
+        """
+        Create the key/value cache used for incremental decoding.
+
+        :param enc_output: Encoder output. Shape: (batch_size, input_seq_len, d_model)
+        :returns: Dict of self-attention ("self") and encoder-decoder attention ("cross") key/value caches.
+        """
+
+        batch_size = tf.shape(enc_output)[0]
+        empty = tf.zeros([batch_size, self.mha1.num_heads, 0, self.mha1.depth], dtype=enc_output.dtype)
+        cross_k, cross_v = self.mha2.project_kv(enc_output, enc_output)
+
+        return {
+            'self': {'k': empty, 'v': empty},
+            'cross': {'k': cross_k, 'v': cross_v},
+        }
+
+    def call(self, x, enc_output, training, look_ahead_mask, padding_mask, cache=None, return_attention_weights=True):
         """
         :param x: X value (input).
         :param enc_output: Encoder output.
         :param training: Whether the model is in training mode.
         :param look_ahead_mask: Look-ahead mask.
         :param padding_mask: Padding mask.
+        :param cache: Optional key/value cache from `init_cache()`. When given, `x` only contains the newest target
+            positions and `enc_output` is unused.
+        :param return_attention_weights: Whether to return the attention weights. If `False`, `None` is returned
+            instead.
 
-        :returns: [Tuple] Output, block 1 attentions weights, block 2 attention weights
+        :returns: [Tuple] Output, block 1 attentions weights, block 2 attention weights, key/value cache including the
+            newest target positions (`None` if no cache was given)
         """
 
         # enc_output.shape: (batch_size, input_seq_len, d_model)
 
-        attn1, attn_weights_block1 = self.mha1(x, x, x, look_ahead_mask)  # (batch_size, target_seq_len, d_model)
+        if cache is None:
+            attn1, attn_weights_block1 = self.mha1(x, x, x, look_ahead_mask,
+                                                   return_attention_weights=return_attention_weights)
+        else:
+            # Append the newest positions' keys and values. The cache is replaced rather than updated in place, since
+            # Keras may pass copies of nested arguments to `call()`.
+            k, v = self.mha1.project_kv(x, x)
+            cache = {
+                'self': {
+                    'k': tf.concat([cache['self']['k'], k], axis=2),
+                    'v': tf.concat([cache['self']['v'], v], axis=2),
+                },
+                'cross': cache['cross'],
+            }
+
+            attn1, attn_weights_block1 = self.mha1(None, None, x, look_ahead_mask, cache=cache['self'],
+                                                   return_attention_weights=return_attention_weights)
+
+        # attn1.shape: (batch_size, target_seq_len, d_model)
+
         attn1 = self.dropout1(attn1, training=training)
         out1 = self.layernorm1(attn1 + x)
 
-        attn2, attn_weights_block2 = self.mha2(enc_output, enc_output, out1,
-                                               padding_mask)  # (batch_size, target_seq_len, d_model)
+        if cache is None:
+            attn2, attn_weights_block2 = self.mha2(enc_output, enc_output, out1, padding_mask,
+                                                   return_attention_weights=return_attention_weights)
+        else:
+            attn2, attn_weights_block2 = self.mha2(None, None, out1, padding_mask, cache=cache['cross'],
+                                                   return_attention_weights=return_attention_weights)
+
+        # attn2.shape: (batch_size, target_seq_len, d_model)
+
         attn2 = self.dropout2(attn2, training=training)
         out2 = self.layernorm2(attn2 + out1)  # (batch_size, target_seq_len, d_model)
 
@@ -56,4 +105,4 @@ class DecoderLayer(tf.keras.layers.Layer):
         ffn_output = self.dropout3(ffn_output, training=training)
         out3 = self.layernorm3(ffn_output + out2)  # (batch_size, target_seq_len, d_model)
 
-        return out3, attn_weights_block1, attn_weights_block2
+        return out3, attn_weights_block1, attn_weights_block2, cache
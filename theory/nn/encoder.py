@@ -8,7 +8,7 @@ class Encoder(tf.keras.layers.Layer):
     """Encoder."""
 
     def __init__(self, num_layers, d_model, num_heads, dff, input_vocab_size, maximum_position_encoding,
-                 dropout_rate=0.1):
+                 dropout_rate=0.1, head_depth=None):
         """
         :param num_layers: Number of hidden layers.
         :param d_model: Model dimensionality.
@@ -17,6 +17,7 @@ class Encoder(tf.keras.layers.Layer):
         :param input_vocab_size: Input vocabulary size.
         :param maximum_position_encoding: Maximum positional encoding.
         :param dropout_rate: Dropout rate.
+        :param head_depth: Dimensionality of each attention head. If `None`, `d_model` is split evenly across the heads.
         """
 
         super(Encoder, self).__init__()
@@ -27,7 +28,7 @@ class Encoder(tf.keras.layers.Layer):
         self.embedding = tf.keras.layers.Embedding(input_vocab_size, d_model)
         self.pos_encoding = positional_encoding(maximum_position_encoding, self.d_model)
 
-        self.enc_layers = [EncoderLayer(d_model, num_heads, dff, dropout_rate) for _ in range(num_layers)]
+        self.enc_layers = [EncoderLayer(d_model, num_heads, dff, dropout_rate, head_depth) for _ in range(num_layers)]
 
         self.dropout = tf.keras.layers.Dropout(dropout_rate)
 
@@ -44,12 +45,12 @@ class Encoder(tf.keras.layers.Layer):
 
         # adding embedding and position encoding.
         x = self.embedding(x)  # (batch_size, input_seq_len, d_model)
-        x *= tf.math.sqrt(tf.cast(self.d_model, tf.float32))
-        x += self.pos_encoding[:, :seq_len, :]
+        x *= tf.math.sqrt(tf.cast(self.d_model, x.dtype))
+        x += tf.cast(self.pos_encoding[:, :seq_len, :], x.dtype)
 
         x = self.dropout(x, training=training)
 
         for i in range(self.num_layers):
-            x = self.enc_layers[i](x, training, mask)
+            x = self.enc_layers[i](x, training=training, mask=mask)
 
         return x  # (batch_size, input_seq_len, d_model)
@@ -7,17 +7,18 @@ from .mha import MultiHeadAttention
 class EncoderLayer(tf.keras.layers.Layer):
     """Encoder layer."""
 
-    def __init__(self, d_model, num_heads, dff, dropout_rate=0.1):
+    def __init__(self, d_model, num_heads, dff, dropout_rate=0.1, head_depth=None):
         """
         :param d_model: Model dimensionality.
         :param num_heads: Number of attention heads.
         :param dff: Feed-forward network dimensionality.
         :param dropout_rate: Dropout rate.
+        :param head_depth: Dimensionality of each attention head. If `None`, `d_model` is split evenly across the heads.
         """
 
         super(EncoderLayer, self).__init__()
 
-        self.mha = MultiHeadAttention(d_model, num_heads)
+        self.mha = MultiHeadAttention(d_model, num_heads, head_depth)
         self.ffn = point_wise_feed_forward_network(d_model, dff)
 
         self.layernorm1 = tf.keras.layers.LayerNormalization(epsilon=1e-6)
@@ -35,7 +36,7 @@ class EncoderLayer(tf.keras.layers.Layer):
         :returns: Output.
         """
 
-        attn_output, _ = self.mha(x, x, x, mask)  # (batch_size, input_seq_len, d_model)
+        attn_output, _ = self.mha(x, x, x, mask, return_attention_weights=False)  # (batch_size, input_seq_len, d_model)
         attn_output = self.dropout1(attn_output, training=training)
         out1 = self.layernorm1(x + attn_output)  # (batch_size, input_seq_len, d_model)
 
@@ -1,8 +1,17 @@
+import json
+from typing import List, Optional
+
+
 class Hyperparams:
     """Hyperparameters configuration object."""
 
     def __init__(self, buffer_size: int, batch_size: int, num_layers: int, d_model: int, dff: int, num_heads: int,
-                 dropout_rate: float, epochs: int = 10):
+                 dropout_rate: float, epochs: int = 10, max_seq_len: int = 512,
+                 bucket_boundaries: Optional[List[int]] = None, tokens_per_batch: Optional[int] = None,
+                 accumulation_steps: int = 1, precision: str = 'float32', validation_interval: Optional[int] = None,
+                 early_stopping_patience: Optional[int] = None, early_stopping_min_delta: float = 0.0,
+                 checkpoint_interval: Optional[int] = None, distillation_alpha: float = 0.5,
+                 distillation_temperature: float = 2.0, head_depth: Optional[int] = None):
         self.buffer_size = buffer_size
         self.batch_size = batch_size
         self.num_layers = num_layers
@@ -11,6 +20,56 @@ class Hyperparams:
         self.num_heads = num_heads
         self.dropout_rate = dropout_rate
         self.epochs = epochs
+        # Maximum encoded sequence length (including start and end tokens), which sizes the positional encoding tables
+        self.max_seq_len = max_seq_len
+        # Sequence length bucket boundaries for batching. If `None`, batches aren't bucketed by length.
+        self.bucket_boundaries = bucket_boundaries
+        # Target number of tokens per bucketed batch, which determines each bucket's batch size
+        self.tokens_per_batch = tokens_per_batch
+        # Number of micro-batches to accumulate gradients over per optimizer step. The effective batch size is
+        # `batch_size * accumulation_steps`.
+        self.accumulation_steps = accumulation_steps
+        # Keras mixed precision policy of the transformer ("float32", "mixed_bfloat16" or "mixed_float16")
+        self.precision = precision
+        # Number of optimizer steps between validation passes. If `None`, validation runs at the end of every epoch.
+        self.validation_interval = validation_interval
+        # Number of validation passes without improvement of the validation loss before training stops early. If
+        # `None`, training runs for all epochs.
+        self.early_stopping_patience = early_stopping_patience
+        # Minimum decrease of the validation loss that counts as an improvement
+        self.early_stopping_min_delta = early_stopping_min_delta
+        # Number of optimizer steps between checkpoints, in addition to the checkpoint at the end of every epoch
+        self.checkpoint_interval = checkpoint_interval
+        # Weight of the cross-entropy loss on the training targets when distilling from a teacher. The rest of the loss
+        # is the divergence from the teacher's predictions.
+        self.distillation_alpha = distillation_alpha
+        # Softmax temperature of the teacher's and student's predictions when distilling, which softens them
+        self.distillation_temperature = distillation_temperature
+        # Dimensionality of each attention head. If `None`, `d_model // num_heads`. Pruned models keep their original
+        # head dimensionality with fewer heads.
+        self.head_depth = head_depth
+
+    def save(self, file_path: str):
+        """
+        Save hyperparameters to a JSON file.
+
+        :param file_path: Output file path.
+        """
+
+        with open(file_path, 'w') as file:
+            json.dump(vars(self), file, indent=4)
+
+    @staticmethod
+    def load(file_path: str):
+        """
+        Load hyperparameters from a JSON file.
+
+        :param file_path: Path to file saved by `Hyperparams.save()`.
+        :returns: Hyperparameters.
+        """
+
+        with open(file_path) as file:
+            return Hyperparams(**json.load(file))
 
     def __str__(self):
         return '| ' + '-' * 78 + '\n' + \
@@ -23,5 +82,17 @@ class Hyperparams:
                f'| Model dimensionality: {self.d_model}\n' + \
                f'| Dense feed-forward network size (neurons): {self.dff}\n' + \
                f'| Number of heads: {self.num_heads}\n' + \
+               f'| Head dimensionality: {self.head_depth}\n' + \
                f'| Dropout rate: {self.dropout_rate}\n' + \
+               f'| Max sequence length: {self.max_seq_len}\n' + \
+               f'| Bucket boundaries: {self.bucket_boundaries}\n' + \
+               f'| Tokens per batch: {self.tokens_per_batch}\n' + \
+               f'| Gradient accumulation steps: {self.accumulation_steps}\n' + \
+               f'| Precision: {self.precision}\n' + \
+               f'| Validation interval (steps): {self.validation_interval}\n' + \
+               f'| Early stopping patience: {self.early_stopping_patience}\n' + \
+               f'| Early stopping min delta: {self.early_stopping_min_delta}\n' + \
+               f'| Checkpoint interval (steps): {self.checkpoint_interval}\n' + \
+               f'| Distillation alpha: {self.distillation_alpha}\n' + \
+               f'| Distillation temperature: {self.distillation_temperature}\n' + \
                '| ' + '-' * 78
@@ -1,23 +1,31 @@
 import tensorflow as tf
 
-from .brain_common import scaled_dot_product_attention
+from .brain_common import einsum_attention, scaled_dot_product_attention
 
 
 class MultiHeadAttention(tf.keras.layers.Layer):
     """Multi-head attention layer."""
 
-    def __init__(self, d_model, num_heads):
+    def __init__(self, d_model, num_heads, depth=None):
+        """
+        :param d_model: Model dimensionality.
+        :param num_heads: Number of attention heads.
+        :param depth: Dimensionality of each head. If `None`, `d_model` is split evenly across the heads.
+        """
+
         super(MultiHeadAttention, self).__init__()
         self.num_heads = num_heads
         self.d_model = d_model
 
-        assert d_model % self.num_heads == 0
+        if depth is None:
+            assert d_model % self.num_heads == 0
+            depth = d_model // self.num_heads
 
-        self.depth = d_model // self.num_heads
+        self.depth = depth
 
-        self.wq = tf.keras.layers.Dense(d_model)
-        self.wk = tf.keras.layers.Dense(d_model)
-        self.wv = tf.keras.layers.Dense(d_model)
+        self.wq = tf.keras.layers.Dense(num_heads * depth)
+        self.wk = tf.keras.layers.Dense(num_heads * depth)
+        self.wv = tf.keras.layers.Dense(num_heads * depth)
 
         self.dense = tf.keras.layers.Dense(d_model)
 
@@ -28,17 +36,59 @@ class MultiHeadAttention(tf.keras.layers.Layer):
         x = tf.reshape(x, (batch_size, -1, self.num_heads, self.depth))
         return tf.transpose(x, perm=[0, 2, 1, 3])
 
-    def call(self, v, k, q, mask):
-        batch_size = tf.shape(q)[0]
+    def project_kv(self, v, k):
+        """
+        Project keys and values and split them into heads.
 
-        q = self.wq(q)  # (batch_size, seq_len, d_model)
-        k = self.wk(k)  # (batch_size, seq_len, d_model)
-        v = self.wv(v)  # (batch_size, seq_len, d_model)
+        :param v: Values. Shape: (batch_size, seq_len, d_model)
+        :param k: Keys. Shape: (batch_size, seq_len, d_model)
+        :returns: Tuple of keys and values. Shape of each: (batch_size, num_heads, seq_len, depth)
+        """
+
+        batch_size = tf.shape(k)[0]
+
+        k = self.wk(k)  # (batch_size, seq_len, num_heads * depth)
+        v = self.wv(v)  # (batch_size, seq_len, num_heads * depth)
 
-        q = self.split_heads(q, batch_size)  # (batch_size, num_heads, seq_len_q, depth)
         k = self.split_heads(k, batch_size)  # (batch_size, num_heads, seq_len_k, depth)
         v = self.split_heads(v, batch_size)  # (batch_size, num_heads, seq_len_v, depth)
 
+        return k, v
+
+    def call(self, v, k, q, mask, cache=None, return_attention_weights=True):
+        """
+        :param v: Values.
+        :param k: Keys.
+        :param q: Queries.
+        :param mask: Mask.
+        :param cache: Optional dict of projected keys and values ("k" and "v") to attend to instead of projecting `k`
+            and `v`, which are then unused (e.g. keys and values cached for incremental decoding).
+        :param return_attention_weights: Whether to return the attention weights. If `False`, `None` is returned
+            instead and attention is computed by `einsum_attention()`, which allocates fewer intermediate tensors.
+
+        :returns: Tuple of output and attention weights.
+        """
+
+        batch_size = tf.shape(q)[0]
+
+        q = self.wq(q)  # (batch_size, seq_len, num_heads * depth)
+
+        if return_attention_weights:
+            q = self.split_heads(q, batch_size)  # (batch_size, num_heads, seq_len_q, depth)
+        else:
+            q = tf.reshape(q, (batch_size, -1, self.num_heads, self.depth))  # (batch_size, seq_len_q, num_heads, depth)
+
+        if cache is None:
+            k, v = self.project_kv(v, k)
+        else:
+            k, v = cache['k'], cache['v']
+
+        if not return_attention_weights:
+            scaled_attention = einsum_attention(q, k, v, mask)  # (batch_size, seq_len_q, num_heads, depth)
+            concat_attention = tf.reshape(scaled_attention, (batch_size, -1, self.num_heads * self.depth))
+
+            return self.dense(concat_attention), None
+
         # scaled_attention.shape: (batch_size, num_heads, seq_len_q, depth)
         # attention_weights.shape: (batch_size, num_heads, seq_len_q, seq_len_k)
         scaled_attention, attention_weights = scaled_dot_product_attention(q, k, v, mask)
@@ -46,8 +96,8 @@ class MultiHeadAttention(tf.keras.layers.Layer):
         scaled_attention = tf.transpose(scaled_attention,
                                         perm=[0, 2, 1, 3])  # (batch_size, seq_len_q, num_heads, depth)
 
-        concat_attention = tf.reshape(scaled_attention,
-                                      (batch_size, -1, self.d_model))  # (batch_size, seq_len_q, d_model)
+        # concat_attention.shape: (batch_size, seq_len_q, num_heads * depth)
+        concat_attention = tf.reshape(scaled_attention, (batch_size, -1, self.num_heads * self.depth))
 
         output = self.dense(concat_attention)  # (batch_size, seq_len_q, d_model)
 
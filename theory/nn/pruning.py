@@ -0,0 +1,109 @@
+import numpy as np
+import tensorflow as tf
+
+
+def head_scores(mha) -> np.ndarray:
+    """
+    Score the heads of a multi-head attention layer by the magnitude of their weights, i.e. the L2 norm of their query,
+    key and value projection columns and output projection rows.
+
+    :param mha: Built multi-head attention layer.
+    :returns: Score of each head. Shape: (num_heads,)
+    """
+
+    def column_norms(kernel):
+        # (in_units, num_heads * depth) --> (num_heads,)
+        return np.sum(np.square(kernel.numpy().reshape(kernel.shape[0], mha.num_heads, mha.depth)), axis=(0, 2))
+
+    output_norms = np.sum(np.square(mha.dense.kernel.numpy().reshape(mha.num_heads, mha.depth, -1)), axis=(1, 2))
+
+    return np.sqrt(column_norms(mha.wq.kernel) + column_norms(mha.wk.kernel) + column_norms(mha.wv.kernel) +
+                   output_norms)
+
+
+def ffn_scores(ffn) -> np.ndarray:
+    """
+    Score the hidden units of a point-wise feed-forward network by the magnitude of their weights, i.e. the product of
+    the L2 norms of their input and output weights.
+
+    :param ffn: Built point-wise feed-forward network.
+    :returns: Score of each hidden unit. Shape: (dff,)
+    """
+
+    hidden, output = ffn.layers
+
+    return np.linalg.norm(hidden.kernel.numpy(), axis=0) * np.linalg.norm(output.kernel.numpy(), axis=1)
+
+
+def top_indices(scores: np.ndarray, count: int) -> np.ndarray:
+    """Get the indices of the highest scores, in ascending order of index."""
+
+    return np.sort(np.argsort(-scores, kind='stable')[:count])
+
+
+def prune_mha(source, target):
+    """
+    Copy the weights of the highest scoring heads of a multi-head attention layer to a smaller one.
+
+    :param source: Built multi-head attention layer.
+    :param target: Built multi-head attention layer with fewer heads of the same dimensionality.
+    """
+
+    heads = top_indices(head_scores(source), target.num_heads)
+    units = (heads[:, np.newaxis] * source.depth + np.arange(source.depth)).reshape(-1)
+
+    for name in ('wq', 'wk', 'wv'):
+        getattr(target, name).kernel.assign(tf.gather(getattr(source, name).kernel, units, axis=1))
+        getattr(target, name).bias.assign(tf.gather(getattr(source, name).bias, units))
+
+    target.dense.kernel.assign(tf.gather(source.dense.kernel, units, axis=0))
+    target.dense.bias.assign(source.dense.bias)
+
+
+def prune_ffn(source, target):
+    """
+    Copy the weights of the highest scoring hidden units of a point-wise feed-forward network to a smaller one.
+
+    :param source: Built point-wise feed-forward network.
+    :param target: Built point-wise feed-forward network with fewer hidden units.
+    """
+
+    units = top_indices(ffn_scores(source), target.layers[0].units)
+
+    target.layers[0].kernel.assign(tf.gather(source.layers[0].kernel, units, axis=1))
+    target.layers[0].bias.assign(tf.gather(source.layers[0].bias, units))
+    target.layers[1].kernel.assign(tf.gather(source.layers[1].kernel, units, axis=0))
+    target.layers[1].bias.assign(source.layers[1].bias)
+
+
+def prune_transformer(source, target):
+    """
+    Copy the weights of a built transformer to a smaller one with fewer attention heads and feed-forward network
+    hidden units in every layer, keeping the highest scoring ones. All other weights are copied as-is.
+
+    :param source: Built transformer.
+    :param target: Built transformer with the same number of layers and model dimensionality.
+    """
+
+    def copy(source_layer, target_layer):
+        for source_weight, target_weight in zip(source_layer.weights, target_layer.weights):
+            target_weight.assign(source_weight)
+
+    for source_layer, target_layer in zip(source.encoder.enc_layers, target.encoder.enc_layers):
+        prune_mha(source_layer.mha, target_layer.mha)
+        prune_ffn(source_layer.ffn, target_layer.ffn)
+
+        for name in ('layernorm1', 'layernorm2'):
+            copy(getattr(source_layer, name), getattr(target_layer, name))
+
+    for source_layer, target_layer in zip(source.decoder.dec_layers, target.decoder.dec_layers):
+        prune_mha(source_layer.mha1, target_layer.mha1)
+        prune_mha(source_layer.mha2, target_layer.mha2)
+        prune_ffn(source_layer.ffn, target_layer.ffn)
+
+        for name in ('layernorm1', 'layernorm2', 'layernorm3'):
+            copy(getattr(source_layer, name), getattr(target_layer, name))
+
+    copy(source.encoder.embedding, target.encoder.embedding)
+    copy(source.decoder.embedding, target.decoder.embedding)
+    copy(source.final_layer, target.final_layer)
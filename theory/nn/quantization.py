@@ -0,0 +1,99 @@
+import tempfile
+from typing import Tuple
+
+import numpy as np
+import tensorflow as tf
+
+# File name of quantized decoder models in serving model directories
+QUANTIZED_DECODER_FILE_NAME = 'quantized_decoder.tflite'
+
+# Signature names of quantized decoder models
+ENCODE_SIGNATURE = 'encode'
+DECODE_STEP_SIGNATURE = 'decode_step'
+
+
+def quantize_decoder(encode, decode_step) -> bytes:
+    """
+    Convert a greedy decoder to a TFLite model with dynamic range INT8 quantization.
+    Weights are stored as INT8, and activations are quantized on the fly, so matrix multiplications run on integer
+    kernels. Activation ranges are computed per batch at runtime, so no calibration dataset is needed.
+
+    :param encode: Compiled function that encodes a batch of input sequences, returning a dictionary of the initial
+        decoding state. Inputs: `encoder_input` and `max_lengths`. TFLite models can't output empty tensors, so state
+        that starts empty (e.g. the cached keys and values of decoded tokens) must be left out.
+    :param decode_step: Compiled function that decodes the next token of every sequence, taking the decoding state,
+        `encoder_input` and `max_lengths`, and returning the next decoding state. The state must include `last_id`
+        (predicted IDs), `finished` (whether each sequence has stopped) and `stop_reasons`.
+    :returns: TFLite model.
+    """
+
+    signatures = {
+        ENCODE_SIGNATURE: encode.get_concrete_function(),
+        DECODE_STEP_SIGNATURE: decode_step.get_concrete_function(),
+    }
+
+    # Only the variables the functions capture are saved, rather than the layers they belong to. Keras 3 layers save
+    # variable wrappers that the functions don't read from, and add their own signatures.
+    module = tf.Module()
+    module.captured_variables = [v for function in signatures.values() for v in function.variables]
+
+    # Multiple signatures can only be converted from a saved model
+    with tempfile.TemporaryDirectory() as saved_model_path:
+        tf.saved_model.save(module, saved_model_path, signatures=signatures)
+
+        converter = tf.lite.TFLiteConverter.from_saved_model(saved_model_path, signature_keys=list(signatures))
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+
+        return converter.convert()
+
+
+class QuantizedDecoder:
+    """Greedy decoder running a TFLite model converted by `quantize_decoder()`."""
+
+    def __init__(self, model: bytes, max_length: int):
+        """
+        :param model: TFLite model.
+        :param max_length: Maximum number of decoding steps.
+        """
+
+        self.model = model
+        self.max_length = max_length
+
+        self.interpreter = tf.lite.Interpreter(model_content=model)
+        self.encode = self.interpreter.get_signature_runner(ENCODE_SIGNATURE)
+        self.decode_step = self.interpreter.get_signature_runner(DECODE_STEP_SIGNATURE)
+
+    def __call__(self, encoder_input, max_lengths) -> Tuple[tf.Tensor, tf.Tensor]:
+        """
+        Greedily decode a batch of encoded input sequences.
+        Takes and returns the same as `Brain.__greedy_decode()`.
+
+        :param encoder_input: Padded encoder input. Shape: (batch_size, inp_seq_len)
+        :param max_lengths: Maximum decoded length of each sequence. Shape: (batch_size,)
+        :returns: Tuple of decoded target token IDs and stop reasons.
+        """
+
+        inputs = {
+            'encoder_input': np.asarray(encoder_input, dtype=np.int32),
+            'max_lengths': np.asarray(max_lengths, dtype=np.int32),
+        }
+
+        batch_size = inputs['encoder_input'].shape[0]
+
+        # Inputs are resized to the state's shapes on every step, since the cached keys and values grow
+        state = self.encode(**inputs)
+        output_ids = []
+
+        # State left out by the encoder starts empty
+        for name, details in self.decode_step.get_input_details().items():
+            if name not in inputs and name not in state:
+                shape = [batch_size] + [max(d, 0) for d in details['shape_signature'][1:]]
+                state[name] = np.zeros(shape, dtype=details['dtype'])
+
+        while not state['finished'].all() and len(output_ids) < self.max_length:
+            state = self.decode_step(**inputs, **state)
+            output_ids.append(state['last_id'])
+
+        output_ids = np.stack(output_ids, axis=-1) if output_ids else np.zeros((batch_size, 0), dtype=np.int32)
+
+        return tf.constant(output_ids), tf.constant(state['stop_reasons'])
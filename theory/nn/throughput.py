@@ -0,0 +1,91 @@
+import json
+import time
+from typing import Optional
+
+import psutil
+
+
+class ThroughputMonitor:
+    """
+    Training throughput metrics, aggregated over a window of training steps.
+
+    Step time is split into time spent waiting on the input pipeline and time spent computing the training step, which
+    tells whether the input pipeline or the model is the bottleneck. Each window's metrics can be appended to a JSONL
+    file.
+    """
+
+    def __init__(self, file_path: Optional[str] = None):
+        """
+        :param file_path: Path to a JSONL file to append metrics to. If `None`, metrics are only returned.
+        """
+
+        self.file_path = file_path
+        self.__file = open(file_path, 'a') if file_path is not None else None
+        self.__process = psutil.Process()
+        self.reset()
+
+    def reset(self):
+        """Start a new window."""
+
+        self.steps = 0
+        self.wait_time = 0.0
+        self.compute_time = 0.0
+        self.examples = 0
+        self.real_tokens = 0
+        self.padded_tokens = 0
+
+    def update(self, wait_time: float, compute_time: float, examples: int, real_tokens: int, padded_tokens: int):
+        """
+        Record a training step.
+
+        :param wait_time: Seconds spent waiting for the step's batch from the input pipeline.
+        :param compute_time: Seconds spent computing the training step.
+        :param examples: Number of examples in the batch.
+        :param real_tokens: Number of non-padding tokens in the batch.
+        :param padded_tokens: Total number of tokens in the batch, including padding.
+        """
+
+        self.steps += 1
+        self.wait_time += wait_time
+        self.compute_time += compute_time
+        self.examples += examples
+        self.real_tokens += real_tokens
+        self.padded_tokens += padded_tokens
+
+    def summary(self) -> dict:
+        """
+        Get the metrics of the current window.
+
+        :returns: Dictionary of metrics. Time values are averages per step, in seconds.
+        """
+
+        step_time = self.wait_time + self.compute_time
+
+        return {
+            'tokens_per_sec': self.real_tokens / step_time if step_time > 0 else 0.0,
+            'examples_per_sec': self.examples / step_time if step_time > 0 else 0.0,
+            'padding_ratio': 1 - self.real_tokens / self.padded_tokens if self.padded_tokens > 0 else 0.0,
+            'input_wait_time': self.wait_time / max(self.steps, 1),
+            'compute_time': self.compute_time / max(self.steps, 1),
+            'input_wait_fraction': self.wait_time / step_time if step_time > 0 else 0.0,
+            'host_memory_mb': self.__process.memory_info().rss / 2 ** 20,
+        }
+
+    def write(self, record: dict):
+        """
+        Append a record to the JSONL file, if any.
+
+        :param record: JSON serializable record.
+        """
+
+        if self.__file is None:
+            return
+
+        self.__file.write(json.dumps({'time': time.time(), **record}) + '\n')
+        self.__file.flush()
+
+    def close(self):
+        """Close the JSONL file."""
+
+        if self.__file is not None:
+            self.__file.close()
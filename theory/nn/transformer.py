@@ -8,24 +8,70 @@ class Transformer(tf.keras.Model):
     """Transformer model."""
 
     def __init__(self, num_layers, d_model, num_heads, dff, input_vocab_size, target_vocab_size, pe_input, pe_target,
-                 rate=0.1):
+                 rate=0.1, head_depth=None):
         super(Transformer, self).__init__()
 
-        self.encoder = Encoder(num_layers, d_model, num_heads, dff, input_vocab_size, pe_input, rate)
+        self.encoder = Encoder(num_layers, d_model, num_heads, dff, input_vocab_size, pe_input, rate, head_depth)
 
-        self.decoder = Decoder(num_layers, d_model, num_heads, dff, target_vocab_size, pe_target, rate)
+        self.decoder = Decoder(num_layers, d_model, num_heads, dff, target_vocab_size, pe_target, rate, head_depth)
 
         self.final_layer = tf.keras.layers.Dense(target_vocab_size)
 
-    def call(self, inputs, training=False, mask=None):
+    def call(self, inputs, training=False, mask=None, return_attention_weights=True):
+        """
+        :param inputs: Tuple of input and target sequences.
+        :param training: Whether the model is in training mode.
+        :param mask: List of encoder padding mask, look-ahead mask and decoder padding mask.
+        :param return_attention_weights: Whether to collect and return the decoder's attention weights. If `False`,
+            `None` is returned instead and attention is computed without them, which allocates fewer tensors.
+        :returns: Tuple of float32 predictions and attention weights.
+        """
+
         inp, tar = inputs
         enc_padding_mask, look_ahead_mask, dec_padding_mask = mask
 
-        enc_output = self.encoder(inp, training, enc_padding_mask)  # (batch_size, inp_seq_len, d_model)
+        enc_output = self.encoder(inp, training=training, mask=enc_padding_mask)  # (batch_size, inp_seq_len, d_model)
 
         # dec_output.shape: (batch_size, tar_seq_len, d_model)
-        dec_output, attention_weights = self.decoder(tar, enc_output, training, look_ahead_mask, dec_padding_mask)
+        dec_output, attention_weights, _ = self.decoder(tar, enc_output, training=training,
+                                                        look_ahead_mask=look_ahead_mask, padding_mask=dec_padding_mask,
+                                                        return_attention_weights=return_attention_weights)
 
         final_output = self.final_layer(dec_output)  # (batch_size, tar_seq_len, target_vocab_size)
 
+        # Predictions are always float32, so the loss and decoding are unaffected by mixed precision
+        final_output = tf.cast(final_output, tf.float32)
+
         return final_output, attention_weights
+
+    def encode(self, inp, enc_padding_mask, training=False):
+        """
+        Run the encoder only.
+
+        :param inp: Input sequences. Shape: (batch_size, inp_seq_len)
+        :param enc_padding_mask: Encoder padding mask.
+        :param training: Whether the model is in training mode.
+        :returns: Encoder output. Shape: (batch_size, inp_seq_len, d_model)
+        """
+
+        return self.encoder(inp, training=training, mask=enc_padding_mask)
+
+    def decode_step(self, tar, cache, step, dec_padding_mask, return_attention_weights=False):
+        """
+        Run the decoder and final layer on the newest target tokens only, reusing cached keys and values.
+
+        :param tar: Newest target tokens. Shape: (batch_size, 1)
+        :param cache: Decoder key/value caches from `decoder.init_cache()` or the previous step.
+        :param step: Position of `tar` within the target sequence.
+        :param dec_padding_mask: Padding mask for the encoder output.
+        :param return_attention_weights: Whether to collect and return the decoder's attention weights. If `False`,
+            `None` is returned instead.
+        :returns: Tuple of float32 predictions, attention weights and the caches including `tar`, for the next step.
+            Shape of predictions: (batch_size, 1, target_vocab_size)
+        """
+
+        dec_output, attention_weights, cache = self.decoder(tar, None, training=False, look_ahead_mask=None,
+                                                            padding_mask=dec_padding_mask, cache=cache, step=step,
+                                                            return_attention_weights=return_attention_weights)
+
+        return tf.cast(self.final_layer(dec_output), tf.float32), attention_weights, cache
@@ -0,0 +1,112 @@
+import hashlib
+import sqlite3
+import threading
+import time
+from typing import Dict, List
+
+
+class TranslationCache:
+    """
+    Persistent neural network translation cache, backed by SQLite.
+
+    Translations are keyed by a model identity (e.g. checkpoint and decoding config) plus the input sequence, so a
+    cache file can safely be shared between models and between processes (e.g. API workers). Least recently used
+    entries are evicted once the cache grows beyond `max_entries`.
+    """
+
+    def __init__(self, file_path: str, max_entries: int = 100000):
+        """
+        :param file_path: Path to the SQLite database file. Created if it doesn't exist.
+        :param max_entries: Maximum number of cached translations.
+        """
+
+        self.file_path = file_path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.__lock = threading.Lock()
+
+        # Write-ahead logging allows readers in other processes while one process writes
+        self.__conn = sqlite3.connect(file_path, timeout=30, check_same_thread=False)
+        self.__conn.execute('PRAGMA journal_mode=WAL')
+        self.__conn.execute('PRAGMA synchronous=NORMAL')
+        self.__conn.execute(
+            'CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, translation TEXT NOT NULL, '
+            'last_used REAL NOT NULL)')
+        self.__conn.execute('CREATE INDEX IF NOT EXISTS translations_last_used ON translations (last_used)')
+        self.__conn.commit()
+
+    @staticmethod
+    def __key(model_id: str, input: str) -> str:
+        return hashlib.sha256(f'{model_id}\n{input}'.encode('utf-8')).hexdigest()
+
+    def get_many(self, model_id: str, inputs: List[str]) -> Dict[str, str]:
+        """
+        Get cached translations.
+
+        :param model_id: Model identity.
+        :param inputs: Input sequences.
+        :returns: Dictionary of input sequence to cached translation, for cached inputs only.
+        """
+
+        keys = {self.__key(model_id, i): i for i in inputs}
+        translations = dict()
+
+        with self.__lock:
+            key_list = list(keys)
+
+            # Stay below SQLite's host parameter limit
+            for start in range(0, len(key_list), 500):
+                chunk = key_list[start:start + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self.__conn.execute(
+                    f'SELECT key, translation FROM translations WHERE key IN ({placeholders})', chunk).fetchall()
+
+                for key, translation in rows:
+                    translations[keys[key]] = translation
+
+                # Mark hits as recently used
+                self.__conn.executemany('UPDATE translations SET last_used = ? WHERE key = ?',
+                                        [(time.time(), key) for key, _ in rows])
+
+            self.__conn.commit()
+
+        self.hits += len(translations)
+        self.misses += len(keys) - len(translations)
+
+        return translations
+
+    def put_many(self, model_id: str, translations: Dict[str, str]):
+        """
+        Cache translations, evicting the least recently used entries if the cache is full.
+
+        :param model_id: Model identity.
+        :param translations: Dictionary of input sequence to translation.
+        """
+
+        if not translations:
+            return
+
+        now = time.time()
+
+        with self.__lock:
+            self.__conn.executemany(
+                'INSERT OR REPLACE INTO translations (key, translation, last_used) VALUES (?, ?, ?)',
+                [(self.__key(model_id, i), t, now) for i, t in translations.items()])
+
+            count = self.__conn.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+            if count > self.max_entries:
+                self.__conn.execute(
+                    'DELETE FROM translations WHERE key IN '
+                    '(SELECT key FROM translations ORDER BY last_used LIMIT ?)', (count - self.max_entries,))
+
+            self.__conn.commit()
+
+    def __len__(self):
+        with self.__lock:
+            return self.__conn.execute('SELECT COUNT(*) FROM translations').fetchone()[0]
+
+    def close(self):
+        """Close the database connection."""
+
+        self.__conn.close()
@@ -1,12 +1,21 @@
 import argparse
+import json
+import os
+from os import path
 
+from cli import log
 from cli_constants import DEFAULT_HYPERPARAMS
 from theory.lvp import LVP
-from theory.nn.brain import Brain
+from theory.nn.brain import Brain, PRECISIONS
+from theory.nn.datasets import DUPLICATE_WEIGHTINGS, LONG_ROWS, load_sources, prepare_dataset
 from theory.nn.hyperparams import Hyperparams
 
 # Get command line arguments
 parser = argparse.ArgumentParser()
+parser.add_argument('command', nargs='?', choices=['train', 'prepare', 'preprocess'], default='train',
+                    help='"train" to train the model (default), "prepare" to deduplicate and length filter the '
+                         'training dataset, or "preprocess" to encode the datasets into sharded TFRecord files used by '
+                         'subsequent training runs')
 parser.add_argument('--base-data-path',
                     help='Base dataset path (e.g. "data")', default='data')
 parser.add_argument('--train-data', help='Training dataset file path')
@@ -30,10 +39,99 @@ parser.add_argument('--heads', help='Number of attention heads',
                     type=int, default=DEFAULT_HYPERPARAMS.num_heads)
 parser.add_argument('--dropout', help='Dropout rate',
                     type=float, default=DEFAULT_HYPERPARAMS.dropout_rate)
+parser.add_argument('--max-seq-len', help='Max encoded sequence length, which sizes the positional encoding tables',
+                    type=int, default=DEFAULT_HYPERPARAMS.max_seq_len)
+parser.add_argument('--bucket-boundaries',
+                    help='Comma-separated sequence length bucket boundaries (e.g. "8,16,32,64"). When set, batches '
+                         'are bucketed by length, with a batch size per bucket')
+parser.add_argument('--tokens-per-batch', help='Target number of tokens per bucketed batch', type=int)
+parser.add_argument('--accumulation-steps',
+                    help='Number of micro-batches to accumulate gradients over per optimizer step',
+                    type=int, default=DEFAULT_HYPERPARAMS.accumulation_steps)
+parser.add_argument('--precision', choices=PRECISIONS, help='Mixed precision policy',
+                    default=DEFAULT_HYPERPARAMS.precision)
+parser.add_argument('--validation-interval',
+                    help='Number of optimizer steps between validation passes (defaults to the end of every epoch)',
+                    type=int)
+parser.add_argument('--patience',
+                    help='Number of validation passes without improvement before training stops early', type=int)
+parser.add_argument('--checkpoint-interval',
+                    help='Number of optimizer steps between checkpoints, in addition to the end of every epoch',
+                    type=int)
+parser.add_argument('--min-delta', help='Minimum decrease of the validation loss that counts as an improvement',
+                    type=float, default=DEFAULT_HYPERPARAMS.early_stopping_min_delta)
+parser.add_argument('--max-steps', help='Total number of optimizer steps to stop training after', type=int)
+parser.add_argument('--max-time', help='Number of seconds to stop training after', type=float)
+parser.add_argument('--benchmark-samples',
+                    help='Number of validation sequences to measure the decoding latency of the trained model on',
+                    type=int)
+parser.add_argument('--teacher',
+                    help='Trained model directory to distill into the (usually smaller) model being trained. Its '
+                         'tokenizer vocabularies are reused')
+parser.add_argument('--distillation-alpha',
+                    help='Weight of the loss on the training targets when distilling, versus the teacher\'s '
+                         'predictions',
+                    type=float, default=DEFAULT_HYPERPARAMS.distillation_alpha)
+parser.add_argument('--distillation-temperature', help='Softmax temperature of the predictions when distilling',
+                    type=float, default=DEFAULT_HYPERPARAMS.distillation_temperature)
+parser.add_argument('--distillation-samples',
+                    help='Number of validation sequences to compare the student and teacher models on',
+                    type=int, default=256)
+parser.add_argument('--prune',
+                    help='Trained model directory to prune into the model being trained, which then fine-tunes it. '
+                         'Its architecture and tokenizer vocabularies are reused')
+parser.add_argument('--prune-heads', help='Fraction of the attention heads of every layer to prune', type=float,
+                    default=0.0)
+parser.add_argument('--prune-ffn', help='Fraction of the feed-forward network hidden units of every layer to prune',
+                    type=float, default=0.0)
+parser.add_argument('--prune-samples',
+                    help='Number of validation sequences to compare the pruned and original models on',
+                    type=int, default=256)
+parser.add_argument('--distribution-strategy', choices=['mirrored', 'multi_worker_mirrored'],
+                    help='Distribution strategy for data-parallel training. "multi_worker_mirrored" reads the cluster '
+                         'from the TF_CONFIG environment variable')
+parser.add_argument('--metrics-interval',
+                    help='Number of batches to aggregate throughput metrics over before they are logged', type=int,
+                    default=10)
+parser.add_argument('--metrics-path',
+                    help='JSONL file to append throughput metrics to (defaults to "train_metrics.jsonl" in the output '
+                         'directory)')
+parser.add_argument('--profile-batches',
+                    help='First and last batch to capture a profiler trace of (e.g. "100,110"), saved to "profile" in '
+                         'the output directory')
 parser.add_argument('--disable-wandb', help='Whether to enable Weights & Biases (wandb) integration',
                     action='store_true')
+parser.add_argument('--export-dir', help='Directory to export the serving model to after training')
+parser.add_argument('--export-only',
+                    help='Whether to skip training and only export the best checkpoint (or latest, if it has not been '
+                         'validated), with the model architecture saved alongside it', action='store_true')
+parser.add_argument('--vocab-sample-size',
+                    help='Number of training examples randomly sampled to build the tokenizer vocabularies from, if '
+                         'they don\'t exist yet (defaults to all)', type=int)
+parser.add_argument('--max-length',
+                    help='Max length of a training example\'s source and target in characters, when preparing the '
+                         'training dataset', type=int)
+parser.add_argument('--long-rows', choices=LONG_ROWS,
+                    help='Whether to drop training examples beyond "--max-length", or split them into examples of '
+                         'consecutive aligned lines', default='drop')
+parser.add_argument('--duplicate-weighting', choices=list(DUPLICATE_WEIGHTINGS),
+                    help='Number of copies kept of duplicate training examples, as a function of their count '
+                         '(defaults to a single copy)')
+parser.add_argument('--shards', help='Number of shards per preprocessed dataset', type=int, default=8)
+parser.add_argument('--quantize',
+                    help='Whether to export an INT8 quantized greedy decoder with the serving model, for faster CPU '
+                         'inference', action='store_true')
+parser.add_argument('--quantize-samples',
+                    help='Number of validation sequences to compare the float and quantized models on',
+                    type=int, default=256)
 args = parser.parse_args()
 
+if args.export_only and args.export_dir is None:
+    raise Exception('"--export-dir" is required when using "--export-only".')
+
+if args.quantize and args.export_dir is None:
+    raise Exception('"--export-dir" is required when using "--quantize".')
+
 # Get LVP from args
 lvp = None
 
@@ -42,6 +140,25 @@ try:
 except Exception:
     raise Exception(f'Unknown language-version pair "{args.lvp}".')
 
+# Prepare training dataset, before tokenizers are built from it
+if args.command == 'prepare':
+    train_dataset_path = args.train_data if args.train_data is not None else \
+        path.join(args.base_data_path, f'{lvp.value.lower()}_train.csv')
+    prepared_dataset_path = path.join(args.out, 'prepared_train.csv')
+    os.makedirs(args.out, exist_ok=True)
+
+    log(f'Preparing training dataset "{train_dataset_path}"...')
+    stats = prepare_dataset(train_dataset_path, prepared_dataset_path, max_length=args.max_length,
+                            long_rows=args.long_rows, duplicate_weighting=args.duplicate_weighting)
+
+    with open(path.join(args.out, 'prepared_train_stats.json'), 'w') as file:
+        json.dump(stats, file, indent=2)
+
+    log(f'Prepared {stats["output_examples"]} examples from {stats["rows"]} rows '
+        f'({stats["duplicate_examples"]} duplicates, {stats["split_rows"]} split and {stats["dropped_rows"]} dropped '
+        f'long rows) into "{prepared_dataset_path}".')
+    exit()
+
 # Initialize Theory
 brain = Brain(
     lvp,
@@ -54,16 +171,84 @@ brain = Brain(
         dff=args.dff,
         num_heads=args.heads,
         dropout_rate=args.dropout,
+        max_seq_len=args.max_seq_len,
+        bucket_boundaries=[int(b) for b in args.bucket_boundaries.split(',')] if args.bucket_boundaries else None,
+        tokens_per_batch=args.tokens_per_batch,
+        accumulation_steps=args.accumulation_steps,
+        precision=args.precision,
+        validation_interval=args.validation_interval,
+        early_stopping_patience=args.patience,
+        early_stopping_min_delta=args.min_delta,
+        checkpoint_interval=args.checkpoint_interval,
+        distillation_alpha=args.distillation_alpha,
+        distillation_temperature=args.distillation_temperature,
     ),
     base_dataset_path=args.base_data_path,
     model_dir_path=args.out,
     train_dataset_path=args.train_data,
     valid_dataset_path=args.valid_data,
     enable_wandb=not args.disable_wandb,
+    # Exporting only needs the tokenizers and the saved model config, not the datasets or the architecture flags
+    inference=args.export_only,
+    distribution_strategy=args.distribution_strategy,
+    vocab_sample_size=args.vocab_sample_size,
+    teacher_model_path=args.teacher,
+    prune_model_path=args.prune,
+    prune_head_fraction=args.prune_heads,
+    prune_ffn_fraction=args.prune_ffn,
 )
 
-# Restore latest checkpoint
-brain.restore_checkpoint()
+# Preprocess datasets
+if args.command == 'preprocess':
+    brain.preprocess(num_shards=args.shards)
+    exit()
+
+# Restore latest checkpoint to resume training, or the best one if only exporting
+brain.restore_checkpoint(best=args.export_only)
 
 # Train
-brain.train()
+if not args.export_only:
+    profile_batches = tuple(int(b) for b in args.profile_batches.split(',')) if args.profile_batches else None
+    brain.train(metrics_interval=args.metrics_interval, metrics_path=args.metrics_path,
+                profile_batches=profile_batches, max_steps=args.max_steps, max_time=args.max_time)
+
+# Compare the distilled model to its teacher
+if args.teacher is not None and not args.export_only:
+    distillation_report = brain.distillation_report(
+        load_sources(brain.valid_dataset_path, limit=args.distillation_samples))
+
+    with open(path.join(args.out, 'distillation_report.json'), 'w') as file:
+        json.dump(distillation_report, file, indent=2)
+
+# Compare the pruned model to the original
+if args.prune is not None and not args.export_only:
+    pruning_report = brain.pruning_report(load_sources(brain.valid_dataset_path, limit=args.prune_samples))
+
+    with open(path.join(args.out, 'pruning_report.json'), 'w') as file:
+        json.dump(pruning_report, file, indent=2)
+
+# Measure decoding latency
+if args.benchmark_samples is not None:
+    sample_inputs = load_sources(brain.valid_dataset_path, limit=args.benchmark_samples)
+    _, latency = brain.benchmark_decode(sample_inputs)
+
+    with open(path.join(args.out, 'benchmark_report.json'), 'w') as file:
+        json.dump({
+            'samples': len(sample_inputs),
+            'latency_s': latency,
+            'sequences_per_sec': len(sample_inputs) / max(latency, 1e-9),
+        }, file, indent=2)
+
+# Quantize
+quantization_report = None
+
+if args.quantize:
+    quantization_report = brain.quantize(load_sources(brain.valid_dataset_path, limit=args.quantize_samples))
+
+# Export serving model
+if args.export_dir is not None:
+    brain.export(args.export_dir)
+
+    if quantization_report is not None:
+        with open(path.join(args.export_dir, 'quantization_report.json'), 'w') as file:
+            json.dump(quantization_report, file, indent=2)